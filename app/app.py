@@ -4,12 +4,13 @@ from werkzeug.exceptions import HTTPException
 
 import json
 import flask
+from typing import Dict
 import socket
 import logging
 import os
 
 from flask_sock import Sock
-from flask import request, abort, jsonify, g
+from flask import request, abort, jsonify, g, stream_with_context
 
 import app.lib.redis as redis_lib
 from app.lib.name_sentiments import UserSentiments
@@ -22,13 +23,24 @@ from app.lib import session_id as sid
 from app.lib import origin_and_meaning as osm
 from app.lib.common import canonicalize_gender, canonicalize_name
 from app.lib import name_rating as nr
+from app.lib import dataset_registry
 
 import app.procedure.suggest_names as suggest_names_proc
+from app.openai_lib import chat_completion as cc
 
 app = flask.Flask(__name__)
 app.config['JSON_SORT_KEYS'] = False
 sock = Sock(app)
 
+# the datasets are loaded on first use; DATASET_WARM_UP controls whether they are loaded ahead of the
+# first request: 'background' (default), 'sync' (before serving) or 'none'. gunicorn.sh uses 'sync', so the
+# datasets are loaded in the master process and shared by the forked workers
+dataset_warm_up = os.environ.get('DATASET_WARM_UP', 'background')
+if dataset_warm_up == 'background':
+    dataset_registry.start_warm_up()
+elif dataset_warm_up == 'sync':
+    dataset_registry.warm_up()
+
 
 @app.before_request
 def logging_before():
@@ -143,7 +155,7 @@ def get_name_facts():
     if rank < 100000:
         output['rank'] = rank
 
-    feature_scores = nr.NAME_RATING.get_feature_scores(name, gender)
+    feature_scores = nr.NAME_RATING.get_feature_scores_batch([name], gender).get(name, {})
     if feature_scores:
         output['features'] = feature_scores
 
@@ -195,6 +207,64 @@ def suggest_names():
     return jsonify(resp_dict)
 
 
+@app.route("/babyname/suggest_stream")
+def suggest_names_stream():
+    """
+    The Server-Sent Events variant of /babyname/suggest, which accepts the same URL parameters and sends each
+    suggested name as soon as it is proposed:
+    - event "name" for each name, with data like {"name": "Mike"}
+    - event "done" at the end, with the same data as the response of /babyname/suggest
+    - event "error" if the names can not be suggested, after which the stream is closed
+    """
+    session_id = request.args.get('session_id', default="", type=str)
+    if not session_id or not sid.verify_session_id(session_id):
+        abort(400, "missing or invalid session id: {}".format(session_id))
+    gender = request.args.get(np.GenderPref.get_url_param_name(), default="", type=str)
+    gender = canonicalize_gender(gender)
+    if not gender:
+        abort(400, "missing the required parameter of gender")
+
+    # update user preferences
+    pref_resp_msg = update_user_pref(func_call=True, delete_before_updating=True)
+
+    # Update user sentiments
+    update_user_sentiments(func_call=True)
+
+    # if user preference is not updated and there is previous proposals, use the previous proposals
+    last_proposals = []
+    if 'no-op' in pref_resp_msg.get('msg', ''):
+        last_proposals = redis_lib.get_displayed_names(session_id, max_count=20)
+
+    def generate():
+        start_ts = time.time()
+        suggested_names = []
+        try:
+            names = iter(last_proposals) if last_proposals else \
+                suggest_names_proc.stream_suggest(session_id, gender, filter_displayed_names=False)
+            for name in names:
+                if not suggested_names:
+                    logging.info('Sent the first recommended name after {} seconds'.format(time.time() - start_ts))
+                suggested_names.append(name)
+                yield format_server_sent_event('name', {'name': name})
+        except Exception as e:
+            logging.exception(e, exc_info=True)
+            yield format_server_sent_event('error', {'error': 'Failed to suggest names'})
+            return
+
+        logging.info('Compute recommended name using {} seconds'.format(time.time() - start_ts))
+        yield format_server_sent_event('done', {
+            'suggested_names': suggested_names,
+            'page_no': 0
+        })
+
+    return flask.Response(stream_with_context(generate()), mimetype='text/event-stream',
+                          headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+def format_server_sent_event(event: str, data) -> str:
+    return 'event: {event}\ndata: {data}\n\n'.format(event=event, data=json.dumps(data))
+
+
 @app.route("/babyname/refresh")
 def suggest_more():
     session_id = request.args.get('session_id', default="", type=str)
@@ -257,16 +327,8 @@ def update_user_pref(func_call=False, delete_before_updating=False):
         else:
             abort(400, "missing or invalid session id: {}".format(session_id))
 
-    # Parse parameters
-    all_prefs = {}
-    for pref_class in np.ALL_PREFERENCES:
-        val = request.args.get(pref_class.get_url_param_name(), default="", type=str)
-        if not val:
-            continue
-        all_prefs[pref_class.get_url_param_name()] = val
-    logging.info('[data] Preferences from session {} is: {}'.format(session_id, json.dumps(all_prefs)))
-
-    if not all_prefs or (len(all_prefs) == 1 and all_prefs.get(np.GenderPref.get_url_param_name(), None)):
+    all_prefs = parse_user_prefs(session_id, request.args)
+    if is_no_op_pref_update(all_prefs):
         resp = {"msg": "success; no-op"}
         return json.dumps(resp) if not func_call else resp
 
@@ -277,6 +339,25 @@ def update_user_pref(func_call=False, delete_before_updating=False):
     return jsonify({"msg": "success"}) if not func_call else resp
 
 
+def parse_user_prefs(session_id: str, args) -> Dict[str, str]:
+    """
+    :param args: the URL parameters of the request
+    :return: the serialized preferences in the URL parameters, keyed by their URL parameter names
+    """
+    all_prefs = {}
+    for pref_class in np.ALL_PREFERENCES:
+        val = args.get(pref_class.get_url_param_name(), default="", type=str)
+        if not val:
+            continue
+        all_prefs[pref_class.get_url_param_name()] = val
+    logging.info('[data] Preferences from session {} is: {}'.format(session_id, json.dumps(all_prefs)))
+    return all_prefs
+
+
+def is_no_op_pref_update(all_prefs: Dict[str, str]) -> bool:
+    return not all_prefs or (len(all_prefs) == 1 and np.GenderPref.get_url_param_name() in all_prefs)
+
+
 @app.route("/babyname/get_user_pref")
 def get_user_pref():
     """
@@ -398,10 +479,64 @@ def list_ip():
     try:
         host_name = socket.gethostname()
         host_ip = socket.gethostbyname(host_name)
-        return flask.render_template('index.html', host_name, host_ip)
-    except:
+        return jsonify(host_name=host_name, host_ip=host_ip)
+    except Exception as e:
+        logging.exception(e)
         return flask.render_template('error.html')
 
 
+def get_health_status():
+    """
+    :return: a tuple of whether the pod is ready to serve, and a dict of the status of the datasets and Redis;
+    the datasets are not loaded by this function
+    """
+    datasets = dataset_registry.get_status()
+    output = {
+        'datasets': datasets
+    }
+    datasets_ready = all(x['loaded'] for x in datasets.values())
+
+    redis_ready = True
+    try:
+        output['redis'] = {'latency_ms': redis_lib.get_ping_latency_ms()}
+    except Exception as e:
+        logging.warning('Failed to ping Redis: {}'.format(e))
+        output['redis'] = {'error': str(e)}
+        redis_ready = False
+
+    faiss_search = dataset_registry.get_dataset('faiss_search')
+    if faiss_search.is_loaded():
+        output['faiss_index_size'] = faiss_search.get_index_sizes()
+
+    output['proposed_names_cache'] = cc.PROPOSED_NAMES_CACHE_STATS.to_dict()
+
+    ready = datasets_ready and redis_ready
+    output['status'] = 'ready' if ready else 'not ready'
+    return ready, output
+
+
+@app.route("/healthz")
+def healthz():
+    """
+    liveness probe: the process is able to serve requests; the status of the datasets is reported but does not
+    fail the probe, because a restart would not help a pod which is still loading data. Redis is not checked, so
+    an unresponsive Redis does not get the pods restarted
+    """
+    return jsonify({
+        'status': 'alive',
+        'datasets': dataset_registry.get_status()
+    })
+
+
+@app.route("/readyz")
+def readyz():
+    """
+    readiness probe: all datasets are loaded and Redis is reachable; otherwise 503, so no traffic is routed
+    to the pod
+    """
+    ready, output = get_health_status()
+    return jsonify(output), 200 if ready else 503
+
+
 if __name__ == "__main__":
     app.run(host='0.0.0.0', port=8080)
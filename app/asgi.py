@@ -0,0 +1,263 @@
+"""
+The ASGI entry point of the app, for the async serving mode (SERVING_MODE=asgi in gunicorn.sh):
+
+    gunicorn -w 2 -k uvicorn.workers.UvicornWorker app.asgi:app
+
+/babyname/suggest and /babyname/refresh, which wait for ChatGPT for seconds, are served by coroutines which use
+AsyncOpenAI and redis.asyncio, so a worker process holds hundreds of such requests at the same time instead of one.
+/babyname/suggest_stream is served by a coroutine as well, which sends the Server-Sent Events as ChatGPT streams
+the names. The other endpoints are fast, and are served by the Flask app (app.app) through asgiref, in the threads of
+WSGI_EXECUTOR rather than the single thread asgiref runs them in by default, so a slow request does not hold the
+others; the websocket endpoint of the Flask app is only available in the WSGI mode.
+"""
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl
+
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+from werkzeug.datastructures import MultiDict
+from werkzeug.exceptions import HTTPException, abort
+
+import app.app as flask_app
+import app.lib.redis_async as redis_async
+import app.procedure.suggest_names as suggest_names_proc
+from app.lib import name_pref as np
+from app.lib import session_id as sid
+from app.lib.common import canonicalize_gender
+from app.lib.name_sentiments import UserSentiments
+
+# the threads which serve the endpoints of the Flask app
+WSGI_EXECUTOR = ThreadPoolExecutor(max_workers=8, thread_name_prefix='asgi-wsgi')
+
+
+class ThreadPoolWsgiToAsgiInstance(WsgiToAsgiInstance):
+    run_wsgi_app = sync_to_async(WsgiToAsgiInstance.__dict__['run_wsgi_app'].func, thread_sensitive=False,
+                                 executor=WSGI_EXECUTOR)
+
+
+class ThreadPoolWsgiToAsgi(WsgiToAsgi):
+    """
+    WsgiToAsgi which runs the WSGI app in WSGI_EXECUTOR, rather than in the single thread-sensitive thread
+    """
+    async def __call__(self, scope, receive, send):
+        await ThreadPoolWsgiToAsgiInstance(self.wsgi_application, self.duplicate_header_limit)(scope, receive, send)
+
+
+wsgi_app = ThreadPoolWsgiToAsgi(flask_app.app)
+
+
+async def suggest_names(args: MultiDict):
+    """
+    the async variant of app.app.suggest_names(), which accepts the same URL parameters
+    """
+    session_id = args.get('session_id', default="", type=str)
+    if not session_id or not sid.verify_session_id(session_id):
+        abort(400, "missing or invalid session id: {}".format(session_id))
+    gender = canonicalize_gender(args.get(np.GenderPref.get_url_param_name(), default="", type=str))
+    if not gender:
+        abort(400, "missing the required parameter of gender")
+
+    # update user preferences
+    all_prefs = flask_app.parse_user_prefs(session_id, args)
+    no_op = flask_app.is_no_op_pref_update(all_prefs)
+    if not no_op:
+        await redis_async.update_user_pref(session_id, np.str_dict_to_class_dict(all_prefs),
+                                           delete_before_updating=True)
+
+    # Update user sentiments
+    await update_user_sentiments(session_id, args)
+
+    # if user preference is not updated and there is previous proposals, use the previous proposals
+    if no_op:
+        last_proposals = await redis_async.get_displayed_names(session_id, max_count=20)
+        if last_proposals:
+            return last_proposals
+
+    start_ts = time.time()
+    suggested_names = await suggest_names_proc.suggest_async(session_id, gender, filter_displayed_names=False)
+    logging.info('Compute recommended name using {} seconds'.format(time.time() - start_ts))
+
+    return {
+        'suggested_names': suggested_names,
+        'page_no': 0
+    }
+
+
+async def suggest_more(args: MultiDict):
+    """
+    the async variant of app.app.suggest_more(), which accepts the same URL parameters
+    """
+    session_id = args.get('session_id', default="", type=str)
+    if not session_id or not sid.verify_session_id(session_id):
+        abort(400, "missing or invalid session id: {}".format(session_id))
+    gender = canonicalize_gender(args.get(np.GenderPref.get_url_param_name(), default="", type=str))
+    if not gender:
+        abort(400, "missing the required parameter of gender")
+
+    # Update user sentiments
+    await update_user_sentiments(session_id, args)
+
+    start_ts = time.time()
+    suggested_names = await suggest_names_proc.suggest_async(session_id, gender, filter_displayed_names=True)
+    logging.info('Compute recommended name using {} seconds'.format(time.time() - start_ts))
+
+    return {
+        'suggested_names': suggested_names,
+        'page_no': 0
+    }
+
+
+async def suggest_names_stream(args: MultiDict):
+    """
+    the async variant of app.app.suggest_names_stream(), which accepts the same URL parameters
+    :return: the async iterator of the events, once the parameters are validated and the preferences are updated
+    """
+    session_id = args.get('session_id', default="", type=str)
+    if not session_id or not sid.verify_session_id(session_id):
+        abort(400, "missing or invalid session id: {}".format(session_id))
+    gender = canonicalize_gender(args.get(np.GenderPref.get_url_param_name(), default="", type=str))
+    if not gender:
+        abort(400, "missing the required parameter of gender")
+
+    # update user preferences
+    all_prefs = flask_app.parse_user_prefs(session_id, args)
+    no_op = flask_app.is_no_op_pref_update(all_prefs)
+    if not no_op:
+        await redis_async.update_user_pref(session_id, np.str_dict_to_class_dict(all_prefs),
+                                           delete_before_updating=True)
+
+    # Update user sentiments
+    await update_user_sentiments(session_id, args)
+
+    # if user preference is not updated and there is previous proposals, use the previous proposals
+    last_proposals = []
+    if no_op:
+        last_proposals = await redis_async.get_displayed_names(session_id, max_count=20)
+
+    return generate_suggest_events(session_id, gender, last_proposals)
+
+
+async def generate_suggest_events(session_id: str, gender, last_proposals):
+    start_ts = time.time()
+    suggested_names = []
+    try:
+        if last_proposals:
+            suggested_names = last_proposals
+            for name in last_proposals:
+                yield flask_app.format_server_sent_event('name', {'name': name})
+        else:
+            async for name in suggest_names_proc.stream_suggest_async(session_id, gender,
+                                                                      filter_displayed_names=False):
+                if not suggested_names:
+                    logging.info('Sent the first recommended name after {} seconds'.format(time.time() - start_ts))
+                suggested_names.append(name)
+                yield flask_app.format_server_sent_event('name', {'name': name})
+    except Exception as e:
+        logging.exception(e)
+        yield flask_app.format_server_sent_event('error', {'error': 'Failed to suggest names'})
+        return
+
+    logging.info('Compute recommended name using {} seconds'.format(time.time() - start_ts))
+    yield flask_app.format_server_sent_event('done', {
+        'suggested_names': suggested_names,
+        'page_no': 0
+    })
+
+
+async def update_user_sentiments(session_id: str, args: MultiDict):
+    sentiments_str = args.get(UserSentiments.get_url_param_name(), default="", type=str)
+    if not sentiments_str:
+        return
+
+    logging.info('[data] sentiments from session {}: {}'.format(session_id, sentiments_str))
+    await redis_async.update_user_sentiments(session_id, UserSentiments.create(sentiments_str))
+
+
+ASYNC_ROUTES = {
+    '/babyname/suggest': suggest_names,
+    '/babyname/refresh': suggest_more
+}
+
+STREAM_ROUTES = {
+    '/babyname/suggest_stream': suggest_names_stream
+}
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await handle_lifespan(receive, send)
+    elif scope['type'] == 'websocket':
+        await send({'type': 'websocket.close', 'code': 1000})
+    elif scope['type'] == 'http' and scope['method'] == 'GET' and scope['path'] in ASYNC_ROUTES:
+        await handle_async_route(ASYNC_ROUTES[scope['path']], scope, send)
+    elif scope['type'] == 'http' and scope['method'] == 'GET' and scope['path'] in STREAM_ROUTES:
+        await handle_stream_route(STREAM_ROUTES[scope['path']], scope, send)
+    else:
+        await wsgi_app(scope, receive, send)
+
+
+async def handle_async_route(handler, scope, send):
+    start_ts = time.perf_counter()
+    args = MultiDict(parse_qsl(scope['query_string'].decode('latin-1'), keep_blank_values=True))
+    try:
+        output, code = await handler(args), 200
+    except Exception as e:
+        code, output = get_error_response(e)
+
+    await send_json_response(send, code, output)
+
+    logging.info('End latency of request ({endpoint}) is {latency}ms.'.format(
+        endpoint=scope['path'], latency=int((time.perf_counter() - start_ts) * 1000)))
+
+
+async def handle_stream_route(handler, scope, send):
+    start_ts = time.perf_counter()
+    args = MultiDict(parse_qsl(scope['query_string'].decode('latin-1'), keep_blank_values=True))
+    try:
+        events = await handler(args)
+    except Exception as e:
+        await send_json_response(send, *get_error_response(e))
+        return
+
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [(b'content-type', b'text/event-stream; charset=utf-8'), (b'cache-control', b'no-cache'),
+                    (b'x-accel-buffering', b'no')]
+    })
+    async for event in events:
+        await send({'type': 'http.response.body', 'body': event.encode('utf-8'), 'more_body': True})
+    await send({'type': 'http.response.body', 'body': b''})
+
+    logging.info('End latency of request ({endpoint}) is {latency}ms.'.format(
+        endpoint=scope['path'], latency=int((time.perf_counter() - start_ts) * 1000)))
+
+
+def get_error_response(e: Exception):
+    # the same response as app.app.handle_error()
+    logging.exception(e)
+    code = e.code if isinstance(e, HTTPException) else 500
+    return code, {'error': str(e)}
+
+
+async def send_json_response(send, code: int, output):
+    body = json.dumps(output).encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': code,
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode('latin-1'))]
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def handle_lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
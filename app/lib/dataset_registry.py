@@ -0,0 +1,159 @@
+"""
+A registry of the datasets in app.lib, which are loaded lazily on first use.
+
+Each dataset module exposes its singleton (e.g. NAME_STATISTICS) as a LazyDataset, which behaves like
+the dataset object but only loads the data files when one of its attributes is accessed for the first time.
+So importing app.app or the worker is cheap, and a process only pays for the datasets it actually uses.
+- warm_up() / start_warm_up() load the registered datasets ahead of the first request, either in the
+  calling thread or in a background thread. Under gunicorn --preload, warm_up() completes in the master before
+  the workers are forked, so the workers share the loaded datasets (copy-on-write) instead of loading their own.
+- is_ready() tells whether all registered datasets are loaded, which is exposed for the readiness probe.
+- The datasets which intern names depend on NAME_STATISTICS, so the names of the SSA snapshot always get
+  the first ids of NAME_VOCABULARY whatever dataset is accessed first.
+"""
+import logging
+import os
+import threading
+import time
+
+from typing import Any, Callable, Dict, Iterable, Optional, Sequence
+
+
+class LazyDataset:
+
+    def __init__(self, name: str, factory: Callable[[], Any], depends_on: Sequence['LazyDataset'] = ()):
+        # the attributes are prefixed, and the methods are named, to not shadow those of the loaded dataset
+        self._lazy_name = name
+        self._lazy_factory = factory
+        self._lazy_depends_on = tuple(depends_on)
+        self._lazy_lock = threading.RLock()
+        self._lazy_value = None
+        self._lazy_load_time_ms = None
+
+    def load_dataset(self) -> Any:
+        """
+        :return: the dataset object, which is loaded if it has not been
+        """
+        value = self._lazy_value
+        if value is not None:
+            return value
+
+        for dependency in self._lazy_depends_on:
+            dependency.load_dataset()
+
+        with self._lazy_lock:
+            if self._lazy_value is None:
+                start_ts = time.perf_counter()
+                self._lazy_value = self._lazy_factory()
+                self._lazy_load_time_ms = int((time.perf_counter() - start_ts) * 1000)
+                logging.info('Loaded dataset {name} in {latency}ms'.format(
+                    name=self._lazy_name, latency=self._lazy_load_time_ms))
+            return self._lazy_value
+
+    def is_loaded(self) -> bool:
+        return self._lazy_value is not None
+
+    def get_load_time_ms(self) -> Optional[int]:
+        """
+        :return: how long the dataset took to load, or None if it is not loaded
+        """
+        return self._lazy_load_time_ms
+
+    def __getattr__(self, item):
+        # only called for the attributes which are not found on the proxy itself
+        if item.startswith('_lazy_'):
+            raise AttributeError(item)
+        return getattr(self.load_dataset(), item)
+
+    def __repr__(self):
+        return 'LazyDataset({name}, loaded={loaded})'.format(name=self._lazy_name, loaded=self.is_loaded())
+
+    def _reset_lock(self):
+        self._lazy_lock = threading.RLock()
+
+
+_DATASETS: Dict[str, LazyDataset] = {}
+
+
+def register(name: str, factory: Callable[[], Any], depends_on: Sequence[LazyDataset] = ()) -> LazyDataset:
+    """
+    :param name: the unique name of the dataset
+    :param factory: the callable which loads the dataset
+    :param depends_on: the datasets which must be loaded before this one
+    :return: the lazy proxy of the dataset, which is expected to be assigned to the module-level singleton
+    """
+    if name in _DATASETS:
+        raise ValueError('Dataset {} is already registered'.format(name))
+
+    dataset = LazyDataset(name, factory, depends_on)
+    _DATASETS[name] = dataset
+    return dataset
+
+
+def get_dataset(name: str) -> LazyDataset:
+    return _DATASETS[name]
+
+
+def warm_up(names: Optional[Iterable[str]] = None) -> bool:
+    """
+    load the given datasets, or all registered datasets, in the calling thread
+
+    :return: True if all datasets are loaded; a dataset failing to load is logged and skipped
+    """
+    names = list(_DATASETS.keys()) if names is None else list(names)
+    start_ts = time.perf_counter()
+    all_loaded = True
+    for name in names:
+        try:
+            _DATASETS[name].load_dataset()
+        except Exception as e:
+            logging.exception('Failed to load dataset {}: {}'.format(name, e))
+            all_loaded = False
+
+    logging.info('Warmed up {count} datasets in {latency}ms'.format(
+        count=len(names), latency=int((time.perf_counter() - start_ts) * 1000)))
+    return all_loaded
+
+
+def start_warm_up(names: Optional[Iterable[str]] = None) -> threading.Thread:
+    """
+    load the given datasets, or all registered datasets, in a daemon thread; it is meant for a process which
+    serves requests itself. A child forked before the thread completes (e.g. gunicorn with --preload) does not
+    inherit the thread, and loads the remaining datasets on first use
+    """
+    names = list(_DATASETS.keys()) if names is None else list(names)
+    thread = threading.Thread(target=warm_up, args=(names,), name='dataset-warm-up', daemon=True)
+    thread.start()
+    return thread
+
+
+def is_ready() -> bool:
+    """
+    :return: whether all registered datasets are loaded
+    """
+    return all(dataset.is_loaded() for dataset in _DATASETS.values())
+
+
+def get_status() -> Dict[str, Dict[str, Any]]:
+    """
+    :return: for each registered dataset, whether it is loaded and how long it took to load
+    """
+    return {
+        name: {
+            'loaded': dataset.is_loaded(),
+            'load_time_ms': dataset.get_load_time_ms()
+        }
+        for name, dataset in _DATASETS.items()
+    }
+
+
+def _after_fork_in_child():
+    """
+    the locks may be held by the warm-up thread of the parent process, which does not exist in the child
+    """
+    for dataset in _DATASETS.values():
+        dataset._reset_lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
@@ -1,6 +1,6 @@
 import logging
 import time
-from typing import Union, List, Dict
+from typing import Union, List, Dict, Tuple
 
 import faiss
 import os
@@ -8,40 +8,71 @@ import json
 
 import numpy as np
 from app.lib.common import Gender, get_app_root_dir, canonicalize_gender, canonicalize_name
+from app.lib.dataset_registry import register
+from app.lib.name_vocabulary import NAME_VOCABULARY, NO_ID, get_by_id
+import app.lib.name_statistics as ns
 import app.openai_lib.embedding_client as embedding_client
 
 
+# the index types which can be chosen when the index files are built; all of them use the inner product
+# of L2-normalized embeddings, i.e. the cosine similarity
+INDEX_TYPES = ['flat', 'hnsw', 'ivfpq']
+HNSW_NEIGHBORS = 32
+HNSW_EF_SEARCH = 64
+IVF_NPROBE = 16
+PQ_SUBQUANTIZERS = 32
+# the number of neighbours of each name in the precomputed neighbour tables, which covers the similar names
+# of a name of the same gender (excluding itself) up to NEIGHBOR_COUNT - 1
+NEIGHBOR_COUNT = 32
+
+
 class FaissSearch:
 
     def __init__(self):
         start_ts = time.time()
-        boy_name_list, boy_index, boy_name_embedding_dict = FaissSearch.build_index(Gender.BOY)
-        girl_name_list, girl_index, girl_name_embedding_dict = FaissSearch.build_index(Gender.GIRL)
+        boy_ids, boy_index = FaissSearch.build_index(Gender.BOY)
+        girl_ids, girl_index = FaissSearch.build_index(Gender.GIRL)
         logging.info('FaissSearch; loading time: {} seconds with {} boy records and {} girl records'.format(
-            time.time() - start_ts, len(boy_name_list), len(girl_name_list)
+            time.time() - start_ts, len(boy_ids), len(girl_ids)
         ))
-        self._name_list = {
-            Gender.BOY: boy_name_list,
-            Gender.GIRL: girl_name_list
+        # name id of each row of the index
+        self._ids = {
+            Gender.BOY: boy_ids,
+            Gender.GIRL: girl_ids
+        }
+        self._row_by_id = {
+            Gender.BOY: FaissSearch.create_row_by_id(Gender.BOY, boy_ids),
+            Gender.GIRL: FaissSearch.create_row_by_id(Gender.GIRL, girl_ids)
         }
         self._index = {
             Gender.BOY: boy_index,
             Gender.GIRL: girl_index
         }
-        self._name_embedding_dict = {
-            Gender.BOY: boy_name_embedding_dict,
-            Gender.GIRL: girl_name_embedding_dict
-        }
+        # (gender, target gender) -> (rows of the target index, similarity) of the top neighbours of each row
+        self._neighbors = FaissSearch.load_neighbors(self._index)
+
+    def get_index_sizes(self) -> Dict[str, int]:
+        """
+        :return: the number of vectors in the index of each gender
+        """
+        return {str(gender): int(index.ntotal) for gender, index in self._index.items()}
 
     def search(self, gender: Union[str, Gender], msg: str, num_of_result=10):
         gender = canonicalize_gender(gender)
         embedding = embedding_client.create_single_embedding(msg)
         return self.search_with_embedding(gender, embedding, num_of_result)
 
-    def get_embeddings(self, gender: Union[str, Gender], name: str):
+    def get_embeddings(self, gender: Union[str, Gender], name: str) -> np.ndarray:
+        """
+        :return: the normalized float32 embedding of the name, reconstructed from the index; or an empty
+        array if the name is not indexed
+        """
         gender = canonicalize_gender(gender)
         name = canonicalize_name(name)
-        return self._name_embedding_dict[gender].get(name, [])
+        row = get_by_id(self._row_by_id[gender], NAME_VOCABULARY.get_id(name, gender), NO_ID)
+        if row == NO_ID:
+            return np.empty(0, dtype=np.float32)
+        return self._index[gender].reconstruct(int(row))
 
     def similar_names(self, gender: Union[str, Gender],
                       name: str,
@@ -49,22 +80,78 @@ class FaissSearch:
                       num_of_result=10) -> Dict[str, float]:
         gender = canonicalize_gender(gender)
         target_gender = canonicalize_gender(target_gender)
-        name = canonicalize_name(name)
-        embedding = self._name_embedding_dict[gender].get(name, [])
-        if not embedding:
-            return []
+        if not target_gender:
+            target_gender = gender
+        return self.similar_names_batch([gender], [name], target_gender, num_of_result)
 
-        if target_gender and target_gender != gender:
-            # search for similar names as siblings
-            return self.search_with_embedding(target_gender, embedding, num_of_result)
+    def similar_names_batch(self, genders: List[Gender],
+                            names: List[str],
+                            target_gender: Union[str, Gender],
+                            num_of_result=10) -> Dict[str, float]:
+        """
+        the batched similar_names() of several names (e.g. siblings), which are looked up in the neighbour tables,
+        or searched on the index of the target gender at once if the tables are not available
+
+        :param genders: the gender of each name
+        :return: the similar names of target_gender, with the sum of their similarity to each name, from the
+        most similar one
+        """
+        target_gender = canonicalize_gender(target_gender)
+        query_genders = []
+        query_rows = []
+        for gender, name in zip(genders, names):
+            gender = canonicalize_gender(gender)
+            row = get_by_id(self._row_by_id[gender], NAME_VOCABULARY.get_id(canonicalize_name(name), gender), NO_ID)
+            if row != NO_ID:
+                query_genders.append(gender)
+                query_rows.append(row)
+        if not query_rows:
+            return {}
+
+        distances = []
+        result_ids = []
+        for gender in set(query_genders):
+            rows = np.asarray([row for x, row in zip(query_genders, query_rows) if x == gender], dtype=np.int64)
+            gender_distances, gender_ids = self._get_neighbors(gender, rows, target_gender, num_of_result + 1)
+            if gender == target_gender:
+                # a name is not similar to itself; like a search of num_of_result + 1 names without the name,
+                # which leaves num_of_result + 1 names if the name is not among them
+                keep = gender_ids != self._ids[gender][rows][:, np.newaxis]
+            else:
+                keep = np.ones(gender_ids.shape, dtype=bool)
+                keep[:, num_of_result] = False
+            keep &= gender_ids != NO_ID
+            distances.append(gender_distances[keep])
+            result_ids.append(gender_ids[keep])
+
+        unique_ids, inverse = np.unique(np.concatenate(result_ids), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(distances), minlength=len(unique_ids))
+        # ordered by the similarity, like the result of a search
+        order = np.argsort(-scores, kind='stable')
+        return dict(zip(NAME_VOCABULARY.get_names(unique_ids[order], target_gender), scores[order].tolist()))
+
+    def _get_neighbors(self, gender: Gender, rows: np.ndarray, target_gender: Gender, k: int):
+        """
+        :param rows: rows of the index of gender
+        :return: the similarity and the name id of the top k neighbours of each row in the index of target_gender;
+        the name id is NO_ID if there are less than k neighbours
+        """
+        neighbors = self._neighbors.get((gender, target_gender))
+        if neighbors is not None and k <= neighbors[0].shape[1]:
+            neighbor_rows, neighbor_distances = neighbors
+            indices = neighbor_rows[rows, :k]
+            distances = neighbor_distances[rows, :k].astype(np.float32)
         else:
-            result = self.search_with_embedding(gender, embedding, num_of_result + 1)
-            del result[name]
-            return result
+            embeddings = np.vstack([self._index[gender].reconstruct(int(row)) for row in rows])
+            distances, indices = self._index[target_gender].search(embeddings, k)
+
+        # faiss fills -1 if there are less results than requested
+        name_ids = np.where(indices >= 0, self._ids[target_gender][indices], NO_ID)
+        return distances, name_ids
 
-    def search_with_embedding(self, gender: Gender, embedding: List[float], num_of_result=10)\
+    def search_with_embedding(self, gender: Gender, embedding: Union[List[float], np.ndarray], num_of_result=10)\
             -> Dict[str, float]:
-        embedding_nparray = np.asarray([embedding])
+        embedding_nparray = np.asarray(embedding, dtype=np.float32).reshape(1, -1)
         start_ts = time.time()
         distances, indices = self._index[gender].search(embedding_nparray, num_of_result)
 
@@ -72,22 +159,173 @@ class FaissSearch:
         logging.debug('search_with_embedding took {} seconds : {}, with distance of {}'.format(
             time.time() - start_ts, indices[0][0:max_display_num], distances[0][0:max_display_num]))
 
-        result_names = [self._name_list[gender][i] for i in indices[0]]
-        return {name: score for name, score in zip(result_names, distances[0])}
+        # faiss fills -1 if there are less results than requested
+        found = indices[0] >= 0
+        result_names = NAME_VOCABULARY.get_names(self._ids[gender][indices[0][found]], gender)
+        return {name: score for name, score in zip(result_names, distances[0][found].tolist())}
 
     @staticmethod
-    def build_index(gender):
-        name_embedding_list = FaissSearch.load_file(gender)
-
-        name_list = [x['name'] for x in name_embedding_list]
-        embedding_list = [x['embedding'] for x in name_embedding_list]
-        name_embedding_dict = {x['name']: x['embedding'] for x in name_embedding_list}
-        # embedding_index = faiss.IndexFlatL2(len(embedding_list[0]))
-        embedding_index = faiss.IndexFlatIP(len(embedding_list[0]))
-        embedding_index.add(np.asarray(embedding_list))
+    def build_index(gender: Gender) -> Tuple[np.ndarray, faiss.Index]:
+        names, embedding_index = FaissSearch.load_index(gender)
+        name_ids = NAME_VOCABULARY.intern_all(names, gender)
         logging.debug('loaded index for {}; is_trained: {}, ntotal: {}'.format(
             str(gender), embedding_index.is_trained, embedding_index.ntotal))
-        return name_list, embedding_index, name_embedding_dict
+        return name_ids, embedding_index
+
+    @staticmethod
+    def create_index(name_embedding_list: List[Dict], index_type: str = 'flat') -> Tuple[List[str], faiss.Index]:
+        """
+        convert the output of load_file() into an inner-product index of L2-normalized float32 embeddings,
+        so the inner product is the cosine similarity
+        - flat: exact search
+        - hnsw: approximate search on a HNSW graph, which keeps the exact embeddings
+        - ivfpq: approximate search on the inverted lists of product-quantized embeddings, which also makes
+          get_embeddings() return the quantized embeddings
+
+        :return: the canonicalized name of each row of the index, and the index
+        """
+        names = [canonicalize_name(x['name']) for x in name_embedding_list]
+        embeddings = np.asarray([x['embedding'] for x in name_embedding_list], dtype=np.float32)
+        faiss.normalize_L2(embeddings)
+
+        num, dim = embeddings.shape
+        embedding_index = faiss.index_factory(
+            dim, FaissSearch.get_index_factory_string(index_type, num, dim), faiss.METRIC_INNER_PRODUCT)
+        if not embedding_index.is_trained:
+            embedding_index.train(embeddings)
+        embedding_index.add(embeddings)
+
+        ivf_index = faiss.try_extract_index_ivf(embedding_index)
+        if ivf_index is not None:
+            # required by reconstruct()
+            ivf_index.make_direct_map()
+        FaissSearch.configure_search(embedding_index)
+        return names, embedding_index
+
+    @staticmethod
+    def get_index_factory_string(index_type: str, num: int, dim: int) -> str:
+        if index_type == 'flat':
+            return 'Flat'
+        elif index_type == 'hnsw':
+            return 'HNSW{},Flat'.format(HNSW_NEIGHBORS)
+        elif index_type == 'ivfpq':
+            # faiss asks for at least 39 training points per centroid of the coarse quantizer and of each
+            # sub-quantizer
+            num_lists = max(1, min(int(4 * np.sqrt(num)), num // 39))
+            num_bits = next(x for x in [8, 6, 4] if num >= 39 * (1 << x) or x == 4)
+            num_subquantizers = next(x for x in [PQ_SUBQUANTIZERS, 16, 8, 4, 2, 1] if dim % x == 0)
+            return 'IVF{},PQ{}x{}'.format(num_lists, num_subquantizers, num_bits)
+        raise ValueError('Invalid index type: {}; must be one of {}'.format(index_type, INDEX_TYPES))
+
+    @staticmethod
+    def configure_search(embedding_index: faiss.Index):
+        """
+        set the search-time parameters of the approximate index types, which are not persisted in the index file
+        """
+        if isinstance(embedding_index, faiss.IndexHNSW):
+            embedding_index.hnsw.efSearch = HNSW_EF_SEARCH
+        ivf_index = faiss.try_extract_index_ivf(embedding_index)
+        if ivf_index is not None:
+            ivf_index.nprobe = min(IVF_NPROBE, ivf_index.nlist)
+
+    @staticmethod
+    def write_index(gender: Gender, index_type: str = 'flat'):
+        names, embedding_index = FaissSearch.create_index(FaissSearch.load_file(gender), index_type)
+        names_filename, index_filename = FaissSearch.get_index_files(gender)
+
+        with open(names_filename, 'w') as fp:
+            json.dump(names, fp)
+        faiss.write_index(embedding_index, index_filename)
+        logging.info('Wrote {} index of {} {} names to {}'.format(
+            index_type, len(names), str(gender), index_filename))
+
+    @staticmethod
+    def load_index(gender: Gender) -> Tuple[List[str], faiss.Index]:
+        """
+        The index is opened with IO_FLAG_MMAP_IFC, which maps the vectors of the index from the file in place, so
+        they are shared across the gunicorn workers through the page cache instead of being copied by every worker;
+        IO_FLAG_MMAP does not map the vectors of IndexFlat, which are read into the memory of every worker.
+        If the index has not been built, fall back to build it in memory from the JSON embedding file.
+        """
+        index_files = FaissSearch.get_index_files(gender)
+        names_filename, index_filename = index_files
+        if not all(os.path.isfile(x) for x in index_files):
+            logging.warning('Missing embedding index of {}; build it from {}'.format(
+                str(gender), FaissSearch.get_source_file(gender)))
+            return FaissSearch.create_index(FaissSearch.load_file(gender))
+
+        with open(names_filename, 'r') as fp:
+            names = json.load(fp)
+        embedding_index = faiss.read_index(index_filename, faiss.IO_FLAG_MMAP_IFC)
+        FaissSearch.configure_search(embedding_index)
+        return names, embedding_index
+
+    @staticmethod
+    def create_neighbors(embedding_index: faiss.Index, target_index: faiss.Index, k=NEIGHBOR_COUNT,
+                         batch_size=1024) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        compute the exact top k neighbours in target_index of every row of embedding_index, with the embeddings
+        kept by the indices (which are quantized for ivfpq)
+
+        :return: the int32 rows of target_index, -1 for missing neighbours, and the float16 similarity
+        """
+        target_embeddings = target_index.reconstruct_n(0, target_index.ntotal)
+        flat_index = faiss.IndexFlatIP(target_embeddings.shape[1])
+        flat_index.add(target_embeddings)
+
+        k = min(k, target_index.ntotal)
+        neighbor_rows = np.empty((embedding_index.ntotal, k), dtype=np.int32)
+        neighbor_distances = np.empty((embedding_index.ntotal, k), dtype=np.float16)
+        for start in range(0, embedding_index.ntotal, batch_size):
+            num = min(batch_size, embedding_index.ntotal - start)
+            distances, indices = flat_index.search(embedding_index.reconstruct_n(start, num), k)
+            neighbor_rows[start:start + num] = indices
+            neighbor_distances[start:start + num] = distances
+        return neighbor_rows, neighbor_distances
+
+    @staticmethod
+    def write_neighbors():
+        """
+        write the neighbour tables of both genders to both genders, which must be rebuilt with the index files
+        """
+        indices = {gender: FaissSearch.load_index(gender)[1] for gender in [Gender.BOY, Gender.GIRL]}
+        for gender, target_gender in FaissSearch.get_neighbor_pairs():
+            neighbor_rows, neighbor_distances = FaissSearch.create_neighbors(indices[gender], indices[target_gender])
+            rows_filename, distances_filename = FaissSearch.get_neighbor_files(gender, target_gender)
+            np.save(rows_filename, neighbor_rows)
+            np.save(distances_filename, neighbor_distances)
+            logging.info('Wrote {} neighbours of {} {} names to {}'.format(
+                neighbor_rows.shape[1], neighbor_rows.shape[0], str(gender), rows_filename))
+
+    @staticmethod
+    def load_neighbors(indices: Dict[Gender, faiss.Index]) \
+            -> Dict[Tuple[Gender, Gender], Tuple[np.ndarray, np.ndarray]]:
+        """
+        The tables are opened as read-only numpy.memmap; a missing table, or a table which does not match the
+        index, is skipped and similar_names() searches the index instead.
+        """
+        result = {}
+        for gender, target_gender in FaissSearch.get_neighbor_pairs():
+            neighbor_files = FaissSearch.get_neighbor_files(gender, target_gender)
+            if not all(os.path.isfile(x) for x in neighbor_files):
+                logging.warning('Missing neighbour table of {} to {}; search the index instead'.format(
+                    str(gender), str(target_gender)))
+                continue
+
+            neighbor_rows, neighbor_distances = [np.load(x, mmap_mode='r') for x in neighbor_files]
+            if neighbor_rows.shape[0] != indices[gender].ntotal or \
+                    neighbor_rows.max(initial=-1) >= indices[target_gender].ntotal:
+                logging.warning('Neighbour table of {} to {} does not match the index; search the index '
+                                'instead'.format(str(gender), str(target_gender)))
+                continue
+            result[(gender, target_gender)] = (neighbor_rows, neighbor_distances)
+        return result
+
+    @staticmethod
+    def create_row_by_id(gender: Gender, name_ids: np.ndarray) -> np.ndarray:
+        row_by_id = np.full(NAME_VOCABULARY.size(gender), NO_ID, dtype=np.int32)
+        row_by_id[name_ids] = np.arange(len(name_ids), dtype=np.int32)
+        return row_by_id
 
     @staticmethod
     def load_file(gender: Gender):
@@ -102,5 +340,24 @@ class FaissSearch:
         else:
             return os.path.join(get_app_root_dir(), 'data', 'name_embedding-concise_rating-girl.txt')
 
+    @staticmethod
+    def get_index_files(gender: Gender):
+        prefix = FaissSearch.get_index_file_prefix(gender)
+        return prefix + '.names.json', prefix + '.faiss'
+
+    @staticmethod
+    def get_neighbor_files(gender: Gender, target_gender: Gender):
+        prefix = '{}.neighbors-{}'.format(FaissSearch.get_index_file_prefix(gender), str(target_gender))
+        return prefix + '.rows.npy', prefix + '.similarity.npy'
+
+    @staticmethod
+    def get_neighbor_pairs() -> List[Tuple[Gender, Gender]]:
+        return [(gender, target_gender) for gender in [Gender.BOY, Gender.GIRL]
+                for target_gender in [Gender.BOY, Gender.GIRL]]
+
+    @staticmethod
+    def get_index_file_prefix(gender: Gender):
+        return os.path.join(get_app_root_dir(), 'data', 'name_embedding-concise_rating-{}'.format(str(gender)))
+
 
-FAISS_SEARCH = FaissSearch()
+FAISS_SEARCH = register('faiss_search', FaissSearch, depends_on=[ns.NAME_STATISTICS])
@@ -2,8 +2,10 @@ import json
 import logging
 import os
 
-from typing import Dict, Tuple, List, Any, Union
+from typing import Dict, List, Any, Union
 from .common import Gender, canonicalize_gender, canonicalize_name, get_app_root_dir
+from .dataset_registry import register
+from .name_vocabulary import NAME_VOCABULARY, get_by_id
 import app.lib.name_statistics as ns
 
 
@@ -20,7 +22,7 @@ class NameMeaning:
         if not gender:
             gender = ns.NAME_STATISTICS.guess_gender(name)
 
-        return self.__name_meaning__[gender].get(name, '')
+        return get_by_id(self.__name_meaning__[gender], NAME_VOCABULARY.get_id(name, gender), '')
 
     @staticmethod
     def load_file() -> List[Dict[str, Any]]:
@@ -47,11 +49,12 @@ class NameMeaning:
         return result
 
     @staticmethod
-    def loaded_list_to_dict(name_list) -> Dict[Tuple[str, Gender], str]:
+    def loaded_list_to_dict(name_list) -> Dict[Gender, List[str]]:
         """
-        returns a dict with key of (name, gender), and with the value of meaning of the name
+        returns a dict with key of gender, and with the value of a list of the meaning of names,
+        indexed by the name id of NAME_VOCABULARY
         """
-        result = {
+        meaning_by_id = {
             Gender.BOY: {},
             Gender.GIRL: {}
         }
@@ -66,11 +69,17 @@ class NameMeaning:
                 gender = ns.NAME_STATISTICS.guess_gender(name)
             description = val_dict.get('description', '')
 
-            result[gender][name] = description
+            meaning_by_id[gender][NAME_VOCABULARY.intern(name, gender)] = description
 
         logging.debug('Name_meaning loaded {} boy names and {} girl names'.format(
-            len(result[Gender.BOY]), len(result[Gender.GIRL])
+            len(meaning_by_id[Gender.BOY]), len(meaning_by_id[Gender.GIRL])
         ))
+
+        result = {}
+        for gender, gender_meaning_by_id in meaning_by_id.items():
+            result[gender] = [''] * NAME_VOCABULARY.size(gender)
+            for name_id, description in gender_meaning_by_id.items():
+                result[gender][name_id] = description
         return result
 
     @staticmethod
@@ -78,6 +87,6 @@ class NameMeaning:
         return os.path.join(get_app_root_dir(), 'data', 'name_meaning_new.txt')
 
 
-NAME_MEANING = NameMeaning()
+NAME_MEANING = register('name_meaning', NameMeaning, depends_on=[ns.NAME_STATISTICS])
 
 
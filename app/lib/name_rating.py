@@ -3,11 +3,14 @@ import logging
 import os
 import time
 
+import numpy as np
 import scipy.stats as stats
 
 from typing import Dict, Tuple, List, Any, Union
 from app.lib.common import Gender, canonicalize_gender, canonicalize_name, get_app_root_dir, \
     float_to_percentage, percentage_to_float
+from app.lib.dataset_registry import register
+from app.lib.name_vocabulary import NAME_VOCABULARY, NO_ID, get_by_id
 import app.lib.name_statistics as ns
 
 ALL_RATINGS = [
@@ -28,6 +31,9 @@ ALL_RATINGS = [
     ("Nerdy", "Unintellectual", 'intellectual_option', "Intellectual", "Modest")
 ]
 
+# URL parameter name -> (column of the rating matrix, external option 1, external option 2)
+RATING_COLUMNS = {types[2]: (col, types[3], types[4]) for col, types in enumerate(ALL_RATINGS)}
+
 DISPLAY_RATINGS = {"style_option", "maturity_option", "formality_option", "class_option",
                    "environment_option", "moral_option", "strength_option", "texture_option",
                    "creativity_option", "complexity_option", "tone_option", "intellectual_option"}
@@ -73,11 +79,28 @@ class NameRating:
 
     def __init__(self):
         raw_input = NameRating.load_file()
-        self.__name_rating__ = NameRating.loaded_list_to_dict(raw_input)
-        self._names = {
-            Gender.BOY: [name for name in self.__name_rating__[Gender.BOY].keys()],
-            Gender.GIRL: [name for name in self.__name_rating__[Gender.GIRL].keys()]
-        }
+        name_rating = NameRating.loaded_list_to_dict(raw_input)
+
+        # per gender, one row for each rated name and one column for each type of ALL_RATINGS
+        self._ids = {}
+        self._row_by_id = {}
+        self._ratings = {}
+        self._zscores = {}
+        self._percentiles = {}
+        for gender, gender_rating in name_rating.items():
+            ids = np.fromiter(gender_rating.keys(), dtype=np.int32)
+            row_by_id = np.full(NAME_VOCABULARY.size(gender), NO_ID, dtype=np.int32)
+            row_by_id[ids] = np.arange(len(ids), dtype=np.int32)
+            ratings = np.asarray([[rating_dict[types[3]] for types in ALL_RATINGS]
+                                  for rating_dict in gender_rating.values()], dtype=np.float32)
+            ratings = ratings.reshape(-1, len(ALL_RATINGS))
+            zscores, percentiles = NameRating.create_zscores_and_percentiles(gender, ratings)
+
+            self._ids[gender] = ids
+            self._row_by_id[gender] = row_by_id
+            self._ratings[gender] = ratings
+            self._zscores[gender] = zscores
+            self._percentiles[gender] = percentiles
 
     def get_feature_scores(self, raw_name: str, raw_gender: Union[str, Gender]) \
             -> Dict[str, Dict[str, Union[List[str], int]]]:
@@ -86,25 +109,30 @@ class NameRating:
         if not gender:
             gender = ns.NAME_STATISTICS.guess_gender(name)
 
-        if name not in self.__name_rating__[gender]:
-            return {}
+        return self.get_feature_scores_batch([name], gender).get(name, {})
 
-        result = {}
-        for types in ALL_RATINGS:
-            url_param = types[2]
-            ext_opt1 = types[3]
-            ext_opt2 = types[4]
-            if url_param not in DISPLAY_RATINGS:
-                continue
+    def get_feature_scores_batch(self, raw_names: List[str], raw_gender: Union[str, Gender]) \
+            -> Dict[str, Dict[str, Dict[str, Union[List[str], int]]]]:
+        """
+        :return: a dict with the canonicalized name as key and with the value of get_feature_scores();
+        names without ratings are skipped
+        """
+        gender = canonicalize_gender(raw_gender)
+        if not gender:
+            raise ValueError('Invalid gender: {}'.format(raw_gender))
 
-            zscore = self._get_zscore(gender, name, url_param, ext_opt1, ext_opt2, ext_opt1)
-            percentile_float = stats.norm.sf(abs(zscore))
-            percentile_float = percentile_float if zscore > 0 else 1 - percentile_float
-            score = round(percentile_float * 10)
+        names, rows = self._get_rated_rows(gender, raw_names)
+        # score of 0~10, the lower the score is, the more the name is of external option 1
+        scores = np.round(self._percentiles[gender][rows] * 10).astype(np.int32)
 
-            result[url_param] = {
-                'characteristics': [ext_opt1, ext_opt2],
-                'score': score
+        result = {}
+        for name, name_scores in zip(names, scores.tolist()):
+            result[name] = {
+                url_param: {
+                    'characteristics': [ext_opt1, ext_opt2],
+                    'score': name_scores[col]
+                }
+                for url_param, (col, ext_opt1, ext_opt2) in RATING_COLUMNS.items() if url_param in DISPLAY_RATINGS
             }
         return result
 
@@ -114,27 +142,41 @@ class NameRating:
         if not gender:
             gender = ns.NAME_STATISTICS.guess_gender(name)
 
-        if name not in self.__name_rating__[gender]:
-            return {}
+        return self.get_feature_percentiles_batch([name], gender).get(name, {})
+
+    def get_feature_percentiles_batch(self, raw_names: List[str], raw_gender: Union[str, Gender]) \
+            -> Dict[str, Dict]:
+        """
+        :return: a dict with the canonicalized name as key and with the value of get_feature_percentiles();
+        names without ratings are skipped
+        """
+        gender = canonicalize_gender(raw_gender)
+        if not gender:
+            raise ValueError('Invalid gender: {}'.format(raw_gender))
+
+        names, rows = self._get_rated_rows(gender, raw_names)
+        ratings = self._ratings[gender][rows].astype(np.float64).tolist()
+        zscores = self._zscores[gender][rows].astype(np.float64).tolist()
+        # the percentile of the option which the name leans to
+        percentiles = self._percentiles[gender][rows].astype(np.float64)
+        percentiles = np.minimum(percentiles, 1 - percentiles).tolist()
 
         result = {}
-        rating_dict = self.__name_rating__[gender][name]
-        for types in ALL_RATINGS:
-            url_param = types[2]
-            ext_opt1 = types[3]
-            ext_opt2 = types[4]
-
-            score = rating_dict[ext_opt1]
-            zscore = self._get_zscore(gender, name, url_param, ext_opt1, ext_opt2, ext_opt1)
-            percentile_float = stats.norm.sf(abs(zscore))
-            percentile_str = float_to_percentage(percentile_float, min_val=1)
-
-            result[types[2]] = {
-                types[3]: (float_to_percentage(score), 'top' if zscore > 0 else 'bottom',
-                           percentile_str, zscore, percentile_float),
-                types[4]: (float_to_percentage(1 - score), 'bottom' if zscore > 0 else 'top',
-                           percentile_str, -zscore, percentile_float)
-            }
+        for i, name in enumerate(names):
+            name_result = {}
+            for url_param, (col, ext_opt1, ext_opt2) in RATING_COLUMNS.items():
+                score = ratings[i][col]
+                zscore = zscores[i][col]
+                percentile_float = percentiles[i][col]
+                percentile_str = float_to_percentage(percentile_float, min_val=1)
+
+                name_result[url_param] = {
+                    ext_opt1: (float_to_percentage(score), 'top' if zscore > 0 else 'bottom',
+                               percentile_str, zscore, percentile_float),
+                    ext_opt2: (float_to_percentage(1 - score), 'bottom' if zscore > 0 else 'top',
+                               percentile_str, -zscore, percentile_float)
+                }
+            result[name] = name_result
         return result
 
     def suggest(self, raw_target_gender: Union[str, Gender], options: Dict[str, str], count=20) \
@@ -151,39 +193,22 @@ class NameRating:
         if not target_gender:
             raise ValueError('Invalid target gender: {}'.format(raw_target_gender))
 
-        name_reasons = {name: {'pros': [], 'cons': []} for name in names}
-
-        for url_param, choice in options.items():
-            opt1, opt2 = NameRating.get_options_by_url_param(url_param)
-            if not opt1 or not opt2:
-                logging.warning('Unexpected URL param for rating choice: {}; skip'.format(url_param))
-                continue
-
-            choice = options.get(url_param, "").strip()
-            if not choice or choice not in [opt1, opt2]:
-                logging.warning('Unexpected choice: "{}", allowed values are "{}" and "{}"; skip'.format(
-                    choice if choice else '', opt1, opt2))
-                continue
+        cols, choose_opt2 = self._parse_options(options)
+        choices = [ALL_RATINGS[col][4 if opt2 else 3] for col, opt2 in zip(cols, choose_opt2)]
 
-            for name in names:
-                percentile = self._get_percentile(target_gender, name, url_param, opt1, opt2, choice)
-                percentile_str = float_to_percentage(percentile, min_val=1)
-
-                if percentile < 0.4:
-                    name_reasons[name]['pros'].append(
-                        'the top {percentile} {choice} names'.format(
-                            percentile=percentile_str, choice=choice
-                        )
-                    )
-                elif percentile > 0.6:
-                    name_reasons[name]['cons'].append(
-                        '{choice}'.format(choice=choice)
-                    )
+        # names without ratings are at the 50% percentile of every option
+        rows = self._get_rows(target_gender, NAME_VOCABULARY.get_ids(names, target_gender))
+        percentiles = np.full((len(names), len(cols)), 0.5)
+        rated = rows != NO_ID
+        percentiles[rated] = self._percentiles[target_gender][np.ix_(rows[rated], cols)]
+        percentiles = np.where(choose_opt2, 1 - percentiles, percentiles).tolist()
 
         name_reason_sentences = {name: '' for name in names}
-        for name, pros_cons in name_reasons.items():
-            pros = pros_cons['pros']
-            # cons = pros_cons['cons']
+        for name, name_percentiles in zip(names, percentiles):
+            pros = ['the top {percentile} {choice} names'.format(
+                        percentile=float_to_percentage(percentile, min_val=1), choice=choice)
+                    for choice, percentile in zip(choices, name_percentiles) if percentile < 0.4]
+            # cons = [choice for choice, percentile in zip(choices, name_percentiles) if percentile > 0.6]
 
             if pros:
                 name_reason_sentences[name] = 'We recommend this name because it is considered as {}.'\
@@ -203,13 +228,69 @@ class NameRating:
         if not target_gender:
             raise ValueError('Invalid target gender: {}'.format(raw_target_gender))
 
-        # score all top names
-        available_names = set(self._names[target_gender])
-        top_names = set(ns.NAME_STATISTICS.get_popular_names(target_gender, count=5000))
-        top_available_names = available_names.intersection(top_names)
-        logging.debug('# of Top available names for suggest is {}'.format(len(top_available_names)))
-        name_score_dict = {x: 0.0 for x in top_available_names}
+        # score all top names which have ratings
+        top_ids = ns.NAME_STATISTICS.get_popular_ids(target_gender, count=5000)
+        top_rows = self._get_rows(target_gender, top_ids)
+        top_available_ids = top_ids[top_rows != NO_ID]
+        top_available_rows = top_rows[top_rows != NO_ID]
+        logging.debug('# of Top available names for suggest is {}'.format(len(top_available_ids)))
+
+        cols, choose_opt2 = self._parse_options(options)
+        # the percentile of choosing option 2 is 1 - the percentile of choosing option 1
+        percentiles = self._percentiles[target_gender][np.ix_(top_available_rows, cols)]
+        scores = np.where(choose_opt2, percentiles, 1 - percentiles).sum(axis=1, dtype=np.float64)
+
+        num_choices = len(options)
+        qualified = np.flatnonzero(scores > 0.5 * num_choices)
+        count = min(count, len(qualified))
+        if count <= 0:
+            return {}
+
+        top_k = qualified[np.argpartition(-scores[qualified], count - 1)[0:count]]
+        top_k = top_k[np.argsort(-scores[top_k], kind='stable')]
 
+        names = NAME_VOCABULARY.get_names(top_available_ids[top_k], target_gender)
+        return {name: float(score) / num_choices for name, score in zip(names, scores[top_k])}
+
+    def stats(self, gender: Gender):
+        count = {types[3]: int(x) for types, x in zip(ALL_RATINGS, (self._ratings[gender] >= 0.5).sum(axis=0))}
+
+        total = len(self._ids[gender])
+        percentage = {key: "{}%".format(round(100.0 * val / total)) for key, val in count.items()}
+        logging.info('Total: {}, count of names with >=50%: {}, percentage: {}'.format(
+            total, count, percentage
+        ))
+
+    def _get_rated_rows(self, gender: Gender, raw_names: List[str]) -> Tuple[List[str], np.ndarray]:
+        """
+        :return: the canonicalized names which have ratings, and their rows in the rating matrix
+        """
+        names = [canonicalize_name(x) for x in raw_names]
+        rows = self._get_rows(gender, NAME_VOCABULARY.get_ids(names, gender))
+        rated = np.flatnonzero(rows != NO_ID)
+        return [names[i] for i in rated], rows[rated]
+
+    def _get_row(self, gender: Gender, name: str) -> int:
+        return int(get_by_id(self._row_by_id[gender], NAME_VOCABULARY.get_id(name, gender), NO_ID))
+
+    def _get_rows(self, gender: Gender, name_ids: np.ndarray) -> np.ndarray:
+        """
+        :return: the row of each name id in the rating matrix, or NO_ID for names without ratings
+        """
+        row_by_id = self._row_by_id[gender]
+        name_ids = np.asarray(name_ids, dtype=np.int32)
+        in_range = (name_ids >= 0) & (name_ids < len(row_by_id))
+        rows = np.full(len(name_ids), NO_ID, dtype=np.int32)
+        rows[in_range] = row_by_id[name_ids[in_range]]
+        return rows
+
+    @staticmethod
+    def _parse_options(options: Dict[str, str]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        :return: the matrix columns of the valid options, and whether option 2 is chosen for each of them
+        """
+        cols = []
+        choose_opt2 = []
         for url_param, choice in options.items():
             opt1, opt2 = NameRating.get_options_by_url_param(url_param)
             if not opt1 or not opt2:
@@ -222,79 +303,54 @@ class NameRating:
                     choice if choice else '', opt1, opt2))
                 continue
 
-            for name in name_score_dict.keys():
-                percentile = self._get_percentile(target_gender, name, url_param, opt1, opt2, choice)
-                name_score_dict[name] += 1 - percentile
+            cols.append(RATING_COLUMNS[url_param][0])
+            choose_opt2.append(choice == opt2)
 
-        num_choices = len(options)
-        name_score_list = [(name, score / num_choices) for name, score in name_score_dict.items()
-                           if score > 0.5 * num_choices]
-        name_score_list = sorted(name_score_list, key=lambda x: x[1], reverse=True)
-
-        count = min(count, len(name_score_list))
-        result_dict = {name_score[0]: name_score[1] for name_score in name_score_list[0:count]}
-
-        return result_dict
-
-    def stats(self, gender: Gender):
-        count = {
-            "A Good Name": 0,
-            "Masculine": 0,
-            "Classic": 0,
-            "Mature": 0,
-            "Formal": 0,
-            "Noble": 0,
-            "Urban": 0,
-            "Wholesome": 0,
-            "Strong": 0,
-            "Refined": 0,
-            "Creative": 0,
-            "Simple": 0,
-            "Serious": 0,
-            "Intellectual": 0,
-        }
-        for types in ALL_RATINGS:
-            for name in self._names[gender]:
-                score = self.__name_rating__[gender][name][types[3]]
-                if score >= 0.5:
-                    count[types[3]] += 1
-
-        total = len(self._names[gender])
-        percentage = {key: "{}%".format(round(100.0 * val / total)) for key, val in count.items()}
-        logging.info('Total: {}, count of names with >=50%: {}, percentage: {}'.format(
-            total, count, percentage
-        ))
+        return np.asarray(cols, dtype=np.int32), np.asarray(choose_opt2, dtype=bool)
 
     def _get_percentile(self, gender: Union[Gender, str], name: str,
                         url_param: str, ext_option1: str, ext_option2: str,
                         option_choice: str) -> float:
         gender = canonicalize_gender(gender)
-        zscore = self._get_zscore(gender, name, url_param, ext_option1, ext_option2, option_choice)
-        percentile = stats.norm.sf(abs(zscore))
-        return percentile if zscore > 0 else 1 - percentile
+        row = self._get_row(gender, name)
+        if row == NO_ID:
+            return 0.5
+
+        percentile = float(self._percentiles[gender][row, RATING_COLUMNS[url_param][0]])
+        return 1 - percentile if NameRating._is_option2(url_param, ext_option1, ext_option2, option_choice) \
+            else percentile
 
     def _get_zscore(self, gender: Gender, name: str,
                     url_param: str, ext_option1: str, ext_option2: str,
                     option_choice: str) -> float:
-        if name not in self.__name_rating__[gender]:
+        row = self._get_row(gender, name)
+        if row == NO_ID:
             return 0
 
+        z_score = float(self._zscores[gender][row, RATING_COLUMNS[url_param][0]])
+        return -z_score if NameRating._is_option2(url_param, ext_option1, ext_option2, option_choice) else z_score
+
+    @staticmethod
+    def _is_option2(url_param: str, ext_option1: str, ext_option2: str, option_choice: str) -> bool:
         if option_choice.lower() == ext_option1.lower():
-            go_higher = True
+            return False
         elif option_choice.lower() == ext_option2.lower():
-            go_higher = False
+            return True
         else:
             raise ValueError('Unexpected option: {} --> {}'.format(url_param, option_choice))
 
-        mean = RATING_DISTRIBUTION[gender][ext_option1][0]
-        std_dev = RATING_DISTRIBUTION[gender][ext_option1][1]
-
-        score = self.__name_rating__[gender][name][ext_option1]
-        z_score = (score - mean) / std_dev
-        if not go_higher:
-            z_score = -z_score
+    @staticmethod
+    def create_zscores_and_percentiles(gender: Gender, ratings: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        :return: the z-scores of external option 1 against RATING_DISTRIBUTION, and the percentiles of
+        choosing external option 1, i.e. the share of names which are more option 1 than the name
+        """
+        means = np.asarray([RATING_DISTRIBUTION[gender][types[3]][0] for types in ALL_RATINGS])
+        std_devs = np.asarray([RATING_DISTRIBUTION[gender][types[3]][1] for types in ALL_RATINGS])
 
-        return z_score
+        zscores = (ratings - means) / std_devs
+        percentiles = stats.norm.sf(zscores)
+        return zscores.astype(np.float32), percentiles.astype(np.float32)
 
     @staticmethod
     def load_file() -> List[Dict[str, Any]]:
@@ -330,13 +386,13 @@ class NameRating:
             return json.load(fp)
 
     @staticmethod
-    def loaded_list_to_dict(name_list) -> Dict[Tuple[str, Gender], str]:
+    def loaded_list_to_dict(name_list) -> Dict[Gender, Dict[int, Dict[str, float]]]:
         """
         all options are mapped to external options, as defined at ALL_RATINGS
-        returns a dict like
+        returns a dict keyed by the name id of NAME_VOCABULARY, like
         {
             Gender.BOY : {
-                "George": {
+                12 (id of "George"): {
                     "A Good Name": 0.69,
                     "Masculine": 0.92,
                     "Classic": 0.46,
@@ -375,7 +431,7 @@ class NameRating:
                 # here we map internal option 1 to external option 1, like "Strange" to "Creative"
                 parsed_ratings[ext_opt1] = NameRating.get_score(raw_ratings, int_opt1)
 
-            result[gender][name] = parsed_ratings
+            result[gender][NAME_VOCABULARY.intern(name, gender)] = parsed_ratings
 
         logging.debug('Name Rating: boy count: {}, girl count: {}'.format(boy_count, girl_count))
 
@@ -388,12 +444,12 @@ class NameRating:
 
     @staticmethod
     def get_options_by_url_param(url_param):
-        record = next(x for x in ALL_RATINGS if url_param == x[2])
-        return record[3], record[4]
+        _, ext_opt1, ext_opt2 = RATING_COLUMNS.get(url_param, (NO_ID, '', ''))
+        return ext_opt1, ext_opt2
 
     @staticmethod
     def get_source_file():
         return os.path.join(get_app_root_dir(), 'data', 'ratings.json')
 
 
-NAME_RATING = NameRating()
+NAME_RATING = register('name_rating', NameRating, depends_on=[ns.NAME_STATISTICS])
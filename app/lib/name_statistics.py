@@ -3,37 +3,88 @@ import json
 import logging
 import os
 
-from typing import Dict, Union
+import numpy as np
+
+from functools import lru_cache
+from typing import Dict, List, NamedTuple, Tuple, Union
 from .common import Gender, canonicalize_gender, canonicalize_name, get_app_root_dir
+from .dataset_registry import register
+from .name_vocabulary import NAME_VOCABULARY, NO_ID, get_by_id, get_by_ids
+
+
+UNRANKED = 100000
+
+
+class WindowRank(NamedTuple):
+    """
+    frequency and rank of the names of one gender within a year window; freq and rank are indexed
+    by the name id of NAME_VOCABULARY
+    """
+    freq: np.ndarray            # int64 frequency summed over the window
+    ordered_ids: np.ndarray     # ids of names with non-zero frequency, by frequency descending
+    rank: np.ndarray            # 1-based rank, or UNRANKED for names with zero frequency
+    cum_ratio: np.ndarray       # cumulative share of the total frequency, following ordered_ids
 
 
 class NameStatistics:
 
-    def __init__(self, start_year=2020, end_year=2022):
-        self.__freq__ = NameStatistics.load_file()
-        self._name_freq_3_year, self._name_ordered_list_3_year = \
-            NameStatistics.create_name_freq_rank(self.__freq__, start_year, end_year)
+    def __init__(self, start_year=2020, end_year=2022, window_cache_size=32):
+        self._start_year = start_year
+        self._end_year = end_year
+        names, genders, self._first_year, self._counts, self._cum_counts = NameStatistics.load_snapshot()
+
+        # the snapshot is ordered by gender, so the columns of each gender are contiguous
+        self._gender_columns = {}
+        self._ids = {}
+        self._column_by_id = {}
+        for gender in [Gender.GIRL, Gender.BOY]:
+            first = int(np.searchsorted(genders, gender.value, side='left'))
+            last = int(np.searchsorted(genders, gender.value, side='right'))
+            self._gender_columns[gender] = slice(first, last)
+
+            ids = NAME_VOCABULARY.intern_all(names[first:last], gender)
+            column_by_id = np.full(int(ids.max()) + 1 if len(ids) else 0, NO_ID, dtype=np.int32)
+            column_by_id[ids] = np.arange(first, last, dtype=np.int32)
+            self._ids[gender] = ids
+            self._column_by_id[gender] = column_by_id
+
+        self._get_window_rank = lru_cache(maxsize=window_cache_size)(self.create_name_freq_rank)
+        # warm up the default window
+        self._get_window_rank(start_year, end_year)
 
     def guess_gender(self, name: str):
-        name = canonicalize_name(name)
-        boy_count = self._name_freq_3_year[Gender.BOY].get(name, {}).get('freq', 0)
-        girl_count = self._name_freq_3_year[Gender.GIRL].get(name, {}).get('freq', 0)
+        return self.guess_genders([name])[0]
 
-        guess_gender = Gender.GIRL if girl_count >= boy_count else Gender.BOY
-        # logging.debug('name {} guess gender: {}, Girl count: {}, Boy count: {}'.format(
-        #     name, str(guess_gender), girl_count, boy_count))
-        return guess_gender
+    def guess_genders(self, raw_names: List[str]) -> List[Gender]:
+        """
+        :return: for each name, the gender which the name is more frequently given to; girl if tie
+        """
+        names = [canonicalize_name(x) for x in raw_names]
+        counts = {}
+        for gender in [Gender.BOY, Gender.GIRL]:
+            freq = self.get_window_rank(gender).freq
+            counts[gender] = get_by_ids(freq, NAME_VOCABULARY.get_ids(names, gender), 0)
 
-    def get_frequency_and_rank(self, raw_name: str, raw_gender: str = None):
+        return [Gender.GIRL if girl_count >= boy_count else Gender.BOY
+                for boy_count, girl_count in zip(counts[Gender.BOY].tolist(), counts[Gender.GIRL].tolist())]
+
+    def get_frequency_and_rank(self, raw_name: str, raw_gender: str = None,
+                               start_year: int = None, end_year: int = None) -> Tuple[int, int]:
+        """
+        :param start_year: the first year of the window; default to the start year of this instance
+        :param end_year: the last year (inclusive) of the window; default to the end year of this instance
+        """
         name = canonicalize_name(raw_name)
         gender = canonicalize_gender(raw_gender)
         if not gender:
             gender = self.guess_gender(name)
 
-        return self._name_freq_3_year[gender].get(name, {}).get('freq', 0), \
-               self._name_freq_3_year[gender].get(name, {}).get('rank', 100000)
+        name_id = NAME_VOCABULARY.get_id(name, gender)
+        window = self.get_window_rank(gender, start_year, end_year)
+        return int(get_by_id(window.freq, name_id, 0)), int(get_by_id(window.rank, name_id, UNRANKED))
 
-    def get_popular_names(self, raw_gender: Union[str, Gender], count=30):
+    def get_popular_names(self, raw_gender: Union[str, Gender], count=30,
+                          start_year: int = None, end_year: int = None) -> List[str]:
         if isinstance(raw_gender, Gender):
             gender = raw_gender
         else:
@@ -41,26 +92,39 @@ class NameStatistics:
         if not gender:
             raise ValueError('Wrong gender: {}'.format(raw_gender))
 
-        count = min(count, len(self._name_ordered_list_3_year[gender]))
-        top_records = self._name_ordered_list_3_year[gender][0:count]
-        return [x['name'] for x in top_records]
+        return NAME_VOCABULARY.get_names(self.get_popular_ids(gender, count, start_year, end_year), gender)
 
-    def get_percentile(self, percentile, gender: Gender):
-        total = 0
-        for record in self._name_ordered_list_3_year[gender]:
-            total += record['freq']
+    def get_popular_ids(self, gender: Gender, count=30, start_year: int = None, end_year: int = None) -> np.ndarray:
+        """
+        :return: the ids of NAME_VOCABULARY of the most popular names, by frequency descending
+        """
+        window = self.get_window_rank(gender, start_year, end_year)
+        return window.ordered_ids[0:count]
 
-        names = []
-        count = 0
-        for record in self._name_ordered_list_3_year[gender]:
-            count += record['freq']
-            names.append(record['name'])
-            if 1.0 * count / total >= percentile:
-                break
+    def get_percentile(self, percentile, gender: Gender,
+                       start_year: int = None, end_year: int = None) -> List[str]:
+        """
+        :return: the most popular names which together account for the given percentile of all babies
+        """
+        cutoff = self.get_percentile_cutoffs([percentile], gender, start_year, end_year)[0]
+        names = self.get_popular_names(gender, count=cutoff, start_year=start_year, end_year=end_year)
 
-        logging.debug('{} of names has a count of {} out of {}: {}'.format(len(names), count, total, names))
+        logging.debug('{} of names reaches the percentile of {}: {}'.format(len(names), percentile, names))
         return names
 
+    def get_percentile_cutoffs(self, percentiles: List[float], gender: Gender,
+                               start_year: int = None, end_year: int = None) -> List[int]:
+        """
+        :return: for each percentile, the number of most popular names which together account for the percentile
+        of all babies; i.e. get_popular_names(gender, count=cutoff) returns the names within the percentile
+        """
+        window = self.get_window_rank(gender, start_year, end_year)
+        if len(window.cum_ratio) == 0:
+            return [0 for _ in percentiles]
+
+        cutoffs = np.searchsorted(window.cum_ratio, np.asarray(percentiles, dtype=np.float64), side='left') + 1
+        return [int(x) for x in np.minimum(cutoffs, len(window.cum_ratio))]
+
     def get_yearly_trend(self, raw_name: str, raw_gender: Union[str, Gender] = None) -> Dict[str, str]:
         """
         return a dict with year as key and with frequency as value
@@ -70,102 +134,57 @@ class NameStatistics:
         if not gender:
             gender = self.guess_gender(name)
 
-        result = self.__freq__.get((name, gender), {})
-        return result
+        column_idx = get_by_id(self._column_by_id[gender], NAME_VOCABULARY.get_id(name, gender), NO_ID)
+        if column_idx == NO_ID:
+            return {}
+
+        column = self._counts[:, column_idx]
+        return {str(self._first_year + year_idx): str(column[year_idx]) for year_idx in np.flatnonzero(column)}
 
     def get_raw_yearly_trend(self):
-        return self.__freq__.copy()
+        return {(name, gender): self.get_yearly_trend(name, gender)
+                for gender, ids in self._ids.items()
+                for name in NAME_VOCABULARY.get_names(ids, gender)}
 
-    @staticmethod
-    def create_name_freq_rank(yearly_trend_dict, start_year, end_year):
+    def get_window_rank(self, gender: Gender, start_year: int = None, end_year: int = None) -> WindowRank:
+        start_year = self._start_year if start_year is None else start_year
+        end_year = self._end_year if end_year is None else end_year
+        if start_year > end_year:
+            raise ValueError('Invalid year window: {} - {}'.format(start_year, end_year))
+
+        return self._get_window_rank(start_year, end_year)[gender]
+
+    def create_name_freq_rank(self, start_year, end_year) -> Dict[Gender, WindowRank]:
         """
-        :param yearly_trend_dict:
+        compute the frequency and rank of all names within a window with the prefix sums over the year axis
         :param start_year:
         :param end_year: inclusive
-        :return:
-        a frequency dictionary, like
-        {
-            Gender.GIRL: {
-                'Ally': {
-                    'freq': 80
-                    'rank': 1
-                }
-                ...
-            },
-            Gender.BOY: {
-                'George": {
-                    'freq': 40,
-                    'rank': 1
-                }
-                ...
-            },
-        }
-        and a name list ordered by frequency, like
-        {
-            Gender.GIRL: [
-                {
-                    'name': 'Ally'
-                    'freq': 80
-                }
-                ...
-            ],
-            Gender.BOY: {
-                {
-                    'name': 'George'
-                    'freq': 40
-                }
-                ...
-            },
-        }
-        """
-        raw_freq_dict = {
-            Gender.GIRL: {},
-            Gender.BOY: {}
-        }
-        for name_gender, yearly_trend in yearly_trend_dict.items():
-            name, gender = name_gender
-            assert isinstance(gender, Gender), "wrong gender type: {}".format(gender)
-
-            raw_freq_dict[gender][name] = {'freq': 0}
-            for year in range(start_year, end_year + 1):
-                raw_freq_dict[gender][name]['freq'] += int(yearly_trend.get(str(year), '0'))
-
-        # remove names with 0 frequency
-        freq_dict = {
-            Gender.GIRL: {},
-            Gender.BOY: {}
-        }
-        count = 0
-        for gender in [Gender.GIRL, Gender.BOY]:
-            for name, record in raw_freq_dict[gender].items():
-                if record['freq'] > 0:
-                    freq_dict[gender][name] = record
-                    count += 1
-        logging.debug('name_statistics: {} records has non-zero frequency'.format(count))
-
-        raw_freq_list = {
-            Gender.GIRL: [],
-            Gender.BOY: []
-        }
-        for gender in [Gender.GIRL, Gender.BOY]:
-            for name, record in freq_dict[gender].items():
-                raw_freq_list[gender].append({'name': name, 'freq': record['freq']})
-                # logging.debug('name {} frequency {}'.format(name, record['freq']))
+        """
+        # clip the window to the years of the snapshot; years outside of the snapshot are simply absent
+        num_years = self._cum_counts.shape[0] - 1
+        first_row = min(max(start_year - self._first_year, 0), num_years)
+        last_row = min(max(end_year - self._first_year + 1, 0), num_years)
 
-        freq_list = {
-            Gender.GIRL: sorted(raw_freq_list[Gender.GIRL], key=lambda x: x['freq'], reverse=True),
-            Gender.BOY: sorted(raw_freq_list[Gender.BOY], key=lambda x: x['freq'], reverse=True)
-        }
+        result = {}
+        for gender, columns in self._gender_columns.items():
+            freq = np.zeros(len(self._column_by_id[gender]), dtype=np.int64)
+            freq[self._ids[gender]] = self._cum_counts[last_row, columns].astype(np.int64) \
+                - self._cum_counts[first_row, columns]
 
-        # write rank  into freq_dict
-        for gender in [Gender.GIRL, Gender.BOY]:
-            rank = 1
-            for record in freq_list[gender]:
-                name = record['name']
-                freq_dict[gender][name]['rank'] = rank
-                rank += 1
+            ordered_ids = np.argsort(-freq, kind='stable')
+            ordered_ids = ordered_ids[0:np.count_nonzero(freq)].astype(np.int32)
+
+            rank = np.full(len(freq), UNRANKED, dtype=np.int32)
+            rank[ordered_ids] = np.arange(1, len(ordered_ids) + 1, dtype=np.int32)
+
+            cum_freq = np.cumsum(freq[ordered_ids])
+            cum_ratio = cum_freq / cum_freq[-1] if len(cum_freq) > 0 else cum_freq.astype(np.float64)
 
-        return freq_dict, freq_list
+            result[gender] = WindowRank(freq=freq, ordered_ids=ordered_ids, rank=rank, cum_ratio=cum_ratio)
+
+        logging.debug('name_statistics: {} records has non-zero frequency between {} and {}'.format(
+            sum(len(x.ordered_ids) for x in result.values()), start_year, end_year))
+        return result
 
     @staticmethod
     def load_file():
@@ -201,9 +220,88 @@ class NameStatistics:
 
         return output
 
+    @staticmethod
+    def create_snapshot(yearly_trend_dict) -> Tuple[List[str], np.ndarray, int, np.ndarray]:
+        """
+        convert the output of load_file() into the columnar snapshot format:
+        - a name table, ordered by gender and then by name
+        - a gender column (int8 value of Gender) aligned with the name table
+        - the first year covered by the count matrix
+        - a dense int32 count matrix with one row per year and one column per name
+        """
+        name_genders = sorted(yearly_trend_dict.keys(), key=lambda x: (x[1].value, x[0]))
+        all_years = [int(year) for trend in yearly_trend_dict.values() for year in trend.keys()]
+        first_year, last_year = min(all_years), max(all_years)
+
+        names = [name for name, _ in name_genders]
+        genders = np.asarray([gender.value for _, gender in name_genders], dtype=np.int8)
+        counts = np.zeros((last_year - first_year + 1, len(name_genders)), dtype=np.int32)
+        for idx, name_gender in enumerate(name_genders):
+            for year, count in yearly_trend_dict[name_gender].items():
+                counts[int(year) - first_year, idx] = int(count)
+
+        return names, genders, first_year, counts
+
+    @staticmethod
+    def write_snapshot(yearly_trend_dict):
+        names, genders, first_year, counts = NameStatistics.create_snapshot(yearly_trend_dict)
+        names_filename, genders_filename, counts_filename, cum_counts_filename = \
+            NameStatistics.get_snapshot_files()
+
+        with open(names_filename, 'w') as fp:
+            json.dump({'first_year': first_year, 'names': names}, fp)
+        np.save(genders_filename, genders)
+        np.save(counts_filename, counts)
+        np.save(cum_counts_filename, NameStatistics.create_cum_counts(counts))
+
+        logging.info('Wrote snapshot of {} names and {} years to {}'.format(
+            len(names), counts.shape[0], counts_filename))
+
+    @staticmethod
+    def load_snapshot() -> Tuple[List[str], np.ndarray, int, np.ndarray, np.ndarray]:
+        """
+        The count matrix and its prefix sums are opened as read-only numpy.memmap, so the pages are shared
+        across the gunicorn workers through the page cache instead of being parsed by every worker.
+        If the snapshot has not been built, fall back to build it in memory from the gzip JSON file.
+        """
+        snapshot_files = NameStatistics.get_snapshot_files()
+        names_filename, genders_filename, counts_filename, cum_counts_filename = snapshot_files
+        if not all(os.path.isfile(x) for x in snapshot_files):
+            logging.warning('Missing snapshot of name statistics; build it from {}'.format(
+                NameStatistics.get_source_file()))
+            names, genders, first_year, counts = NameStatistics.create_snapshot(NameStatistics.load_file())
+            return names, genders, first_year, counts, NameStatistics.create_cum_counts(counts)
+
+        with open(names_filename, 'r') as fp:
+            names_info = json.load(fp)
+        genders = np.load(genders_filename)
+        counts = np.load(counts_filename, mmap_mode='r')
+        cum_counts = np.load(cum_counts_filename, mmap_mode='r')
+
+        logging.info("Loaded snapshot of number of names: {}".format(len(names_info['names'])))
+        return names_info['names'], genders, names_info['first_year'], counts, cum_counts
+
+    @staticmethod
+    def create_cum_counts(counts: np.ndarray) -> np.ndarray:
+        """
+        prefix sums over the year axis, with a leading row of zeros, such that the frequency between
+        row i and row j (exclusive) is cum_counts[j] - cum_counts[i]
+        """
+        cum_counts = np.zeros((counts.shape[0] + 1, counts.shape[1]), dtype=np.int32)
+        np.cumsum(counts, axis=0, out=cum_counts[1:])
+        return cum_counts
+
     @staticmethod
     def get_source_file():
         return os.path.join(get_app_root_dir(), 'data', 'name_year_trend.json.gzip')
 
+    @staticmethod
+    def get_snapshot_files():
+        data_dir = os.path.join(get_app_root_dir(), 'data')
+        return os.path.join(data_dir, 'name_year_trend.names.json'), \
+            os.path.join(data_dir, 'name_year_trend.genders.npy'), \
+            os.path.join(data_dir, 'name_year_trend.counts.npy'), \
+            os.path.join(data_dir, 'name_year_trend.cum_counts.npy')
+
 
-NAME_STATISTICS = NameStatistics()
+NAME_STATISTICS = register('name_statistics', NameStatistics)
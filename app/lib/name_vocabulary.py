@@ -0,0 +1,127 @@
+"""
+A single vocabulary of names shared by all datasets in app.lib.
+
+Each (name, gender) is assigned a dense integer id at load time, so the datasets can store
+array-indexed columns keyed by id, instead of keeping their own dicts keyed by name strings.
+- The ids of a gender start from 0 and are only valid for that gender.
+- The names of the SSA snapshot (loaded by name_statistics) are interned first and in the order
+  of the snapshot, so their ids are stable across processes; names which only appear in the other
+  datasets get ids after them, in the order in which the datasets are loaded.
+"""
+import os
+import threading
+
+import numpy as np
+
+from typing import Dict, Iterable, List, Sequence, Union
+from app.lib.common import Gender
+
+NO_ID = -1
+
+
+class NameVocabulary:
+
+    def __init__(self):
+        self._names: Dict[Gender, List[str]] = {
+            Gender.GIRL: [],
+            Gender.BOY: []
+        }
+        self._ids: Dict[Gender, Dict[str, int]] = {
+            Gender.GIRL: {},
+            Gender.BOY: {}
+        }
+        self._lock = threading.Lock()
+
+    def intern(self, name: str, gender: Gender) -> int:
+        """
+        :param name: a canonicalized name
+        :return: the id of the name, which is assigned if the name is new
+        """
+        name_id = self._ids[gender].get(name, NO_ID)
+        if name_id != NO_ID:
+            return name_id
+
+        with self._lock:
+            name_id = self._ids[gender].get(name, NO_ID)
+            if name_id == NO_ID:
+                name_id = len(self._names[gender])
+                self._names[gender].append(name)
+                self._ids[gender][name] = name_id
+            return name_id
+
+    def intern_all(self, names: Iterable[str], gender: Gender) -> np.ndarray:
+        return np.asarray([self.intern(name, gender) for name in names], dtype=np.int32)
+
+    def get_id(self, name: str, gender: Gender) -> int:
+        """
+        :param name: a canonicalized name
+        :return: the id of the name, or NO_ID if the name is not in any dataset
+        """
+        return self._ids[gender].get(name, NO_ID)
+
+    def get_ids(self, names: Iterable[str], gender: Gender) -> np.ndarray:
+        return np.asarray([self.get_id(name, gender) for name in names], dtype=np.int32)
+
+    def get_name(self, name_id: int, gender: Gender) -> str:
+        return self._names[gender][name_id]
+
+    def get_names(self, name_ids: Iterable[int], gender: Gender) -> List[str]:
+        names = self._names[gender]
+        return [names[name_id] for name_id in name_ids]
+
+    def size(self, gender: Gender) -> int:
+        return len(self._names[gender])
+
+    def _after_fork_in_child(self):
+        # the process may fork while a dataset is loaded in another thread, between appending a name and
+        # assigning its id
+        if self._lock.locked():
+            for gender, names in self._names.items():
+                self._ids[gender] = {name: name_id for name_id, name in enumerate(names)}
+        self._lock = threading.Lock()
+
+
+def get_by_id(column: Union[Sequence, np.ndarray], name_id: int, default=None):
+    """
+    look up an id-indexed column, which may be shorter than the vocabulary if names were
+    interned after the column had been built
+    """
+    if 0 <= name_id < len(column):
+        return column[name_id]
+    return default
+
+
+def get_by_ids(column: np.ndarray, name_ids: np.ndarray, default) -> np.ndarray:
+    """
+    the vectorized get_by_id() for a numpy column
+    """
+    name_ids = np.asarray(name_ids)
+    in_range = (name_ids >= 0) & (name_ids < len(column))
+    result = np.full(len(name_ids), default, dtype=column.dtype)
+    result[in_range] = column[name_ids[in_range]]
+    return result
+
+
+def create_mask(name_ids: np.ndarray, size: int) -> np.ndarray:
+    """
+    :return: a boolean column with True for the given ids
+    """
+    mask = np.zeros(size, dtype=bool)
+    mask[name_ids] = True
+    return mask
+
+
+def mask_contains(mask: np.ndarray, name_ids: np.ndarray) -> np.ndarray:
+    """
+    :return: for each id, whether it is set in the boolean column; ids beyond the column are not set
+    """
+    name_ids = np.asarray(name_ids)
+    in_range = (name_ids >= 0) & (name_ids < len(mask))
+    result = np.zeros(len(name_ids), dtype=bool)
+    result[in_range] = mask[name_ids[in_range]]
+    return result
+
+
+NAME_VOCABULARY = NameVocabulary()
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=NAME_VOCABULARY._after_fork_in_child)
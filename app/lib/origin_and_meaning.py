@@ -2,8 +2,10 @@
 import json
 import os
 
-from typing import Dict, Tuple, List, Any, Union
+from typing import Dict, Tuple, List, Union
 from app.lib.common import Gender, canonicalize_gender, canonicalize_name, get_app_root_dir
+from app.lib.dataset_registry import register
+from app.lib.name_vocabulary import NAME_VOCABULARY, get_by_id
 import app.lib.name_statistics as ns
 
 
@@ -18,23 +20,51 @@ class OriginMeaning:
         if not gender:
             gender = ns.NAME_STATISTICS.guess_gender(name)
 
-        tmp_dict = self.__osm__[gender].get(name, {})
-        origin = tmp_dict.get('origin', '')
-        short_meaning = tmp_dict.get('short_meaning', '')
-        meaning = tmp_dict.get('meaning', '')
+        name_id = NAME_VOCABULARY.get_id(name, gender)
+        origins, short_meanings, meanings = self.__osm__[gender]
+        origin = get_by_id(origins, name_id, '')
+        short_meaning = get_by_id(short_meanings, name_id, '')
+        meaning = get_by_id(meanings, name_id, '')
         return origin, short_meaning, meaning
 
+    def items(self, gender: Gender):
+        """
+        iterate over (name, {'origin': ..., 'short_meaning': ..., 'meaning': ...}) of all names of the gender
+        """
+        for name_id, columns in enumerate(zip(*self.__osm__[gender])):
+            if any(columns):
+                yield NAME_VOCABULARY.get_name(name_id, gender), \
+                    dict(zip(['origin', 'short_meaning', 'meaning'], columns))
+
     @staticmethod
-    def load_file() -> List[Dict[str, Any]]:
+    def load_file() -> Dict[Gender, Tuple[List[str], List[str], List[str]]]:
+        """
+        each file has the format of
+        {
+            'San': {
+                'origin': '...',
+                'short_meaning': '...',
+                'meaning': '...'
+            },
+            ...
+        }
+        :return: for each gender, the columns of origin, short meaning and meaning, which are
+        indexed by the name id of NAME_VOCABULARY
+        """
         result = {}
+        for gender in [Gender.BOY, Gender.GIRL]:
+            input_filename = OriginMeaning.get_source_file(gender)
+            with open(input_filename, 'r') as fp:
+                raw_dict = json.load(fp)
 
-        input_filename = OriginMeaning.get_source_file(Gender.BOY)
-        with open(input_filename, 'r') as fp:
-            result[Gender.BOY] = json.load(fp)
-
-        input_filename = OriginMeaning.get_source_file(Gender.GIRL)
-        with open(input_filename, 'r') as fp:
-            result[Gender.GIRL] = json.load(fp)
+            name_ids = NAME_VOCABULARY.intern_all([canonicalize_name(x) for x in raw_dict.keys()], gender)
+            size = NAME_VOCABULARY.size(gender)
+            origins, short_meanings, meanings = [''] * size, [''] * size, [''] * size
+            for name_id, val_dict in zip(name_ids, raw_dict.values()):
+                origins[name_id] = val_dict.get('origin', '')
+                short_meanings[name_id] = val_dict.get('short_meaning', '')
+                meanings[name_id] = val_dict.get('meaning', '')
+            result[gender] = (origins, short_meanings, meanings)
 
         return result
 
@@ -43,4 +73,4 @@ class OriginMeaning:
         return os.path.join(get_app_root_dir(), 'data', 'origin_meaning_{gender}.json'.format(gender=str(gender)))
 
 
-ORIGIN_MEANING = OriginMeaning()
+ORIGIN_MEANING = register('origin_meaning', OriginMeaning, depends_on=[ns.NAME_STATISTICS])
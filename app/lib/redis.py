@@ -13,7 +13,7 @@ import time
 import os
 import redis
 
-from typing import Dict, List
+from typing import Dict, List, NamedTuple, Optional
 import app.lib.name_pref as np
 from app.lib.name_sentiments import UserSentiments
 
@@ -138,13 +138,18 @@ def get_user_sentiments(session_id: str, max_count: int = 20) -> UserSentiments:
     pipeline.zrevrange(user_sentiments_sset_key, 0, max_count - 1)
     responses = pipeline.execute()
 
+    return create_user_sentiments(responses[0], responses[1])
+
+
+def create_user_sentiments(raw_user_sentiments: Dict[str, str], latest_names: List[str]) -> UserSentiments:
+    """
+    :param raw_user_sentiments: the hash of the sentiments of a session
+    :param latest_names: the names of the latest sentiments, which are kept
+    """
     # Parse and add NameSentiments preference
-    raw_user_sentiments = responses[0]
     if not raw_user_sentiments:
         return UserSentiments.create_from_dict({})
 
-    # Get the list of the latest names
-    latest_names = responses[1]
     logging.debug(f'latest names from sorted set: {latest_names}')
 
     # Parse the dictionary string
@@ -179,25 +184,40 @@ def get_displayed_names_key(session_id):
     return 'proposal-{}'.format(session_id)
 
 
-def append_displayed_names(session_id: str, names: List[str]):
-    if not names:
-        return
+# KEYS[1]: the sorted set of the displayed names
+# ARGV[1]: the maximum number of tracked names, ARGV[2]: the expiration in seconds, ARGV[3]: the current timestamp,
+# ARGV[4...]: the names
+APPEND_DISPLAYED_NAMES_LUA = """
+local unpack = unpack or table.unpack
+local zadd_args = {}
+for i = 4, #ARGV do
+    table.insert(zadd_args, ARGV[3])
+    table.insert(zadd_args, ARGV[i])
+end
+redis.call('ZADD', KEYS[1], unpack(zadd_args))
+
+-- keep the latest names only
+local trim_count = redis.call('ZCARD', KEYS[1]) - tonumber(ARGV[1])
+if trim_count > 0 then
+    redis.call('ZREMRANGEBYRANK', KEYS[1], 0, trim_count - 1)
+end
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+"""
 
-    pipeline = redis_client.pipeline()
+APPEND_DISPLAYED_NAMES_SCRIPT = redis_client.register_script(APPEND_DISPLAYED_NAMES_LUA)
 
-    # trim the sorted set if needed
-    proposal_key = get_displayed_names_key(session_id)
-    displayed_names_count = redis_client.zcard(proposal_key)
-    trim_count = displayed_names_count + len(names) - MAX_NUM_OF_TRACKED_NAMES
-    if trim_count > 0:
-        pipeline.zremrangebyrank(proposal_key, 0, trim_count)
 
-    # put displayed names in a sorted set
-    pipeline.expire(proposal_key, time=TWO_WEEKS_IN_SECONDS)
-    cur_ts = int(time.time())
-    pipeline.zadd(proposal_key, {x: cur_ts for x in names})
+def append_displayed_names(session_id: str, names: List[str]):
+    """
+    add the names to the displayed names of the session, and trim the oldest names beyond MAX_NUM_OF_TRACKED_NAMES,
+    atomically in one round trip
+    """
+    if not names:
+        return
 
-    pipeline.execute()
+    APPEND_DISPLAYED_NAMES_SCRIPT(keys=[get_displayed_names_key(session_id)],
+                                  args=[MAX_NUM_OF_TRACKED_NAMES, TWO_WEEKS_IN_SECONDS, int(time.time())] + names,
+                                  client=redis_client)
 
 
 def get_displayed_names(session_id, max_count=100) -> List[str]:
@@ -212,35 +232,79 @@ def get_displayed_names(session_id, max_count=100) -> List[str]:
 Write a job for background job to generate recommend reasons
 - name proposal reason job: a shared list for the background job to fetch 
 - name proposal reason: a user-specific hash with the name as key and with the reason as value
+- pending names: a user-specific set of the names in the queued or in-flight jobs, which are not queued again
 """
 
 
 PROPOSAL_REASON_JOB_QUEUE_KEY = 'reason_job_que'
+# the pending names are queued again after the expiration, if a job is lost
+PENDING_REASON_NAMES_TTL_SECONDS = 60 * 60
 
 
 def get_recommendation_reason_key(session_id):
     return 'proposal-reason-{}'.format(session_id)
 
 
+def get_pending_reason_names_key(session_id):
+    return 'proposal-reason-pending-{}'.format(session_id)
+
+
+# the JSON string literal of a value; the quotes, the backslashes and the control characters are escaped as \uXXXX,
+# and the other characters are kept as they are (UTF-8)
+LUA_JSON_QUOTE = r"""
+local function json_quote(value)
+    local escaped = string.gsub(value, '[%c"\\]', function(c)
+        return string.format('\\u%04x', string.byte(c))
+    end)
+    return '"' .. escaped .. '"'
+end
+"""
+
+# KEYS[1]: the hash of the recommendation reasons of the session, KEYS[2]: the job queue, KEYS[3]: the pending names
+# of the session
+# ARGV[1]: the session id, ARGV[2]: the expiration of the job queue in seconds, ARGV[3]: the expiration of the pending
+# names in seconds, ARGV[4...]: the names
+# :return: the job string, or nil if all names already have recommendation reasons or are pending
+ADD_RECOMMENDATION_JOB_LUA = LUA_JSON_QUOTE + """
+local names = {}
+for i = 4, #ARGV do
+    -- SADD also skips the names repeated in ARGV
+    if redis.call('HEXISTS', KEYS[1], ARGV[i]) == 0 and redis.call('SADD', KEYS[3], ARGV[i]) == 1 then
+        table.insert(names, json_quote(ARGV[i]))
+    end
+end
+if #names == 0 then
+    return nil
+end
+redis.call('EXPIRE', KEYS[3], ARGV[3])
+
+-- the same format as create_job_string()
+local job = '{"session_id": ' .. json_quote(ARGV[1]) .. ', "names": [' .. table.concat(names, ', ') .. ']}'
+redis.call('RPUSH', KEYS[2], job)
+redis.call('EXPIRE', KEYS[2], ARGV[2])
+return job
+"""
+
+ADD_RECOMMENDATION_JOB_SCRIPT = redis_client.register_script(ADD_RECOMMENDATION_JOB_LUA)
+
+
 def add_recommendation_job(session_id: str, proposed_names: List[str]):
-    # filter out names which already had recommendation reason
-    names_reasons = get_proposal_reasons(session_id)
-    names_need_recommend_reason = []
-    for name in proposed_names:
-        if name in names_reasons:
-            continue
-        names_need_recommend_reason.append(name)
+    """
+    push a job for the names which neither have recommendation reasons nor are pending yet, atomically in one round
+    trip
+    """
+    if not proposed_names:
+        return
 
-    if not names_need_recommend_reason:
+    job_que_str = ADD_RECOMMENDATION_JOB_SCRIPT(
+        keys=[get_recommendation_reason_key(session_id), PROPOSAL_REASON_JOB_QUEUE_KEY,
+              get_pending_reason_names_key(session_id)],
+        args=[session_id, TWO_WEEKS_IN_SECONDS, PENDING_REASON_NAMES_TTL_SECONDS] + proposed_names,
+        client=redis_client)
+    if not job_que_str:
         logging.debug('no recommend reason is required for session: {}'.format(session_id))
         return
 
-    job_que_str = create_job_string(session_id, names_need_recommend_reason)
-    pipeline = redis_client.pipeline()
-    pipeline.rpush(PROPOSAL_REASON_JOB_QUEUE_KEY, job_que_str)
-    pipeline.expire(PROPOSAL_REASON_JOB_QUEUE_KEY, time=TWO_WEEKS_IN_SECONDS)
-    pipeline.execute()
-
     logging.debug('Writing job with session id {} to job queue: {}'.format(
         session_id, job_que_str))
 
@@ -253,7 +317,7 @@ def create_job_string(session_id: str, names: List[str]) -> str:
     return json.dumps(output_dict)
 
 
-def update_name_proposal_reasons(session_id, proposal_reasons: Dict[str, str], clear_job_que=True):
+def update_name_proposal_reasons(session_id, proposal_reasons: Dict[str, str]):
     if not proposal_reasons:
         return
 
@@ -263,12 +327,65 @@ def update_name_proposal_reasons(session_id, proposal_reasons: Dict[str, str], c
     pipeline.hset(proposal_reason_key, mapping=proposal_reasons)
     pipeline.expire(proposal_reason_key, time=TWO_WEEKS_IN_SECONDS)
 
-    if clear_job_que:
-        pipeline.lrem(PROPOSAL_REASON_JOB_QUEUE_KEY, 1, session_id)
-
     pipeline.execute()
 
 
+"""
+The reliable queue of the proposal reason jobs (see app.lib.redis_async), so a job is not lost when a worker crashes
+while handling it
+- a worker moves a job from the job queue to its own processing list (BLMOVE), and removes the job from the list
+  after handling it
+- the workers write a heartbeat to a shared sorted set (worker id -> timestamp); the jobs in the processing list of a
+  worker without a recent heartbeat are moved back to the head of the job queue
+"""
+
+
+REASON_WORKER_HEARTBEAT_KEY = 'reason_worker_heartbeat'
+REASON_WORKER_STALE_SECONDS = 5 * 60
+
+
+def get_reason_processing_list_key(worker_id: str):
+    return '{}:processing:{}'.format(PROPOSAL_REASON_JOB_QUEUE_KEY, worker_id)
+
+
+# KEYS[1]: the job queue, KEYS[2]: the heartbeats of the workers
+# ARGV[1]: the timestamp before which a heartbeat is stale, ARGV[2] (optional): the id of a starting worker, whose jobs
+# left by its previous run are reclaimed as well
+# :return: the number of the reclaimed jobs
+# The processing lists are not passed as KEYS because they are only known from the heartbeats, which is fine for a
+# non-cluster Redis.
+RECLAIM_REASON_JOBS_LUA = """
+local worker_ids = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', '(' .. ARGV[1])
+if ARGV[2] then
+    table.insert(worker_ids, ARGV[2])
+end
+
+local count = 0
+for _, worker_id in ipairs(worker_ids) do
+    local processing_key = KEYS[1] .. ':processing:' .. worker_id
+    -- the oldest job ends up at the head of the job queue
+    while redis.call('LMOVE', processing_key, KEYS[1], 'RIGHT', 'LEFT') do
+        count = count + 1
+    end
+    redis.call('ZREM', KEYS[2], worker_id)
+end
+return count
+"""
+
+
+"""
+The proposal reasons shared by the sessions with the same user context (see app.lib.redis_async), which is a hash
+with the name as key and with the reason as value
+"""
+
+
+SHARED_PROPOSAL_REASONS_TTL_SECONDS = 7 * 24 * 60 * 60
+
+
+def get_shared_proposal_reasons_key(context_digest: str):
+    return 'shared-proposal-reason-{}'.format(context_digest)
+
+
 def get_proposal_reason_for_name(session_id, name) -> str:
     proposal_key = get_recommendation_reason_key(session_id)
     return redis_client.hget(proposal_key, name)
@@ -277,3 +394,161 @@ def get_proposal_reason_for_name(session_id, name) -> str:
 def get_proposal_reasons(session_id) -> Dict[str, str]:
     proposal_key = get_recommendation_reason_key(session_id)
     return redis_client.hgetall(proposal_key)
+
+
+"""
+Fetch the data of a session which is used by a suggest request in one round trip
+"""
+
+
+class SessionSnapshot(NamedTuple):
+    session_id: str
+    user_prefs: Dict[str, np.PrefInterface]
+    user_sentiments: UserSentiments
+    # the latest displayed names first
+    displayed_names: List[str]
+    # only fetched when requested with include_reasons
+    proposal_reasons: Dict[str, str]
+
+
+def get_session_snapshot(session_id: str, max_sentiment_count: int = 20, max_displayed_count: int = 100,
+                         include_reasons: bool = False) -> SessionSnapshot:
+    """
+    :return: the preferences, the latest sentiments, the displayed names and, if include_reasons, the
+    recommendation reasons of the session, which are fetched in a single pipeline
+    """
+    pipeline = redis_client.pipeline()
+    add_session_snapshot_commands(pipeline, session_id, max_sentiment_count, max_displayed_count, include_reasons)
+    return create_session_snapshot(session_id, pipeline.execute())
+
+
+def add_session_snapshot_commands(pipeline, session_id: str, max_sentiment_count: int, max_displayed_count: int,
+                                  include_reasons: bool = False):
+    pipeline.hgetall(get_pref_key(session_id))
+    pipeline.hgetall(get_user_sentiments_hash_key(session_id))
+    pipeline.zrevrange(get_user_sentiments_sset_key(session_id), 0, max_sentiment_count - 1)
+    pipeline.zrevrange(get_displayed_names_key(session_id), 0, max_displayed_count)
+    if include_reasons:
+        pipeline.hgetall(get_recommendation_reason_key(session_id))
+
+
+def create_session_snapshot(session_id: str, responses: list) -> SessionSnapshot:
+    """
+    :param responses: the responses of the commands added by add_session_snapshot_commands()
+    """
+    raw_prefs, raw_sentiments, latest_sentiment_names, displayed_names = responses[:4]
+    logging.debug('raw_general_pref from redis: {}'.format(raw_prefs))
+    return SessionSnapshot(
+        session_id=session_id,
+        user_prefs=np.str_dict_to_class_dict(raw_prefs),
+        user_sentiments=create_user_sentiments(raw_sentiments, latest_sentiment_names),
+        displayed_names=displayed_names,
+        proposal_reasons=responses[4] if len(responses) > 4 else {}
+    )
+
+
+"""
+Cache the embeddings of texts, keyed by the hash of the model and the text.
+The embeddings are stored as the raw bytes of float32 arrays, so they are read with a client which does not decode
+the responses.
+"""
+EMBEDDING_CACHE_TTL_SECONDS = 30 * 24 * 60 * 60
+
+redis_bytes_client = redis.StrictRedis(host=redis_host, port=redis_port)
+
+
+def get_embedding_key(digest: str):
+    return 'embedding-{}'.format(digest)
+
+
+def get_cached_embedding(digest: str) -> Optional[bytes]:
+    return redis_bytes_client.get(get_embedding_key(digest))
+
+
+def cache_embedding(digest: str, embedding_bytes: bytes):
+    redis_bytes_client.set(get_embedding_key(digest), embedding_bytes, ex=EMBEDDING_CACHE_TTL_SECONDS)
+
+
+# the client of the readiness probe, which fails fast rather than waiting for an unresponsive Redis
+HEALTH_CHECK_TIMEOUT_SECONDS = 1
+health_check_client = redis.StrictRedis(host=redis_host, port=redis_port, socket_timeout=HEALTH_CHECK_TIMEOUT_SECONDS,
+                                        socket_connect_timeout=HEALTH_CHECK_TIMEOUT_SECONDS)
+
+
+def get_ping_latency_ms() -> float:
+    """
+    :return: the round-trip latency of a PING to Redis; raises the redis error if Redis is unreachable or does not
+    respond within HEALTH_CHECK_TIMEOUT_SECONDS
+    """
+    start_ts = time.perf_counter()
+    health_check_client.ping()
+    return round((time.perf_counter() - start_ts) * 1000, 2)
+
+
+"""
+Cache the names proposed by ChatGPT, keyed by the hash of the normalized user context.
+- proposed names: a string key per context with the json list of names, which expires after a day
+- proposed names index: a sorted set of the cached contexts by the time they were cached, which is used to evict
+  the oldest contexts once there are more than MAX_NUM_OF_CACHED_PROPOSALS
+"""
+PROPOSED_NAMES_CACHE_TTL_SECONDS = 24 * 60 * 60
+MAX_NUM_OF_CACHED_PROPOSALS = 10000
+PROPOSED_NAMES_INDEX_KEY = 'proposed_names_index'
+PROPOSED_NAMES_KEY_PREFIX = 'proposed-names-'
+
+
+def get_proposed_names_key(digest: str):
+    return PROPOSED_NAMES_KEY_PREFIX + digest
+
+
+# KEYS[1]: the proposed names of the context, KEYS[2]: the proposed names index
+# ARGV[1]: the json list of names, ARGV[2]: the expiration in seconds, ARGV[3]: the current timestamp,
+# ARGV[4]: the maximum number of cached contexts, ARGV[5]: the digest of the context, ARGV[6]: the key prefix of the
+# proposed names
+# The keys of the evicted contexts are not passed as KEYS because they are only known from the index, which is fine for
+# a non-cluster Redis.
+CACHE_PROPOSED_NAMES_LUA = """
+local unpack = unpack or table.unpack
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+redis.call('ZADD', KEYS[2], ARGV[3], ARGV[5])
+-- the expired contexts are dropped from the index
+redis.call('ZREMRANGEBYSCORE', KEYS[2], 0, tonumber(ARGV[3]) - tonumber(ARGV[2]))
+
+local evict_count = redis.call('ZCARD', KEYS[2]) - tonumber(ARGV[4])
+if evict_count > 0 then
+    local evicted_digests = redis.call('ZRANGE', KEYS[2], 0, evict_count - 1)
+    for _, digest in ipairs(evicted_digests) do
+        redis.call('DEL', ARGV[6] .. digest)
+    end
+    redis.call('ZREM', KEYS[2], unpack(evicted_digests))
+end
+"""
+
+CACHE_PROPOSED_NAMES_SCRIPT = redis_client.register_script(CACHE_PROPOSED_NAMES_LUA)
+
+
+def parse_cached_proposed_names(names_str: Optional[str]) -> Optional[List[str]]:
+    return json.loads(names_str) if names_str else None
+
+
+def get_cache_proposed_names_script_args(digest: str, names: List[str]):
+    """
+    :return: the keys and the args of CACHE_PROPOSED_NAMES_SCRIPT, which are shared with app.lib.redis_async
+    """
+    keys = [get_proposed_names_key(digest), PROPOSED_NAMES_INDEX_KEY]
+    args = [json.dumps(names), PROPOSED_NAMES_CACHE_TTL_SECONDS, int(time.time()), MAX_NUM_OF_CACHED_PROPOSALS, digest,
+            PROPOSED_NAMES_KEY_PREFIX]
+    return keys, args
+
+
+def get_cached_proposed_names(digest: str) -> Optional[List[str]]:
+    return parse_cached_proposed_names(redis_client.get(get_proposed_names_key(digest)))
+
+
+def cache_proposed_names(digest: str, names: List[str]):
+    """
+    cache the names of the context, and evict the oldest contexts beyond MAX_NUM_OF_CACHED_PROPOSALS, atomically in
+    one round trip
+    """
+    keys, args = get_cache_proposed_names_script_args(digest, names)
+    CACHE_PROPOSED_NAMES_SCRIPT(keys=keys, args=args, client=redis_client)
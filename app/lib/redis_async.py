@@ -0,0 +1,199 @@
+"""
+The asyncio counterpart of app.lib.redis, for the async serving path (app.asgi) and for the proposal reason worker.
+The data structures and the keys are the same as those of app.lib.redis, so the data written by either module is read
+by the other.
+"""
+import json
+import logging
+import os
+import time
+
+import redis.asyncio
+
+from typing import Dict, List, Optional
+import app.lib.name_pref as np
+import app.lib.redis as redis_lib
+from app.lib.name_sentiments import UserSentiments
+
+# the coroutines share the connections of the pool, and wait for a free connection once all are in use
+REDIS_MAX_CONNECTIONS = int(os.environ.get("REDIS_MAX_CONNECTIONS", 100))
+connection_pool = redis.asyncio.BlockingConnectionPool(host=redis_lib.redis_host, port=redis_lib.redis_port,
+                                                       decode_responses=True, max_connections=REDIS_MAX_CONNECTIONS)
+redis_client = redis.asyncio.StrictRedis(connection_pool=connection_pool)
+
+# the Lua scripts of app.lib.redis, which are invoked with the client given on each call
+APPEND_DISPLAYED_NAMES_SCRIPT = redis_client.register_script(redis_lib.APPEND_DISPLAYED_NAMES_LUA)
+ADD_RECOMMENDATION_JOB_SCRIPT = redis_client.register_script(redis_lib.ADD_RECOMMENDATION_JOB_LUA)
+RECLAIM_REASON_JOBS_SCRIPT = redis_client.register_script(redis_lib.RECLAIM_REASON_JOBS_LUA)
+CACHE_PROPOSED_NAMES_SCRIPT = redis_client.register_script(redis_lib.CACHE_PROPOSED_NAMES_LUA)
+
+
+async def update_user_pref(session_id, user_prefs: Dict[str, np.PrefInterface], delete_before_updating=False):
+    if len(user_prefs) == 0:
+        return True
+
+    pref_dict = np.class_dict_to_str_dict(user_prefs)
+
+    pipeline = redis_client.pipeline()
+    pref_key = redis_lib.get_pref_key(session_id)
+    if delete_before_updating:
+        pipeline.delete(pref_key)
+    pipeline.hset(pref_key, mapping=pref_dict)
+    pipeline.zadd(redis_lib.LAST_PREF_UPDATE_TS_KEY, mapping={session_id: int(time.time())})
+    await pipeline.execute()
+
+    return True
+
+
+async def get_user_pref(session_id: str) -> Dict[str, np.PrefInterface]:
+    raw_general_pref = await redis_client.hgetall(redis_lib.get_pref_key(session_id))
+    logging.debug('raw_general_pref from redis: {}'.format(raw_general_pref))
+    return np.str_dict_to_class_dict(raw_general_pref)
+
+
+async def update_user_sentiments(session_id, name_sentiments: UserSentiments):
+    if not name_sentiments:
+        return True
+
+    cur_ts = int(time.time())
+    name_sentiments_str = {}
+    name_ts = {}
+    for name, sentiments_dict in name_sentiments.get_native_val().items():
+        name_sentiments_str[name] = json.dumps(sentiments_dict)
+        name_ts[name] = cur_ts
+
+    pipeline = redis_client.pipeline()
+    pipeline.hset(redis_lib.get_user_sentiments_hash_key(session_id), mapping=name_sentiments_str)
+    pipeline.zadd(redis_lib.get_user_sentiments_sset_key(session_id), name_ts)
+    await pipeline.execute()
+
+    return True
+
+
+async def get_user_sentiments(session_id: str, max_count: int = 20) -> UserSentiments:
+    pipeline = redis_client.pipeline()
+    pipeline.hgetall(redis_lib.get_user_sentiments_hash_key(session_id))
+    pipeline.zrevrange(redis_lib.get_user_sentiments_sset_key(session_id), 0, max_count - 1)
+    responses = await pipeline.execute()
+
+    return redis_lib.create_user_sentiments(responses[0], responses[1])
+
+
+async def append_displayed_names(session_id: str, names: List[str]):
+    if not names:
+        return
+
+    await APPEND_DISPLAYED_NAMES_SCRIPT(
+        keys=[redis_lib.get_displayed_names_key(session_id)],
+        args=[redis_lib.MAX_NUM_OF_TRACKED_NAMES, redis_lib.TWO_WEEKS_IN_SECONDS, int(time.time())] + names,
+        client=redis_client)
+
+
+async def get_displayed_names(session_id, max_count=100) -> List[str]:
+    return await redis_client.zrevrange(redis_lib.get_displayed_names_key(session_id), 0, max_count)
+
+
+async def add_recommendation_job(session_id: str, proposed_names: List[str]):
+    if not proposed_names:
+        return
+
+    job_que_str = await ADD_RECOMMENDATION_JOB_SCRIPT(
+        keys=[redis_lib.get_recommendation_reason_key(session_id), redis_lib.PROPOSAL_REASON_JOB_QUEUE_KEY,
+              redis_lib.get_pending_reason_names_key(session_id)],
+        args=[session_id, redis_lib.TWO_WEEKS_IN_SECONDS, redis_lib.PENDING_REASON_NAMES_TTL_SECONDS] + proposed_names,
+        client=redis_client)
+    if not job_que_str:
+        logging.debug('no recommend reason is required for session: {}'.format(session_id))
+        return
+
+    logging.debug('Writing job with session id {} to job queue: {}'.format(session_id, job_que_str))
+
+
+async def remove_pending_reason_names(session_id: str, names: List[str]):
+    """
+    allow the names to be queued again, after their job is completed or failed
+    """
+    if names:
+        await redis_client.srem(redis_lib.get_pending_reason_names_key(session_id), *names)
+
+
+async def update_name_proposal_reasons(session_id, proposal_reasons: Dict[str, str]):
+    if not proposal_reasons:
+        return
+
+    pipeline = redis_client.pipeline()
+    proposal_reason_key = redis_lib.get_recommendation_reason_key(session_id)
+    pipeline.hset(proposal_reason_key, mapping=proposal_reasons)
+    pipeline.expire(proposal_reason_key, time=redis_lib.TWO_WEEKS_IN_SECONDS)
+    await pipeline.execute()
+
+
+async def get_proposal_reasons(session_id) -> Dict[str, str]:
+    return await redis_client.hgetall(redis_lib.get_recommendation_reason_key(session_id))
+
+
+async def reclaim_reason_jobs(starting_worker_id: Optional[str] = None) -> int:
+    """
+    move the in-flight jobs of the stale workers back to the job queue
+    :param starting_worker_id: the id of a starting worker, whose jobs left by its previous run are reclaimed as well
+    :return: the number of the reclaimed jobs
+    """
+    args = [int(time.time()) - redis_lib.REASON_WORKER_STALE_SECONDS]
+    if starting_worker_id:
+        args.append(starting_worker_id)
+    return await RECLAIM_REASON_JOBS_SCRIPT(
+        keys=[redis_lib.PROPOSAL_REASON_JOB_QUEUE_KEY, redis_lib.REASON_WORKER_HEARTBEAT_KEY], args=args,
+        client=redis_client)
+
+
+async def send_reason_worker_heartbeat(worker_id: str):
+    await redis_client.zadd(redis_lib.REASON_WORKER_HEARTBEAT_KEY, {worker_id: int(time.time())})
+
+
+async def pop_reason_job(worker_id: str, timeout: int) -> Optional[str]:
+    """
+    :return: the oldest job, which is kept in the processing list of the worker until ack_reason_job() is called,
+        or None after the timeout in seconds
+    """
+    return await redis_client.blmove(redis_lib.PROPOSAL_REASON_JOB_QUEUE_KEY,
+                                     redis_lib.get_reason_processing_list_key(worker_id), timeout,
+                                     src='LEFT', dest='RIGHT')
+
+
+async def ack_reason_job(worker_id: str, job_str: str):
+    await redis_client.lrem(redis_lib.get_reason_processing_list_key(worker_id), 1, job_str)
+
+
+async def get_shared_proposal_reasons(context_digest: str, names: List[str]) -> Dict[str, str]:
+    if not names:
+        return {}
+    reasons = await redis_client.hmget(redis_lib.get_shared_proposal_reasons_key(context_digest), names)
+    return {name: reason for name, reason in zip(names, reasons) if reason}
+
+
+async def cache_shared_proposal_reasons(context_digest: str, proposal_reasons: Dict[str, str]):
+    if not proposal_reasons:
+        return
+
+    pipeline = redis_client.pipeline()
+    shared_reasons_key = redis_lib.get_shared_proposal_reasons_key(context_digest)
+    pipeline.hset(shared_reasons_key, mapping=proposal_reasons)
+    pipeline.expire(shared_reasons_key, time=redis_lib.SHARED_PROPOSAL_REASONS_TTL_SECONDS)
+    await pipeline.execute()
+
+
+async def get_session_snapshot(session_id: str, max_sentiment_count: int = 20, max_displayed_count: int = 100,
+                               include_reasons: bool = False) -> redis_lib.SessionSnapshot:
+    pipeline = redis_client.pipeline()
+    redis_lib.add_session_snapshot_commands(pipeline, session_id, max_sentiment_count, max_displayed_count,
+                                            include_reasons)
+    return redis_lib.create_session_snapshot(session_id, await pipeline.execute())
+
+
+async def get_cached_proposed_names(digest: str) -> Optional[List[str]]:
+    return redis_lib.parse_cached_proposed_names(await redis_client.get(redis_lib.get_proposed_names_key(digest)))
+
+
+async def cache_proposed_names(digest: str, names: List[str]):
+    keys, args = redis_lib.get_cache_proposed_names_script_args(digest, names)
+    await CACHE_PROPOSED_NAMES_SCRIPT(keys=keys, args=args, client=redis_client)
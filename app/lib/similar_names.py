@@ -4,6 +4,8 @@ import logging
 
 from typing import Dict, Tuple, List, Any, Union
 from .common import Gender, canonicalize_gender, canonicalize_name, get_app_root_dir
+from .dataset_registry import register
+from .name_vocabulary import NAME_VOCABULARY, get_by_id
 import app.lib.name_statistics as ns
 
 
@@ -14,32 +16,55 @@ class SimilarNames:
     def get(self, raw_name: str, raw_gender: Union[str, Gender] = None) -> List[str]:
         name = canonicalize_name(raw_name)
         gender = canonicalize_gender(raw_gender)
-        if gender:
+        if not gender:
             gender = ns.NAME_STATISTICS.guess_gender(name)
 
-        return self.__similar_names__[gender].get(name, [])
+        similar_ids = get_by_id(self.__similar_names__[gender], NAME_VOCABULARY.get_id(name, gender))
+        if similar_ids is None:
+            return []
+        return NAME_VOCABULARY.get_names(similar_ids, gender)
+
+    def items(self, gender: Gender):
+        """
+        iterate over (name, similar names) of all names of the gender
+        """
+        for name_id, similar_ids in enumerate(self.__similar_names__[gender]):
+            if similar_ids is not None:
+                yield NAME_VOCABULARY.get_name(name_id, gender), NAME_VOCABULARY.get_names(similar_ids, gender)
 
     @staticmethod
     def load_file():
         """
         The input has the format of
         {
-            'San': ["wynnie", "miller", "everley", ...],
-            ...
+            'boy': {
+                'San': ["wynnie", "miller", "everley", ...],
+                ...
+            },
+            'girl': {...}
         {
-        :return:
+        :return: for each gender, a list indexed by the name id of NAME_VOCABULARY, with the value of
+        an array of the ids of similar names, or None for names without similar names
         """
         json_filename = SimilarNames.get_source_file()
         with open(json_filename, 'r') as fin:
             data = json.load(fin)
 
-        output = {
-            Gender.BOY: data[str(Gender.BOY)],
-            Gender.GIRL: data[str(Gender.GIRL)]
-        }
+        output = {}
+        for gender in [Gender.BOY, Gender.GIRL]:
+            similar_ids_by_id = {}
+            for raw_name, similar_names in data[str(gender)].items():
+                name_id = NAME_VOCABULARY.intern(canonicalize_name(raw_name), gender)
+                similar_ids_by_id[name_id] = NAME_VOCABULARY.intern_all(
+                    [canonicalize_name(x) for x in similar_names], gender)
+
+            column = [None] * NAME_VOCABULARY.size(gender)
+            for name_id, similar_ids in similar_ids_by_id.items():
+                column[name_id] = similar_ids
+            output[gender] = column
 
         logging.info("similar names: loaded number of boy names: {} and number of girl names: {}".format(
-            len(output[Gender.BOY]), len(output[Gender.GIRL])))
+            len(data[str(Gender.BOY)]), len(data[str(Gender.GIRL)])))
 
         return output
 
@@ -48,4 +73,4 @@ class SimilarNames:
         return os.path.join(get_app_root_dir(), 'data', 'similar_names_04_13.json')
 
 
-SIMILAR_NAMES = SimilarNames()
+SIMILAR_NAMES = register('similar_names', SimilarNames, depends_on=[ns.NAME_STATISTICS])
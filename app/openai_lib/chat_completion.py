@@ -1,23 +1,66 @@
+import hashlib
 import logging
 import openai
 import os
 import json
+import threading
 import time
 
-from typing import Dict, List, Set
+import redis
+
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Set, Tuple
 from app.lib import name_pref as np
+import app.lib.redis as redis_lib
+import app.lib.redis_async as redis_async
 from app.lib.name_sentiments import UserSentiments
 import app.openai_lib.prompt as prompt
 from app.lib.common import Gender
 
 API_KEY = os.getenv("OPENAI_API_KEY")
-client = openai.OpenAI(api_key='')
+# OPENAI_BASE_URL points the clients to another endpoint, e.g. the stub of tools.load_test_suggest
+client = openai.OpenAI(api_key='', base_url=os.getenv("OPENAI_BASE_URL"))
+async_client = openai.AsyncOpenAI(api_key='', base_url=os.getenv("OPENAI_BASE_URL"))
+
+
+PROPOSE_NAMES_MODEL = "gpt-4-1106-preview"
 
 
 class InvalidResponse(json.decoder.JSONDecodeError):
     pass
 
 
+class CacheStats:
+    """
+    the hits and misses of a cache in this process
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def record(self, hit: bool):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get_hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return round(self.hits / float(total), 4) if total else 0.0
+
+    def to_dict(self) -> Dict[str, float]:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.get_hit_rate()
+        }
+
+
+PROPOSED_NAMES_CACHE_STATS = CacheStats()
+
+
 def check_proposed_names(proposed_names: List[str],
                          user_prefs: Dict[str, np.PrefInterface],
                          user_sentiments: UserSentiments,
@@ -91,16 +134,13 @@ User's input:
     return final_names
 
 
-def propose_names(gender: Gender,
-                  user_prefs: Dict[str, np.PrefInterface],
-                  user_sentiments: UserSentiments,
-                  names_to_avoid: Set[str],
-                  max_count: int):
+def create_propose_names_messages(gender: Gender,
+                                  pref_summary: str,
+                                  sentiment_summary: str,
+                                  names_to_avoid: Set[str],
+                                  max_count: int) -> List[Dict[str, str]]:
     system_msg = "You are a helpful assistant to propose names for a newborn based on user's input"
 
-    sentiment_summary = prompt.create_summary_of_user_sentiments(user_sentiments)
-    pref_summary = prompt.create_text_from_user_pref(user_prefs)
-
     user_prompt = """
 Please propose {max_count} names for a {gender} newborn based on user's input.
 
@@ -123,24 +163,84 @@ Please do not suggest the following names:
 
     logging.debug(f"user_prompt: {user_prompt}")
 
+    return [
+        {
+            "role": "system",
+            "content": system_msg
+        },
+        {
+            "role": "user",
+            "content": user_prompt
+        }
+    ]
+
+
+def propose_names(gender: Gender,
+                  user_prefs: Dict[str, np.PrefInterface],
+                  user_sentiments: UserSentiments,
+                  names_to_avoid: Set[str],
+                  max_count: int):
+    sentiment_summary = prompt.create_summary_of_user_sentiments(user_sentiments)
+    pref_summary = prompt.create_text_from_user_pref(user_prefs)
+
+    digest = get_user_context_digest(gender, pref_summary, sentiment_summary, names_to_avoid, max_count)
+    cached_names = get_cached_proposed_names(digest)
+    if cached_names is not None:
+        return cached_names
+
     start_ts = int(time.time())
     response = client.with_options(max_retries=2, timeout=15).chat.completions.create(
         # GPT 3.5 seems not able to reason well
         # model="gpt-3.5-turbo-1106",
-        model="gpt-4-1106-preview",
+        model=PROPOSE_NAMES_MODEL,
         response_format={"type": "json_object"},
-        messages=[
-            {
-                "role": "system",
-                "content": system_msg
-            },
-            {
-                "role": "user",
-                "content": user_prompt
-            }
-        ]
+        messages=create_propose_names_messages(gender, pref_summary, sentiment_summary, names_to_avoid, max_count)
+    )
+
+    final_names, stop_reason = parse_proposed_names(response, start_ts)
+
+    # an incomplete response is not cached, so the next request with the same context asks again
+    if final_names and stop_reason == 'stop':
+        cache_proposed_names(digest, final_names)
+
+    return final_names
+
+
+async def propose_names_async(gender: Gender,
+                              user_prefs: Dict[str, np.PrefInterface],
+                              user_sentiments: UserSentiments,
+                              names_to_avoid: Set[str],
+                              max_count: int):
+    """
+    the asyncio variant of propose_names(), which does not block the event loop while ChatGPT is responding
+    """
+    sentiment_summary = prompt.create_summary_of_user_sentiments(user_sentiments)
+    pref_summary = prompt.create_text_from_user_pref(user_prefs)
+
+    digest = get_user_context_digest(gender, pref_summary, sentiment_summary, names_to_avoid, max_count)
+    cached_names = await get_cached_proposed_names_async(digest)
+    if cached_names is not None:
+        return cached_names
+
+    start_ts = int(time.time())
+    response = await async_client.with_options(max_retries=2, timeout=15).chat.completions.create(
+        model=PROPOSE_NAMES_MODEL,
+        response_format={"type": "json_object"},
+        messages=create_propose_names_messages(gender, pref_summary, sentiment_summary, names_to_avoid, max_count)
     )
 
+    final_names, stop_reason = parse_proposed_names(response, start_ts)
+
+    if final_names and stop_reason == 'stop':
+        await cache_proposed_names_async(digest, final_names)
+
+    return final_names
+
+
+def parse_proposed_names(response, start_ts: int) -> Tuple[List[str], str]:
+    """
+    :return: the names in the response of ChatGPT, and the reason why ChatGPT stopped
+    """
     stop_reason = response.choices[0].finish_reason
     if stop_reason != 'stop':
         logging.warning('The stop reason is {}'.format(stop_reason))
@@ -155,4 +255,235 @@ Please do not suggest the following names:
         logging.exception(e, exc_info=True)
         raise e
 
-    return final_names
+    return final_names, stop_reason
+
+
+def stream_proposed_names(gender: Gender,
+                          user_prefs: Dict[str, np.PrefInterface],
+                          user_sentiments: UserSentiments,
+                          names_to_avoid: Set[str],
+                          max_count: int) -> Iterator[str]:
+    """
+    the streaming variant of propose_names(), which yields each name as soon as ChatGPT completes it
+    """
+    sentiment_summary = prompt.create_summary_of_user_sentiments(user_sentiments)
+    pref_summary = prompt.create_text_from_user_pref(user_prefs)
+
+    digest = get_user_context_digest(gender, pref_summary, sentiment_summary, names_to_avoid, max_count)
+    cached_names = get_cached_proposed_names(digest)
+    if cached_names is not None:
+        yield from cached_names
+        return
+
+    start_ts = time.perf_counter()
+    stream = client.with_options(max_retries=2, timeout=15).chat.completions.create(
+        model=PROPOSE_NAMES_MODEL,
+        response_format={"type": "json_object"},
+        messages=create_propose_names_messages(gender, pref_summary, sentiment_summary, names_to_avoid, max_count),
+        stream=True
+    )
+
+    parser = StreamingNamesParser("names")
+    final_names = []
+    stop_reason = None
+    for chunk in stream:
+        if not chunk.choices:
+            continue
+        stop_reason = chunk.choices[0].finish_reason or stop_reason
+        for name in parser.feed(chunk.choices[0].delta.content or ''):
+            if not final_names:
+                logging.info('ChatGPT streamed the first name in {}ms'.format(
+                    int((time.perf_counter() - start_ts) * 1000)))
+            final_names.append(name)
+            yield name
+
+    if stop_reason != 'stop':
+        logging.warning('The stop reason is {}'.format(stop_reason))
+    logging.info('ChatGPT streamed {} names in {} seconds'.format(
+        len(final_names), int(time.perf_counter() - start_ts)))
+    logging.info('ChatGPT raw output: {}'.format(parser.get_text()))
+
+    if final_names and stop_reason == 'stop':
+        cache_proposed_names(digest, final_names)
+
+
+async def stream_proposed_names_async(gender: Gender,
+                                      user_prefs: Dict[str, np.PrefInterface],
+                                      user_sentiments: UserSentiments,
+                                      names_to_avoid: Set[str],
+                                      max_count: int) -> AsyncIterator[str]:
+    """
+    the asyncio variant of stream_proposed_names()
+    """
+    sentiment_summary = prompt.create_summary_of_user_sentiments(user_sentiments)
+    pref_summary = prompt.create_text_from_user_pref(user_prefs)
+
+    digest = get_user_context_digest(gender, pref_summary, sentiment_summary, names_to_avoid, max_count)
+    cached_names = await get_cached_proposed_names_async(digest)
+    if cached_names is not None:
+        for name in cached_names:
+            yield name
+        return
+
+    start_ts = time.perf_counter()
+    stream = await async_client.with_options(max_retries=2, timeout=15).chat.completions.create(
+        model=PROPOSE_NAMES_MODEL,
+        response_format={"type": "json_object"},
+        messages=create_propose_names_messages(gender, pref_summary, sentiment_summary, names_to_avoid, max_count),
+        stream=True
+    )
+
+    parser = StreamingNamesParser("names")
+    final_names = []
+    stop_reason = None
+    async for chunk in stream:
+        if not chunk.choices:
+            continue
+        stop_reason = chunk.choices[0].finish_reason or stop_reason
+        for name in parser.feed(chunk.choices[0].delta.content or ''):
+            if not final_names:
+                logging.info('ChatGPT streamed the first name in {}ms'.format(
+                    int((time.perf_counter() - start_ts) * 1000)))
+            final_names.append(name)
+            yield name
+
+    if stop_reason != 'stop':
+        logging.warning('The stop reason is {}'.format(stop_reason))
+    logging.info('ChatGPT streamed {} names in {} seconds'.format(
+        len(final_names), int(time.perf_counter() - start_ts)))
+    logging.info('ChatGPT raw output: {}'.format(parser.get_text()))
+
+    if final_names and stop_reason == 'stop':
+        await cache_proposed_names_async(digest, final_names)
+
+
+class StreamingNamesParser:
+    """
+    Incrementally parse the strings of a json array in a json object, like {"names": ["name_1", "name_2", ...]},
+    while the json text is streamed in chunks. Only the array of the given key is parsed, and the rest of the
+    json text is ignored.
+    """
+
+    def __init__(self, key: str):
+        self._key_token = json.dumps(key)
+        self._text = ''
+        # the position in the text where the parsing continues
+        self._pos = 0
+        self._in_array = False
+        self._done = False
+
+    def feed(self, chunk: str) -> List[str]:
+        """
+        :return: the strings of the array which are completed by the chunk
+        """
+        self._text += chunk
+        items = []
+        while not self._done:
+            if not self._in_array:
+                key_pos = self._text.find(self._key_token, self._pos)
+                array_pos = self._text.find('[', key_pos) if key_pos >= 0 else -1
+                if array_pos < 0:
+                    break
+                self._in_array = True
+                self._pos = array_pos + 1
+                continue
+
+            # skip the separators until the next string, or the end of the array
+            while self._pos < len(self._text) and self._text[self._pos] in ' \t\r\n,':
+                self._pos += 1
+            if self._pos >= len(self._text):
+                break
+            if self._text[self._pos] == ']':
+                self._done = True
+                break
+            if self._text[self._pos] != '"':
+                raise json.decoder.JSONDecodeError('Expecting a string in the array', self._text, self._pos)
+
+            end_pos = self._find_string_end(self._pos + 1)
+            if end_pos < 0:
+                break
+            items.append(json.loads(self._text[self._pos:end_pos + 1]))
+            self._pos = end_pos + 1
+        return items
+
+    def get_text(self) -> str:
+        return self._text
+
+    def _find_string_end(self, pos: int) -> int:
+        """
+        :return: the position of the quote closing the string, or -1 if the string is not complete yet
+        """
+        while pos < len(self._text):
+            if self._text[pos] == '\\':
+                pos += 2
+            elif self._text[pos] == '"':
+                return pos
+            else:
+                pos += 1
+        return -1
+
+
+def get_user_context_digest(gender: Gender,
+                            pref_summary: str,
+                            sentiment_summary: str,
+                            names_to_avoid: Set[str],
+                            max_count: int) -> str:
+    """
+    :return: the hash of the user context sent to ChatGPT, which does not depend on the order of the preferences,
+    the sentiments or the names to avoid
+    """
+    context = {
+        'model': PROPOSE_NAMES_MODEL,
+        'gender': str(gender),
+        'preferences': sorted(x.strip() for x in pref_summary.splitlines() if x.strip()),
+        'sentiments': sorted(x.strip() for x in sentiment_summary.splitlines() if x.strip()),
+        'names_to_avoid': sorted(names_to_avoid),
+        'max_count': max_count
+    }
+    return hashlib.sha256(json.dumps(context, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def get_cached_proposed_names(digest: str):
+    """
+    :return: the cached names of the user context, or None on a cache miss; a Redis error is counted as a miss
+    """
+    try:
+        cached_names = redis_lib.get_cached_proposed_names(digest)
+    except redis.RedisError as e:
+        logging.warning('Failed to read the cached proposed names: {}'.format(e))
+        cached_names = None
+
+    record_proposed_names_cache_lookup(cached_names)
+    return cached_names
+
+
+def record_proposed_names_cache_lookup(cached_names: Optional[List[str]]):
+    PROPOSED_NAMES_CACHE_STATS.record(cached_names is not None)
+    logging.info('Proposed names cache {result}, hit rate: {hit_rate}'.format(
+        result='hit' if cached_names is not None else 'miss',
+        hit_rate=PROPOSED_NAMES_CACHE_STATS.get_hit_rate()))
+
+
+def cache_proposed_names(digest: str, names: List[str]):
+    try:
+        redis_lib.cache_proposed_names(digest, names)
+    except redis.RedisError as e:
+        logging.warning('Failed to cache the proposed names: {}'.format(e))
+
+
+async def get_cached_proposed_names_async(digest: str):
+    try:
+        cached_names = await redis_async.get_cached_proposed_names(digest)
+    except redis.RedisError as e:
+        logging.warning('Failed to read the cached proposed names: {}'.format(e))
+        cached_names = None
+
+    record_proposed_names_cache_lookup(cached_names)
+    return cached_names
+
+
+async def cache_proposed_names_async(digest: str, names: List[str]):
+    try:
+        await redis_async.cache_proposed_names(digest, names)
+    except redis.RedisError as e:
+        logging.warning('Failed to cache the proposed names: {}'.format(e))
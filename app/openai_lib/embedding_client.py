@@ -1,29 +1,188 @@
+import concurrent.futures
+import hashlib
 import logging
+import os
+import queue
+import threading
 import time
-from typing import Dict
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache
+from typing import Dict, List, Tuple
 
+import numpy
 import openai
+import redis
 
 from app.lib.common import Gender
+import app.lib.redis as redis_lib
 import app.openai_lib.prompt as prompt
 import app.lib.name_pref as np
 from app.lib.name_sentiments import UserSentiments
 
 client = openai.OpenAI(api_key='')
 
+EMBEDDING_MODEL = "text-embedding-ada-002"
+# the number of embeddings which are cached in the process, in front of the cache in Redis
+EMBEDDING_LRU_SIZE = 1024
+# how long a caller waits for its embedding, which covers the retries of the request
+EMBEDDING_WAIT_TIMEOUT = 10.0
+# the timeout of an embedding request grows with the number of texts in the batch
+EMBEDDING_REQUEST_TIMEOUT = 1.0
+EMBEDDING_REQUEST_TIMEOUT_PER_TEXT = 0.02
 
-def create_single_embedding(msg: str):
-    start_ts = time.time()
-    resp = client.with_options(max_retries=2, timeout=1.0)\
-        .embeddings\
-        .create(input=[msg], model="text-embedding-ada-002")
-    logging.debug('Fetch embedding from OpenAI using {} seconds'.format(time.time() - start_ts))
-    return resp.data[0].embedding
+
+def create_single_embedding(msg: str, timeout=EMBEDDING_WAIT_TIMEOUT) -> numpy.ndarray:
+    """
+    :param timeout: how long to wait for OpenAI in seconds, if the embedding is not cached
+    :return: the read-only float32 embedding of the text, which is cached in the process and in Redis
+    """
+    return get_embedding(EMBEDDING_MODEL, msg, timeout)
+
+
+@lru_cache(maxsize=EMBEDDING_LRU_SIZE)
+def get_embedding(model: str, text: str, timeout=EMBEDDING_WAIT_TIMEOUT) -> numpy.ndarray:
+    digest = hashlib.sha256('{}\n{}'.format(model, text).encode('utf-8')).hexdigest()
+    try:
+        embedding_bytes = redis_lib.get_cached_embedding(digest)
+        if embedding_bytes:
+            return numpy.frombuffer(embedding_bytes, dtype=numpy.float32)
+    except redis.RedisError as e:
+        logging.warning('Failed to read the cached embedding: {}'.format(e))
+
+    embedding = numpy.asarray(fetch_embedding(model, text, timeout), dtype=numpy.float32)
+    embedding.flags.writeable = False
+    try:
+        redis_lib.cache_embedding(digest, embedding.tobytes())
+    except redis.RedisError as e:
+        logging.warning('Failed to cache the embedding: {}'.format(e))
+    return embedding
+
+
+def fetch_embedding(model: str, text: str, timeout=EMBEDDING_WAIT_TIMEOUT) -> List[float]:
+    return EMBEDDING_BATCHER.embed(model, text, timeout=timeout)
+
+
+class EmbeddingQueueFull(Exception):
+    pass
+
+
+class EmbeddingBatcher:
+    """
+    Coalesce the concurrent embedding requests of a process into multi-input embedding requests.
+
+    The callers block on a future, while a background thread collects the pending texts for up to max_wait_ms
+    (or until max_batch_size texts are collected) and sends them with one request per model; the requests are
+    sent from a small thread pool, so the next batch is collected while the previous one is in flight.
+    A batch is only collected once a sender of the pool is free, so the texts wait in the queue while all senders
+    are busy; at most max_pending texts wait to be sent, beyond which EmbeddingQueueFull is raised to the caller, and
+    the texts of the callers which stopped waiting are not sent.
+    """
+
+    def __init__(self, openai_client: openai.OpenAI = None, max_wait_ms=5, max_batch_size=64, max_concurrency=4,
+                 max_pending=1024):
+        # the module-level client is looked up on every request if no client is given
+        self._client = openai_client
+        self._max_wait = max_wait_ms / 1000.0
+        self._max_batch_size = max_batch_size
+        self._max_concurrency = max_concurrency
+        self._max_pending = max_pending
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+        self._executor = None
+
+    def embed(self, model: str, text: str, timeout=EMBEDDING_WAIT_TIMEOUT) -> List[float]:
+        future = Future()
+        try:
+            self._get_queue().put_nowait((model, text, future))
+        except queue.Full:
+            raise EmbeddingQueueFull('{} embedding requests are pending'.format(self._max_pending))
+
+        try:
+            return future.result(timeout=timeout)
+        except concurrent.futures.TimeoutError:
+            # the text is not sent if the request has not started yet
+            future.cancel()
+            raise
+
+    def _get_queue(self) -> queue.Queue:
+        # the thread is started on first use, and again in a forked child process, which does not inherit it
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._queue = queue.Queue(maxsize=self._max_pending)
+                self._executor = ThreadPoolExecutor(max_workers=self._max_concurrency,
+                                                    thread_name_prefix='embedding-request')
+                free_senders = threading.BoundedSemaphore(self._max_concurrency)
+                threading.Thread(target=self._run, args=(self._queue, self._executor, free_senders),
+                                 name='embedding-batcher', daemon=True).start()
+            return self._queue
+
+    def _run(self, pending: queue.Queue, executor: ThreadPoolExecutor, free_senders: threading.BoundedSemaphore):
+        while True:
+            free_senders.acquire()
+            batch = [pending.get()]
+            deadline = time.perf_counter() + self._max_wait
+            while len(batch) < self._max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(pending.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            for i, model in enumerate(dict.fromkeys(x[0] for x in batch)):
+                # the sender of the first model is acquired before the batch is collected
+                if i > 0:
+                    free_senders.acquire()
+                executor.submit(self._send_and_release, free_senders, model,
+                                [x[1:] for x in batch if x[0] == model])
+
+    def _send_and_release(self, free_senders: threading.BoundedSemaphore, model: str,
+                          requests: List[Tuple[str, Future]]):
+        try:
+            self._send(model, requests)
+        finally:
+            free_senders.release()
+
+    def _send(self, model: str, requests: List[Tuple[str, Future]]):
+        # the requests whose callers stopped waiting are dropped, and the rest can no longer be cancelled
+        requests = [x for x in requests if x[1].set_running_or_notify_cancel()]
+        if not requests:
+            return
+
+        # identical texts are only sent once
+        texts = list(dict.fromkeys(x[0] for x in requests))
+        start_ts = time.time()
+        try:
+            openai_client = self._client if self._client else client
+            request_timeout = EMBEDDING_REQUEST_TIMEOUT + EMBEDDING_REQUEST_TIMEOUT_PER_TEXT * len(texts)
+            resp = openai_client.with_options(max_retries=2, timeout=request_timeout)\
+                .embeddings\
+                .create(input=texts, model=model)
+            if len(resp.data) != len(texts):
+                raise ValueError('Expect {} embeddings but got {}'.format(len(texts), len(resp.data)))
+        except Exception as e:
+            for _, future in requests:
+                future.set_exception(e)
+            return
+
+        logging.debug('Fetch {} embeddings for {} requests from OpenAI using {} seconds'.format(
+            len(texts), len(requests), time.time() - start_ts))
+        # the embeddings are in the order of the input
+        embeddings = {text: x.embedding for text, x in zip(texts, resp.data)}
+        for text, future in requests:
+            future.set_result(embeddings[text])
+
+
+EMBEDDING_BATCHER = EmbeddingBatcher()
 
 
 def create_embedding_from_pref_sentiments(gender: Gender,
                                           user_prefs_dict: Dict[str, np.PrefInterface],
-                                          user_sentiments: UserSentiments):
+                                          user_sentiments: UserSentiments,
+                                          timeout=EMBEDDING_WAIT_TIMEOUT) -> numpy.ndarray:
     # create the paragraphs for user preferences and sentiments
     user_pref_str = prompt.create_text_from_user_pref(user_prefs_dict)
     user_sentiments_str = prompt.create_summary_of_user_sentiments(user_sentiments)
@@ -34,4 +193,4 @@ Look for a name for a {gender} newborn, based on the following user preferences
 {user_sentiments_str}
     """.format(gender=str(gender), user_pref_str=user_pref_str, user_sentiments_str=user_sentiments_str)
 
-    return create_single_embedding(text)
+    return create_single_embedding(text, timeout)
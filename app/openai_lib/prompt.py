@@ -1,10 +1,11 @@
 import logging
-from typing import Dict
+from typing import Dict, List
 
-from app.lib.common import Gender, canonicalize_gender
+from app.lib.common import Gender, canonicalize_gender, canonicalize_name
 from app.lib import name_pref as np
 from app.lib.name_sentiments import UserSentiments, Sentiment
 import app.lib.name_rating as nr
+import app.lib.name_statistics as ns
 
 
 def create_summary_of_user_sentiments(user_sentiments: UserSentiments) -> str:
@@ -74,11 +75,26 @@ def create_text_from_user_pref(user_prefs_dict: Dict[str, np.PrefInterface]) ->
 
 
 def create_rating_description(name: str, gender: Gender):
+    name = canonicalize_name(name)
     gender = canonicalize_gender(gender)
-    rating_dict = nr.NAME_RATING.get_feature_percentiles(name, gender)
-    if not rating_dict:
-        return ''
+    if not gender:
+        gender = ns.NAME_STATISTICS.guess_gender(name)
+    return create_rating_descriptions([name], gender).get(name, '')
+
+
+def create_rating_descriptions(names: List[str], gender: Gender) -> Dict[str, str]:
+    """
+    :return: a dict with the canonicalized name as key and the description of its ratings as value;
+    names without ratings are skipped
+    """
+    gender = canonicalize_gender(gender)
+    result = {}
+    for name, rating_dict in nr.NAME_RATING.get_feature_percentiles_batch(names, gender).items():
+        result[name] = _format_rating_description(rating_dict, gender)
+    return result
+
 
+def _format_rating_description(rating_dict: Dict, gender: Gender) -> str:
     all_sentences = []
     for rating_url_param, val_dict in rating_dict.items():
         leading_part = rating_url_param.replace('_', ' ').replace('option', 'rating')
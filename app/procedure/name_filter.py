@@ -1,5 +1,5 @@
 import logging
-from typing import List, Dict, Set
+from typing import List, Dict, Optional, Set
 
 from app.lib.common import Gender
 from app.lib import name_pref as np
@@ -13,7 +13,12 @@ def filter_names(session_id: str,
                  user_prefs_dict: Dict[str, np.PrefInterface],
                  user_sentiments: UserSentiments,
                  name_list: List[str],
-                 filter_displayed_names: bool = False) -> List[str]:
+                 filter_displayed_names: bool = False,
+                 displayed_names: Optional[List[str]] = None) -> List[str]:
+    """
+    :param displayed_names: the names displayed to the session before, e.g. from a SessionSnapshot; they are fetched
+    from Redis if not given
+    """
     # Filter names based on preference
     names_to_avoid = np.get_filter_names_from_pref(user_prefs_dict)
     filtered_names = filter_names_internal(name_list, names_to_avoid, 'user preferences')
@@ -28,8 +33,9 @@ def filter_names(session_id: str,
 
     # filter names displayed before
     if filter_displayed_names:
-        displayed_names = set(redis_lib.get_displayed_names(session_id))
-        filtered_names = filter_names_internal(filtered_names, displayed_names, 'previously displayed names')
+        if displayed_names is None:
+            displayed_names = redis_lib.get_displayed_names(session_id)
+        filtered_names = filter_names_internal(filtered_names, set(displayed_names), 'previously displayed names')
 
     return filtered_names
 
@@ -1,5 +1,6 @@
+import concurrent.futures
 import logging
-from typing import List, Dict
+from typing import List, Dict, Optional
 
 from app.lib.common import Gender
 import app.openai_lib.embedding_client as ec
@@ -42,7 +43,13 @@ class ProposedNames(object):
 def proposed_names(gender: Gender,
                    user_prefs_dict: Dict[str, np.PrefInterface],
                    user_sentiments: UserSentiments,
-                   count=20):
+                   count=20,
+                   embedding_timeout: Optional[float] = None):
+    """
+    :param embedding_timeout: how long to wait for the embedding of the text preferences in seconds; the names from
+    the text preferences are skipped if the embedding is not ready in time. By default, it waits as long as the
+    embedding client does, and raises on its timeout
+    """
     # User option to get recommendation if there is option input
     suggest_names_from_option = {}
     option_prefs = np.get_option_pref(user_prefs_dict)
@@ -60,8 +67,21 @@ def proposed_names(gender: Gender,
     # Use text content to get recommendation if there is text input
     suggested_names_from_text = {}
     if has_text_pref(user_prefs_dict, user_sentiments):
-        eb = ec.create_embedding_from_pref_sentiments(gender, user_prefs_dict, user_sentiments)
-        suggested_names_from_text = es.FAISS_SEARCH.search_with_embedding(gender, eb, num_of_result=count * 10)
+        if embedding_timeout is None:
+            eb = ec.create_embedding_from_pref_sentiments(gender, user_prefs_dict, user_sentiments)
+        else:
+            try:
+                eb = ec.create_embedding_from_pref_sentiments(gender, user_prefs_dict, user_sentiments,
+                                                              timeout=embedding_timeout)
+            except concurrent.futures.TimeoutError:
+                logging.warning('Skip the names from the text preferences, whose embedding is not ready in {} '
+                                'seconds'.format(embedding_timeout))
+                eb = None
+            except ec.EmbeddingQueueFull as e:
+                logging.warning('Skip the names from the text preferences: {}'.format(e))
+                eb = None
+        if eb is not None:
+            suggested_names_from_text = es.FAISS_SEARCH.search_with_embedding(gender, eb, num_of_result=count * 10)
 
     # Recommend names using popularity
     name_by_popularity = ns.NAME_STATISTICS.get_popular_names(gender, count=count * 10)
@@ -78,16 +98,8 @@ def proposed_names(gender: Gender,
 def suggest_name_using_sibling_names(gender: Gender,
                                      sibling_names: List[str],
                                      count=20) -> Dict[str, float]:
-    name_similarity = {}
-
-    for sibling_name in sibling_names:
-        sibling_gender = ns.NAME_STATISTICS.guess_gender(sibling_name)
-        tmp_result = es.FAISS_SEARCH.similar_names(sibling_gender, sibling_name, gender, num_of_result=20)
-
-        for candidate_name, similarity in tmp_result.items():
-            if candidate_name not in name_similarity:
-                name_similarity[candidate_name] = 0
-            name_similarity[candidate_name] += similarity
+    sibling_genders = ns.NAME_STATISTICS.guess_genders(sibling_names)
+    name_similarity = es.FAISS_SEARCH.similar_names_batch(sibling_genders, sibling_names, gender, num_of_result=20)
 
     name_similarity_list = [(candidate_name, similarity) for candidate_name, similarity in name_similarity.items()]
     name_similarity_list = sorted(name_similarity_list, key=lambda x: x[1], reverse=True)
@@ -6,6 +6,7 @@ from app.lib import name_rating as nr
 from app.lib import name_statistics as ns
 from app.procedure.name_proposer import ProposedNames
 import app.lib.redis as redis_lib
+import app.lib.redis_async as redis_async
 
 
 def generate(session_id: str,
@@ -13,6 +14,29 @@ def generate(session_id: str,
              user_prefs_dict: Dict[str, np.PrefInterface],
              proposed_names: ProposedNames,
              final_names: List[str]):
+    name_reasons = create_name_reasons(gender, user_prefs_dict, proposed_names, final_names)
+
+    # Write recommendation in redis
+    redis_lib.update_name_proposal_reasons(session_id, name_reasons)
+    # write the ChatGPT job to create recommendation reasons
+    redis_lib.add_recommendation_job(session_id, final_names)
+
+
+async def generate_async(session_id: str,
+                         gender: Gender,
+                         user_prefs_dict: Dict[str, np.PrefInterface],
+                         proposed_names: ProposedNames,
+                         final_names: List[str]):
+    name_reasons = create_name_reasons(gender, user_prefs_dict, proposed_names, final_names)
+
+    await redis_async.update_name_proposal_reasons(session_id, name_reasons)
+    await redis_async.add_recommendation_job(session_id, final_names)
+
+
+def create_name_reasons(gender: Gender,
+                        user_prefs_dict: Dict[str, np.PrefInterface],
+                        proposed_names: ProposedNames,
+                        final_names: List[str]) -> Dict[str, str]:
     names_from_options = set(proposed_names.get_suggest_names_from_option()).intersection(final_names)
     names_from_sibling_names = set(proposed_names.get_suggested_names_from_siblings()).intersection(final_names)
     # names_from_embeddings = set(proposed_names.get_suggested_names_from_text()).intersection(final_names)
@@ -28,11 +52,7 @@ def generate(session_id: str,
                                               sibling_name_pref.get_val() if sibling_name_pref else [],
                                               names_from_sibling_names,
                                               names_from_popularity)
-
-    # Write recommendation in redis
-    redis_lib.update_name_proposal_reasons(session_id, name_reasons, clear_job_que=False)
-    # write the ChatGPT job to create recommendation reasons
-    redis_lib.add_recommendation_job(session_id, final_names)
+    return name_reasons
 
 
 def generate_recommend_reasons(gender: Gender,
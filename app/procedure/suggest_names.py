@@ -1,10 +1,19 @@
+import asyncio
+import concurrent.futures
+import functools
 import logging
-from typing import Dict, Set
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Iterator, List, Optional, Set, Tuple
+
+from werkzeug.exceptions import ServiceUnavailable
 
 from app.lib.common import Gender
 
 import app.lib.redis as redis_lib
-from app.lib.name_sentiments import UserSentiments
+import app.lib.redis_async as redis_async
 from app.procedure import name_proposer as n_proposer
 from app.procedure import name_ranker as n_ranker
 from app.procedure import name_filter as n_filter
@@ -13,18 +22,66 @@ from app.openai_lib import chat_completion as cc
 from app.lib import name_pref as np
 import app.lib.name_sentiments as ns
 
+# how long suggest() waits for the names of ChatGPT before it falls back to the names from the local datasets;
+# 0 disables the fallback, so suggest() always waits for ChatGPT
+GPT_LATENCY_BUDGET_SECONDS = float(os.environ.get('GPT_LATENCY_BUDGET_SECONDS', 8))
+# the ChatGPT requests which run beyond the latency budget still hold a worker, until they complete or time out
+GPT_EXECUTOR = ThreadPoolExecutor(max_workers=8, thread_name_prefix='suggest-gpt')
+# the ChatGPT requests of GPT_EXECUTOR which are running or queued, including the ones beyond the latency budget; once
+# the limit is reached, the requests are served by the names from the local datasets only, rather than queued behind
+# them
+MAX_PENDING_GPT_REQUESTS = 16
+_PENDING_GPT_SLOTS = threading.BoundedSemaphore(MAX_PENDING_GPT_REQUESTS)
+# the names from the local datasets of the async serving path are computed here, rather than in the default executor;
+# a computation which is still queued when the latency budget of its request runs out is cancelled
+FACTS_EXECUTOR_THREADS = int(os.environ.get('SUGGEST_FACTS_THREADS', 4))
+FACTS_EXECUTOR = ThreadPoolExecutor(max_workers=FACTS_EXECUTOR_THREADS, thread_name_prefix='suggest-facts')
+# the ChatGPT tasks of the async serving path which are still running, including the ones beyond the latency budget;
+# a task only holds a coroutine rather than a thread, so the limit is the number of concurrent requests a uvicorn
+# worker is meant to hold (see app.asgi), beyond which the requests are served by the names from the local datasets
+MAX_PENDING_GPT_TASKS = int(os.environ.get('MAX_PENDING_GPT_TASKS', 500))
+_BACKGROUND_TASKS = set()
+
 
 def suggest(session_id, gender: Gender, filter_displayed_names=False, count=20):
+    if GPT_LATENCY_BUDGET_SECONDS > 0:
+        return suggest_names_hedged(session_id, gender, filter_displayed_names=filter_displayed_names, count=count)
     return suggest_names_using_gpt(session_id, gender, filter_displayed_names=filter_displayed_names, count=count)
 
 
+def stream_suggest(session_id, gender: Gender, filter_displayed_names=False, count=20) -> Iterator[str]:
+    return stream_suggest_names_using_gpt(session_id, gender, filter_displayed_names=filter_displayed_names,
+                                          count=count)
+
+
 def suggest_names_using_facts(session_id, gender: Gender, filter_displayed_names=False, count=20):
-    # Fetch all preferences and sentiments from redis
-    user_prefs_dict = redis_lib.get_user_pref(session_id)
-    user_sentiments = redis_lib.get_user_sentiments(session_id)
-    logging.debug('Fetched user prefs: {}'.format(list(user_prefs_dict.keys())))
+    # Fetch all preferences, sentiments and displayed names from redis
+    snapshot = get_session_snapshot(session_id)
+
+    proposed_names, final_names = propose_names_using_facts(
+        snapshot, gender, filter_displayed_names=filter_displayed_names, count=count)
+
+    record_suggested_names(snapshot, gender, proposed_names, final_names)
+
+    return final_names
+
 
-    proposed_names = n_proposer.proposed_names(gender, user_prefs_dict, user_sentiments, count=count)
+def propose_names_using_facts(snapshot: redis_lib.SessionSnapshot,
+                              gender: Gender,
+                              filter_displayed_names=False,
+                              count=20,
+                              review_with_gpt=True,
+                              embedding_timeout: Optional[float] = None) -> Tuple[n_proposer.ProposedNames, List[str]]:
+    """
+    :param review_with_gpt: whether ChatGPT reviews the ranked names against the user's input; without the review,
+    the names are computed from the local datasets only
+    :param embedding_timeout: see name_proposer.proposed_names()
+    :return: the proposed names of each source, and the final names
+    """
+    user_prefs_dict = snapshot.user_prefs
+    user_sentiments = snapshot.user_sentiments
+    proposed_names = n_proposer.proposed_names(gender, user_prefs_dict, user_sentiments, count=count,
+                                               embedding_timeout=embedding_timeout)
 
     # get the ranked names based on scores
     name_score_list = n_ranker.rank_names(proposed_names)
@@ -32,20 +89,47 @@ def suggest_names_using_facts(session_id, gender: Gender, filter_displayed_names
 
     # use name preference to do final filtering
     filtered_names = n_filter.filter_names(
-        session_id, gender, user_prefs_dict, user_sentiments,
-        ranked_names, filter_displayed_names=filter_displayed_names)
+        snapshot.session_id, gender, user_prefs_dict, user_sentiments,
+        ranked_names, filter_displayed_names=filter_displayed_names, displayed_names=snapshot.displayed_names)
 
     # Trim names based on the maximum count
     max_count = min(count, len(filtered_names))
 
+    if not review_with_gpt:
+        return proposed_names, filtered_names[0:max_count]
+
     # Use ChatGPT to understand the user input and do a final processing
     final_names = cc.check_proposed_names(filtered_names, user_prefs_dict, user_sentiments, max_count)
     final_names = final_names[0:max_count]
     logging.info(f'ChatGPT reviewed the proposed names and suggested names: {final_names}')
 
+    return proposed_names, final_names
+
+
+def record_suggested_names(snapshot: redis_lib.SessionSnapshot,
+                           gender: Gender,
+                           proposed_names: n_proposer.ProposedNames,
+                           final_names: List[str]):
     # generate recommendation reasons
-    r_generator.generate(session_id, gender, user_prefs_dict, proposed_names, final_names)
+    r_generator.generate(snapshot.session_id, gender, snapshot.user_prefs, proposed_names, final_names)
+
+    log_suggested_names(snapshot.session_id, proposed_names, final_names)
+
+    redis_lib.append_displayed_names(snapshot.session_id, final_names)
+
+
+async def record_suggested_names_async(snapshot: redis_lib.SessionSnapshot,
+                                       gender: Gender,
+                                       proposed_names: n_proposer.ProposedNames,
+                                       final_names: List[str]):
+    await r_generator.generate_async(snapshot.session_id, gender, snapshot.user_prefs, proposed_names, final_names)
+
+    log_suggested_names(snapshot.session_id, proposed_names, final_names)
 
+    await redis_async.append_displayed_names(snapshot.session_id, final_names)
+
+
+def log_suggested_names(session_id, proposed_names: n_proposer.ProposedNames, final_names: List[str]):
     # write data for late analysis
     logging.info('[data] (session: {}) final suggested names: {}'.format(
         session_id, sorted(final_names)))
@@ -62,17 +146,88 @@ def suggest_names_using_facts(session_id, gender: Gender, filter_displayed_names
     logging.info('[data] (session: {}) final suggested names from names_from_popularity: {}'.format(
         session_id, sorted(names_from_popularity)))
 
-    redis_lib.append_displayed_names(session_id, final_names)
+
+def suggest_names_hedged(session_id, gender: Gender, filter_displayed_names=False, count=20,
+                         latency_budget=None):
+    """
+    Ask ChatGPT for names, and compute the names from the local datasets (ratings, embeddings and popularity)
+    in the meantime. The names of ChatGPT are returned if they arrive within the latency budget, otherwise the
+    names from the local datasets are returned; ChatGPT keeps running in the background, so its names are cached
+    for the next /babyname/suggest request with the same preferences. The cache does not serve /babyname/refresh,
+    whose key includes the displayed names, which the names returned here are added to.
+
+    The names from the local datasets skip the text preferences if their embedding is not ready within half of the
+    budget, so a slow OpenAI does not delay them either; if neither source has names within the budget,
+    ServiceUnavailable is raised.
+
+    :param latency_budget: how long to wait for ChatGPT in seconds since the start; GPT_LATENCY_BUDGET_SECONDS
+    by default
+    """
+    latency_budget = GPT_LATENCY_BUDGET_SECONDS if latency_budget is None else latency_budget
+    start_ts = time.perf_counter()
+
+    snapshot = get_session_snapshot(session_id)
+
+    names_to_avoid = get_names_to_avoid(snapshot, gender, filter_displayed_names)
+    gpt_future = submit_gpt_request(gender, snapshot, names_to_avoid, count)
+
+    # the names from the local datasets are computed in this thread, so they do not wait for a free worker
+    facts_result = None
+    try:
+        facts_result = propose_names_using_facts(
+            snapshot, gender, filter_displayed_names=filter_displayed_names, count=count, review_with_gpt=False,
+            embedding_timeout=latency_budget / 2)
+    except Exception as e:
+        logging.exception('Failed to suggest names using facts: {}'.format(e))
+
+    try:
+        if gpt_future is None:
+            raise RuntimeError('too many pending ChatGPT requests')
+        remaining_time = latency_budget - (time.perf_counter() - start_ts)
+        final_names = gpt_future.result(timeout=max(remaining_time, 0))
+        proposed_names = n_proposer.ProposedNames()
+        source = 'gpt'
+    except Exception as e:
+        if isinstance(e, concurrent.futures.TimeoutError):
+            logging.warning('ChatGPT did not propose names within {} seconds'.format(latency_budget))
+        else:
+            logging.warning('Failed to propose names using ChatGPT: {}'.format(e))
+        if not facts_result:
+            raise ServiceUnavailable('No names are available within {} seconds'.format(latency_budget))
+        proposed_names, final_names = facts_result
+        source = 'facts'
+
+    logging.info('[data] (session: {}) suggested names from {} in {}ms'.format(
+        session_id, source, int((time.perf_counter() - start_ts) * 1000)))
+    record_suggested_names(snapshot, gender, proposed_names, final_names)
 
     return final_names
 
 
+def submit_gpt_request(gender: Gender, snapshot: redis_lib.SessionSnapshot, names_to_avoid: Set[str],
+                       count: int) -> Optional[concurrent.futures.Future]:
+    """
+    :return: the future of the names of ChatGPT, or None if there are too many pending ChatGPT requests
+    """
+    if not _PENDING_GPT_SLOTS.acquire(blocking=False):
+        return None
+
+    try:
+        gpt_future = GPT_EXECUTOR.submit(cc.propose_names, gender, snapshot.user_prefs, snapshot.user_sentiments,
+                                         names_to_avoid, count)
+    except Exception:
+        _PENDING_GPT_SLOTS.release()
+        raise
+    gpt_future.add_done_callback(lambda _: _PENDING_GPT_SLOTS.release())
+    return gpt_future
+
+
 def suggest_names_using_gpt(session_id, gender: Gender, filter_displayed_names=False, count=20):
-    user_prefs_dict = redis_lib.get_user_pref(session_id)
-    user_sentiments = redis_lib.get_user_sentiments(session_id)
-    logging.debug('Fetched user prefs: {}'.format(list(user_prefs_dict.keys())))
+    snapshot = get_session_snapshot(session_id)
+    user_prefs_dict = snapshot.user_prefs
+    user_sentiments = snapshot.user_sentiments
 
-    names_to_avoid = get_names_to_avoid(session_id, gender, user_prefs_dict, user_sentiments, filter_displayed_names)
+    names_to_avoid = get_names_to_avoid(snapshot, gender, filter_displayed_names)
 
     final_names = cc.propose_names(gender, user_prefs_dict, user_sentiments, names_to_avoid, count)
 
@@ -88,16 +243,153 @@ def suggest_names_using_gpt(session_id, gender: Gender, filter_displayed_names=F
     return final_names
 
 
-def get_names_to_avoid(session_id: str,
-                       gender: Gender,
-                       user_prefs: Dict[str, np.PrefInterface],
-                       user_sentiments: UserSentiments,
-                       filter_displayed_names) -> Set[str]:
+def stream_suggest_names_using_gpt(session_id, gender: Gender, filter_displayed_names=False, count=20) \
+        -> Iterator[str]:
+    """
+    the streaming variant of suggest_names_using_gpt(), which yields each name as soon as ChatGPT proposes it;
+    the recommendation reasons and the displayed names are recorded once all names are yielded
+    """
+    snapshot = get_session_snapshot(session_id)
+    user_prefs_dict = snapshot.user_prefs
+    user_sentiments = snapshot.user_sentiments
+
+    names_to_avoid = get_names_to_avoid(snapshot, gender, filter_displayed_names)
+
+    final_names = []
+    for name in cc.stream_proposed_names(gender, user_prefs_dict, user_sentiments, names_to_avoid, count):
+        # ChatGPT does not always follow the names to avoid in the prompt
+        if name in names_to_avoid or name in final_names:
+            continue
+        final_names.append(name)
+        yield name
+
+    # generate recommendation reasons
+    r_generator.generate(session_id, gender, user_prefs_dict, n_proposer.ProposedNames(), final_names)
+
+    # write data for late analysis
+    logging.info('[data] (session: {}) final suggested names: {}'.format(
+        session_id, sorted(final_names)))
+
+    redis_lib.append_displayed_names(session_id, final_names)
+
+
+async def stream_suggest_async(session_id, gender: Gender, filter_displayed_names=False, count=20) \
+        -> AsyncIterator[str]:
+    """
+    the asyncio variant of stream_suggest_names_using_gpt(), for the async serving path
+    """
+    snapshot = await redis_async.get_session_snapshot(session_id)
+    names_to_avoid = get_names_to_avoid(snapshot, gender, filter_displayed_names)
+
+    final_names = []
+    async for name in cc.stream_proposed_names_async(gender, snapshot.user_prefs, snapshot.user_sentiments,
+                                                     names_to_avoid, count):
+        if name in names_to_avoid or name in final_names:
+            continue
+        final_names.append(name)
+        yield name
+
+    await record_suggested_names_async(snapshot, gender, n_proposer.ProposedNames(), final_names)
+
+
+async def suggest_async(session_id, gender: Gender, filter_displayed_names=False, count=20):
+    """
+    the asyncio variant of suggest(), for the async serving path
+    """
+    if GPT_LATENCY_BUDGET_SECONDS > 0:
+        return await suggest_names_hedged_async(session_id, gender, filter_displayed_names=filter_displayed_names,
+                                                count=count)
+    return await suggest_names_using_gpt_async(session_id, gender, filter_displayed_names=filter_displayed_names,
+                                               count=count)
+
+
+async def suggest_names_using_gpt_async(session_id, gender: Gender, filter_displayed_names=False, count=20):
+    snapshot = await redis_async.get_session_snapshot(session_id)
+    names_to_avoid = get_names_to_avoid(snapshot, gender, filter_displayed_names)
+
+    final_names = await cc.propose_names_async(gender, snapshot.user_prefs, snapshot.user_sentiments, names_to_avoid,
+                                               count)
+
+    await record_suggested_names_async(snapshot, gender, n_proposer.ProposedNames(), final_names)
+
+    return final_names
+
+
+async def suggest_names_hedged_async(session_id, gender: Gender, filter_displayed_names=False, count=20,
+                                     latency_budget=None):
+    """
+    the asyncio variant of suggest_names_hedged(); the names from the local datasets are computed in FACTS_EXECUTOR,
+    so the event loop keeps serving other requests in the meantime. They are awaited within the latency budget as
+    well, so a request which waits for a free thread of FACTS_EXECUTOR does not exceed the budget either
+    """
+    latency_budget = GPT_LATENCY_BUDGET_SECONDS if latency_budget is None else latency_budget
+    start_ts = time.perf_counter()
+
+    snapshot = await redis_async.get_session_snapshot(session_id)
+    names_to_avoid = get_names_to_avoid(snapshot, gender, filter_displayed_names)
+
+    gpt_task = None
+    if len(_BACKGROUND_TASKS) < MAX_PENDING_GPT_TASKS:
+        gpt_task = asyncio.ensure_future(
+            cc.propose_names_async(gender, snapshot.user_prefs, snapshot.user_sentiments, names_to_avoid, count))
+        # the task keeps running beyond the latency budget, so its names are cached, as in suggest_names_hedged()
+        _BACKGROUND_TASKS.add(gpt_task)
+        gpt_task.add_done_callback(_on_background_task_done)
+
+    facts_result = None
+    facts_future = asyncio.get_event_loop().run_in_executor(FACTS_EXECUTOR, functools.partial(
+        propose_names_using_facts, snapshot, gender, filter_displayed_names=filter_displayed_names, count=count,
+        review_with_gpt=False, embedding_timeout=latency_budget / 2))
+    try:
+        remaining_time = latency_budget - (time.perf_counter() - start_ts)
+        facts_result = await asyncio.wait_for(facts_future, timeout=max(remaining_time, 0))
+    except asyncio.TimeoutError:
+        logging.warning('The names from the local datasets are not ready within {} seconds'.format(latency_budget))
+    except Exception as e:
+        logging.exception('Failed to suggest names using facts: {}'.format(e))
+
+    try:
+        if gpt_task is None:
+            raise RuntimeError('too many pending ChatGPT requests')
+        remaining_time = latency_budget - (time.perf_counter() - start_ts)
+        final_names = await asyncio.wait_for(asyncio.shield(gpt_task), timeout=max(remaining_time, 0))
+        proposed_names = n_proposer.ProposedNames()
+        source = 'gpt'
+    except Exception as e:
+        if isinstance(e, asyncio.TimeoutError):
+            logging.warning('ChatGPT did not propose names within {} seconds'.format(latency_budget))
+        else:
+            logging.warning('Failed to propose names using ChatGPT: {}'.format(e))
+        if not facts_result:
+            raise ServiceUnavailable('No names are available within {} seconds'.format(latency_budget))
+        proposed_names, final_names = facts_result
+        source = 'facts'
+
+    logging.info('[data] (session: {}) suggested names from {} in {}ms'.format(
+        session_id, source, int((time.perf_counter() - start_ts) * 1000)))
+    await record_suggested_names_async(snapshot, gender, proposed_names, final_names)
+
+    return final_names
+
+
+def _on_background_task_done(task: asyncio.Future):
+    _BACKGROUND_TASKS.discard(task)
+    # retrieve the exception, which is already logged by the request which awaited the task, if any
+    if not task.cancelled() and task.exception() is not None:
+        logging.debug('Background task failed: {}'.format(task.exception()))
+
+
+def get_session_snapshot(session_id: str) -> redis_lib.SessionSnapshot:
+    snapshot = redis_lib.get_session_snapshot(session_id)
+    logging.debug('Fetched user prefs: {}'.format(list(snapshot.user_prefs.keys())))
+    return snapshot
+
 
+def get_names_to_avoid(snapshot: redis_lib.SessionSnapshot, gender: Gender, filter_displayed_names) -> Set[str]:
     names_to_avoid = set()
-    names_to_avoid = names_to_avoid.union(np.get_filter_names_from_pref(user_prefs))
-    names_to_avoid = names_to_avoid.union(ns.get_filter_names_from_sentiments(user_sentiments))
-    names_to_avoid = names_to_avoid.union(ns.get_filter_names_from_dislikes(gender, user_sentiments))
+    names_to_avoid = names_to_avoid.union(np.get_filter_names_from_pref(snapshot.user_prefs))
+    names_to_avoid = names_to_avoid.union(ns.get_filter_names_from_sentiments(snapshot.user_sentiments))
+    names_to_avoid = names_to_avoid.union(ns.get_filter_names_from_dislikes(gender, snapshot.user_sentiments))
     if filter_displayed_names:
-        names_to_avoid = names_to_avoid.union(set(redis_lib.get_displayed_names(session_id)))
+        names_to_avoid = names_to_avoid.union(set(snapshot.displayed_names))
     return names_to_avoid
@@ -2,7 +2,12 @@ supervisord -c /etc/supervisord.conf
 
 if [ "${ENV}" = "DEV" ]; then
   python -m app.app
+elif [ "${SERVING_MODE}" = "asgi" ]; then
+  # the requests waiting for ChatGPT are served by coroutines, so a few workers hold many concurrent requests
+  DATASET_WARM_UP=sync gunicorn -w 2 -k uvicorn.workers.UvicornWorker -b 0.0.0.0:8080 --timeout 180 --preload \
+    app.asgi:app
 else
-  # preload option enables some memory sharing across workers
-  gunicorn -w 5 -b 0.0.0.0:8080 --timeout 180 --preload app.app:app
+  # preload option enables some memory sharing across workers; the datasets are loaded in the master before
+  # the workers are forked, so the workers share them instead of loading their own copies
+  DATASET_WARM_UP=sync gunicorn -w 5 -b 0.0.0.0:8080 --timeout 180 --preload app.app:app
 fi
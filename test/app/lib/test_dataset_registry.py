@@ -0,0 +1,63 @@
+import threading
+import time
+import unittest
+
+from app.lib.dataset_registry import LazyDataset
+import app.lib.name_statistics as ns
+
+
+class Dataset:
+
+    def __init__(self, loaded: list, name: str):
+        time.sleep(0.05)
+        loaded.append(name)
+        self.name = name
+
+    def get(self, key: str):
+        return key + ' of ' + self.name
+
+
+class TestDatasetRegistry(unittest.TestCase):
+
+    def test_load_on_first_use(self):
+        loaded = []
+        base = LazyDataset('base', lambda: Dataset(loaded, 'base'))
+        dataset = LazyDataset('dataset', lambda: Dataset(loaded, 'dataset'), depends_on=[base])
+        self.assertTrue(not dataset.is_loaded() and loaded == [])
+
+        # the attributes of the dataset are looked up on the loaded object
+        self.assertTrue(dataset.name == 'dataset')
+        self.assertTrue(dataset.is_loaded() and base.is_loaded())
+        self.assertTrue(loaded == ['base', 'dataset'])
+        self.assertTrue(dataset.get('value') == 'value of dataset')
+
+    def test_concurrent_load(self):
+        loaded = []
+        dataset = LazyDataset('dataset', lambda: Dataset(loaded, 'dataset'))
+        threads = [threading.Thread(target=dataset.load_dataset) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertTrue(loaded == ['dataset'])
+
+    def test_failed_load(self):
+        attempts = []
+
+        def factory():
+            attempts.append(1)
+            if len(attempts) == 1:
+                raise IOError('missing file')
+            return Dataset([], 'dataset')
+
+        dataset = LazyDataset('dataset', factory)
+        with self.assertRaises(IOError):
+            dataset.load_dataset()
+        self.assertTrue(not dataset.is_loaded())
+        # the load is retried on the next access
+        self.assertTrue(dataset.name == 'dataset')
+
+    def test_registered_dataset(self):
+        self.assertTrue(isinstance(ns.NAME_STATISTICS, LazyDataset))
+        self.assertTrue(ns.NAME_STATISTICS.get_frequency_and_rank('Emma', 'girl')[1] < ns.UNRANKED)
+        self.assertTrue(ns.NAME_STATISTICS.is_loaded())
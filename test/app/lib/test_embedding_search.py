@@ -43,6 +43,68 @@ class TestFaissSearch(unittest.TestCase):
                             'Kaitlyn', first_name
                         ))
 
+    def test_similar_names_batch(self):
+        genders = [Gender.GIRL, Gender.BOY, Gender.GIRL]
+        names = ['Kaitlyn', 'Liam', 'NotAnIndexedName']
+        result = es.FAISS_SEARCH.similar_names_batch(genders, names, Gender.GIRL)
+
+        expected = {}
+        for gender, name in zip(genders, names):
+            for similar_name, score in es.FAISS_SEARCH.similar_names(gender, name, Gender.GIRL).items():
+                expected[similar_name] = expected.get(similar_name, 0.0) + score
+        self.assertTrue('Kaitlyn' not in result)
+        self.assertTrue(result.keys() == expected.keys())
+        self.assertTrue(all(abs(result[x] - expected[x]) < 1e-5 for x in expected))
+
+    def test_create_index(self):
+        names, index = es.FaissSearch.create_index([
+            {'name': 'liam', 'embedding': [3.0, 4.0]},
+            {'name': 'Noah', 'embedding': [0.0, 2.0]}
+        ])
+        self.assertTrue(names == ['Liam', 'Noah'])
+        self.assertTrue(index.ntotal == 2)
+        # the embeddings are stored normalized as float32
+        self.assertTrue(np.allclose(index.reconstruct(0), [0.6, 0.8]))
+        self.assertTrue(index.reconstruct(1).dtype == np.float32)
+
+        eb = es.FAISS_SEARCH.get_embeddings('girl', 'Kaitlyn')
+        self.assertTrue(eb.dtype == np.float32 and abs(np.linalg.norm(eb) - 1.0) < 1e-4)
+        self.assertTrue(len(es.FAISS_SEARCH.get_embeddings('girl', 'NotAnIndexedName')) == 0)
+
+    def test_approximate_index(self):
+        rng = np.random.default_rng(0)
+        name_embedding_list = [{'name': 'name{}'.format(i), 'embedding': rng.normal(size=16).tolist()}
+                               for i in range(1000)]
+        _, flat_index = es.FaissSearch.create_index(name_embedding_list, 'flat')
+        queries = np.vstack([flat_index.reconstruct(i) for i in range(20)])
+        _, expected = flat_index.search(queries, 10)
+
+        for index_type in ['hnsw', 'ivfpq']:
+            names, index = es.FaissSearch.create_index(name_embedding_list, index_type)
+            self.assertTrue(index.ntotal == 1000)
+            _, actual = index.search(queries, 10)
+            recall = sum(len(set(x) & set(y)) for x, y in zip(expected, actual)) / float(expected.size)
+            self.assertTrue(recall > 0.5, 'recall@10 of {} is too low: {}'.format(index_type, recall))
+            self.assertTrue(len(index.reconstruct(0)) == 16)
+
+        with self.assertRaises(ValueError):
+            es.FaissSearch.create_index(name_embedding_list, 'lsh')
+
+    def test_create_neighbors(self):
+        rng = np.random.default_rng(0)
+        _, boy_index = es.FaissSearch.create_index(
+            [{'name': 'boy{}'.format(i), 'embedding': rng.normal(size=8).tolist()} for i in range(50)])
+        _, girl_index = es.FaissSearch.create_index(
+            [{'name': 'girl{}'.format(i), 'embedding': rng.normal(size=8).tolist()} for i in range(40)])
+
+        neighbor_rows, neighbor_distances = es.FaissSearch.create_neighbors(boy_index, girl_index, k=5, batch_size=16)
+        self.assertTrue(neighbor_rows.shape == (50, 5) and neighbor_rows.dtype == np.int32)
+        self.assertTrue(neighbor_distances.dtype == np.float16)
+
+        expected_distances, expected_rows = girl_index.search(boy_index.reconstruct_n(0, 50), 5)
+        self.assertTrue(np.array_equal(neighbor_rows, expected_rows))
+        self.assertTrue(np.allclose(neighbor_distances, expected_distances, atol=1e-3))
+
 
 if __name__ == '__main__':
     unittest.main()
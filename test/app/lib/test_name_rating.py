@@ -1,7 +1,12 @@
 import unittest
+from unittest.mock import patch
+
+import scipy.stats as stats
 
 import app.lib.name_rating as nr
+import app.lib.name_statistics as ns
 from app.lib.common import Gender
+from app.lib.name_vocabulary import NAME_VOCABULARY
 
 
 class TestNameRating(unittest.TestCase):
@@ -58,3 +63,64 @@ class TestNameRating(unittest.TestCase):
         self.assertTrue(feature_percentiles['texture_option']['Refined'][1] == 'top',
                         'Refined score percentile for {} is not top: {}'.format(
                             first_name, feature_percentiles['texture_option']['Refined']))
+
+    def test_batch_matches_single(self):
+        names = ['Kaitlyn', 'emma', 'NotARatedName']
+        batch_scores = nr.NAME_RATING.get_feature_scores_batch(names, Gender.GIRL)
+        batch_percentiles = nr.NAME_RATING.get_feature_percentiles_batch(names, Gender.GIRL)
+        self.assertTrue('NotARatedName' not in batch_scores)
+        for name in ['Kaitlyn', 'Emma']:
+            self.assertTrue(batch_scores[name] == nr.NAME_RATING.get_feature_scores(name, Gender.GIRL))
+            self.assertTrue(batch_percentiles[name] == nr.NAME_RATING.get_feature_percentiles(name, Gender.GIRL))
+
+
+def create_rating_record(name: str, gender: str, classic: float):
+    """
+    :return: a record of the ratings file, which is neutral (the mean of the boys) except for the Classic rating
+    """
+    rating = []
+    for types in nr.ALL_RATINGS:
+        score = classic if types[3] == 'Classic' else nr.RATING_DISTRIBUTION[Gender.BOY][types[3]][0]
+        rating.append({types[0]: '{}%'.format(round(score * 100)), types[1]: '{}%'.format(round(100 - score * 100))})
+    return {'name': name, 'gender': gender, 'votes': '100', 'rating': rating}
+
+
+class TestSuggest(unittest.TestCase):
+    def setUp(self) -> None:
+        records = [create_rating_record('Noah', 'boy', 0.75), create_rating_record('Liam', 'boy', 0.80),
+                   create_rating_record('Oliver', 'boy', 0.68), create_rating_record('James', 'boy', 0.50),
+                   create_rating_record('Olivia', 'girl', 0.90)]
+        with patch.object(nr.NameRating, 'load_file', return_value=records):
+            self.name_rating = nr.NameRating()
+
+        # by popularity descending, with a name without ratings
+        popular_names = {Gender.BOY: ['Noah', 'Liam', 'Zzyzx', 'Oliver', 'James'], Gender.GIRL: ['Olivia', 'Emma']}
+        popular_ids = {gender: NAME_VOCABULARY.get_ids(names, gender) for gender, names in popular_names.items()}
+        patcher = patch.object(ns.NAME_STATISTICS, 'get_popular_ids',
+                               side_effect=lambda gender, count: popular_ids[gender])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_suggest_by_score(self):
+        # the more Classic name goes first; the Modern name is not suggested
+        result = self.name_rating._suggest1('boy', {'style_option': 'Classic'})
+        self.assertTrue(list(result.keys()) == ['Liam', 'Noah', 'Oliver'], result)
+        self.assertTrue(result['Liam'] > result['Noah'] > result['Oliver'] > 0.5, result)
+        # the score is the average percentile of the chosen options
+        liam_zscore = (0.80 - nr.RATING_DISTRIBUTION[Gender.BOY]['Classic'][0]) / \
+            nr.RATING_DISTRIBUTION[Gender.BOY]['Classic'][1]
+        self.assertTrue(abs(result['Liam'] - stats.norm.cdf(liam_zscore)) < 1e-6, result)
+
+        # the Modern option ranks the names the other way around
+        result = self.name_rating._suggest1('boy', {'style_option': 'Modern'})
+        self.assertTrue(list(result.keys()) == ['James'], result)
+
+        result = self.name_rating._suggest1('boy', {'style_option': 'Classic'}, count=2)
+        self.assertTrue(list(result.keys()) == ['Liam', 'Noah'], result)
+
+    def test_filter_by_gender(self):
+        result = self.name_rating._suggest1('girl', {'style_option': 'Classic'})
+        self.assertTrue(list(result.keys()) == ['Olivia'], result)
+
+        result = self.name_rating._suggest1('boy', {'style_option': 'Classic'})
+        self.assertTrue('Olivia' not in result, result)
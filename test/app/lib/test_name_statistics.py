@@ -1,6 +1,59 @@
 import unittest
 
+import app.lib.name_statistics as ns
+from app.lib.common import Gender
+
 
 class TestNameStatistics(unittest.TestCase):
 
-    pass
\ No newline at end of file
+    def test_create_snapshot(self):
+        yearly_trend = {
+            ('Liam', Gender.BOY): {'2021': '20', '2022': '30'},
+            ('Emma', Gender.GIRL): {'1990': '5', '2022': '10'},
+            ('Avery', Gender.BOY): {'2020': '7'},
+        }
+        names, genders, first_year, counts = ns.NameStatistics.create_snapshot(yearly_trend)
+
+        self.assertTrue(names == ['Emma', 'Avery', 'Liam'], names)
+        self.assertTrue(list(genders) == [Gender.GIRL.value, Gender.BOY.value, Gender.BOY.value], genders)
+        self.assertTrue(first_year == 1990)
+        self.assertTrue(counts.shape == (2022 - 1990 + 1, 3), counts.shape)
+        self.assertTrue(counts[2022 - first_year, 2] == 30)
+        self.assertTrue(counts.sum() == 72)
+
+    def test_yearly_trend(self):
+        stats = ns.NAME_STATISTICS
+        trend = stats.get_yearly_trend('Liam', 'boy')
+        self.assertTrue(all(isinstance(year, str) and isinstance(count, str) for year, count in trend.items()))
+
+        freq, rank = stats.get_frequency_and_rank('Liam', 'boy')
+        self.assertTrue(freq == sum(int(trend.get(str(year), '0')) for year in range(2020, 2023)))
+        self.assertTrue(stats.get_popular_names('boy', count=rank)[-1] == 'Liam')
+
+    def test_year_window(self):
+        stats = ns.NAME_STATISTICS
+        trend = stats.get_yearly_trend('Liam', 'boy')
+        freq, rank = stats.get_frequency_and_rank('Liam', 'boy', start_year=2012, end_year=2022)
+        self.assertTrue(freq == sum(int(trend.get(str(year), '0')) for year in range(2012, 2023)))
+        self.assertTrue(stats.get_popular_names('boy', count=rank, start_year=2012, end_year=2022)[-1] == 'Liam')
+
+        self.assertTrue(stats.get_frequency_and_rank('Liam', 'boy', start_year=3000, end_year=3001) ==
+                        (0, ns.UNRANKED))
+        self.assertTrue(stats.get_popular_names('boy', start_year=3000, end_year=3001) == [])
+        with self.assertRaises(ValueError):
+            stats.get_popular_names('boy', start_year=2022, end_year=2020)
+
+    def test_percentile(self):
+        stats = ns.NAME_STATISTICS
+        cutoffs = stats.get_percentile_cutoffs([0.1, 0.5, 0.9], Gender.BOY)
+        self.assertTrue(cutoffs == sorted(cutoffs), cutoffs)
+
+        names = stats.get_percentile(0.5, Gender.BOY)
+        self.assertTrue(len(names) == cutoffs[1])
+        self.assertTrue(names == stats.get_popular_names(Gender.BOY, count=cutoffs[1]))
+
+        total = sum(stats.get_frequency_and_rank(name, Gender.BOY)[0]
+                    for name in stats.get_popular_names(Gender.BOY, count=100000))
+        count = sum(stats.get_frequency_and_rank(name, Gender.BOY)[0] for name in names)
+        last_freq, _ = stats.get_frequency_and_rank(names[-1], Gender.BOY)
+        self.assertTrue(count >= 0.5 * total > count - last_freq)
@@ -0,0 +1,33 @@
+import unittest
+
+import numpy as np
+
+from app.lib.common import Gender
+from app.lib.name_vocabulary import NameVocabulary, NO_ID, get_by_id, get_by_ids, create_mask, mask_contains
+
+
+class TestNameVocabulary(unittest.TestCase):
+
+    def test_intern(self):
+        vocabulary = NameVocabulary()
+        self.assertTrue(vocabulary.intern('Liam', Gender.BOY) == 0)
+        self.assertTrue(vocabulary.intern('Noah', Gender.BOY) == 1)
+        self.assertTrue(vocabulary.intern('Liam', Gender.BOY) == 0)
+        # ids are per gender
+        self.assertTrue(vocabulary.intern('Liam', Gender.GIRL) == 0)
+
+        self.assertTrue(list(vocabulary.intern_all(['Noah', 'Mason'], Gender.BOY)) == [1, 2])
+        self.assertTrue(vocabulary.get_id('Oliver', Gender.BOY) == NO_ID)
+        self.assertTrue(vocabulary.get_names([2, 0], Gender.BOY) == ['Mason', 'Liam'])
+        self.assertTrue(vocabulary.size(Gender.BOY) == 3)
+        self.assertTrue(vocabulary.size(Gender.GIRL) == 1)
+
+    def test_id_indexed_columns(self):
+        column = ['a', 'b']
+        self.assertTrue(get_by_id(column, 1) == 'b')
+        self.assertTrue(get_by_id(column, NO_ID, '') == '')
+        self.assertTrue(get_by_id(column, 5, '') == '')
+        self.assertTrue(list(get_by_ids(np.asarray([5, 7]), np.asarray([1, NO_ID, 2, 0]), 0)) == [7, 0, 0, 5])
+
+        mask = create_mask(np.asarray([0, 2]), 3)
+        self.assertTrue(list(mask_contains(mask, np.asarray([2, 1, NO_ID, 7]))) == [True, False, False, False])
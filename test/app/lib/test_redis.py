@@ -1,11 +1,17 @@
+import asyncio
 import json
 import logging
 import time
 import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
 
 import fakeredis
+import fakeredis.aioredis
 
 import app.lib.redis as redis_lib
+import app.lib.redis_async as redis_async
+import app.lib.name_pref as np
 from app.lib.name_sentiments import UserSentiments, Sentiment
 
 
@@ -13,6 +19,8 @@ class TestRedis(unittest.TestCase):
     def setUp(self) -> None:
         logging.getLogger().setLevel(logging.DEBUG)
         redis_lib.redis_client = fakeredis.FakeRedis(charset="utf-8", decode_responses=True)
+        redis_lib.redis_bytes_client = fakeredis.FakeRedis()
+        redis_lib.health_check_client = fakeredis.FakeRedis()
 
     def test_add_job(self):
         redis_lib.add_recommendation_job('12345', ['Liam', 'Kaysen', 'Georgios', 'Jaydon', 'Jorge'])
@@ -31,6 +39,16 @@ class TestRedis(unittest.TestCase):
         self.assertTrue(result['session_id'] == '123456')
         self.assertTrue(result['names'] == ['Kaysen', 'Georgios', 'Jaydon'])
 
+    def test_add_job_with_pending_names(self):
+        redis_lib.add_recommendation_job('12345', ['Liam', 'Kaysen', 'Liam'])
+        # the names queued already are skipped
+        redis_lib.add_recommendation_job('12345', ['Kaysen'])
+        redis_lib.add_recommendation_job('12345', ['Kaysen', 'Jorge'])
+
+        jobs = [json.loads(x) for x in redis_lib.redis_client.lrange(redis_lib.PROPOSAL_REASON_JOB_QUEUE_KEY, 0, -1)]
+        self.assertTrue([x['names'] for x in jobs] == [['Liam', 'Kaysen'], ['Jorge']], jobs)
+        self.assertTrue(redis_lib.redis_client.ttl(redis_lib.get_pending_reason_names_key('12345')) > 0)
+
     def test_name_sentiments(self):
         session_id = '12345'
         sentiments = UserSentiments.create_from_dict({
@@ -82,3 +100,127 @@ class TestRedis(unittest.TestCase):
         self.assertTrue('Jaydon' in result)
         self.assertTrue('Georgios' in result)
         self.assertTrue('Kaysen' in result)
+
+    def test_ping_latency(self):
+        self.assertTrue(redis_lib.get_ping_latency_ms() >= 0)
+
+    @patch('app.lib.redis.MAX_NUM_OF_CACHED_PROPOSALS', 2)
+    def test_proposed_names_cache(self):
+        self.assertTrue(redis_lib.get_cached_proposed_names('a') is None)
+
+        redis_lib.cache_proposed_names('a', ['Liam', 'Ethan'])
+        self.assertTrue(redis_lib.get_cached_proposed_names('a') == ['Liam', 'Ethan'])
+        self.assertTrue(redis_lib.redis_client.ttl(redis_lib.get_proposed_names_key('a')) > 0)
+
+        # the oldest context is evicted once the cache is full
+        redis_lib.redis_client.zadd(redis_lib.PROPOSED_NAMES_INDEX_KEY, {'a': int(time.time()) - 10})
+        redis_lib.cache_proposed_names('b', ['Emma'])
+        redis_lib.cache_proposed_names('c', ['Olivia'])
+        self.assertTrue(redis_lib.get_cached_proposed_names('a') is None)
+        self.assertTrue(redis_lib.get_cached_proposed_names('c') == ['Olivia'])
+        self.assertTrue(redis_lib.redis_client.zcard(redis_lib.PROPOSED_NAMES_INDEX_KEY) == 2)
+
+    @patch('app.lib.redis.MAX_NUM_OF_CACHED_PROPOSALS', 2)
+    def test_async_proposed_names_cache(self):
+        server = fakeredis.FakeServer()
+        redis_lib.redis_client = fakeredis.FakeRedis(server=server, decode_responses=True)
+        redis_async.redis_client = fakeredis.aioredis.FakeRedis(server=server, decode_responses=True)
+
+        async def run():
+            await redis_async.cache_proposed_names('a', ['Liam', 'Ethan'])
+            names = await redis_async.get_cached_proposed_names('a')
+            # the oldest context is evicted once the cache is full
+            await redis_async.redis_client.zadd(redis_lib.PROPOSED_NAMES_INDEX_KEY, {'a': int(time.time()) - 10})
+            await redis_async.cache_proposed_names('b', ['Emma'])
+            await redis_async.cache_proposed_names('c', ['Olivia'])
+            return names
+
+        self.assertTrue(asyncio.run(run()) == ['Liam', 'Ethan'])
+        # the names cached by the async module are read by the sync one
+        self.assertTrue(redis_lib.get_cached_proposed_names('a') is None)
+        self.assertTrue(redis_lib.get_cached_proposed_names('c') == ['Olivia'])
+        self.assertTrue(redis_lib.redis_client.zcard(redis_lib.PROPOSED_NAMES_INDEX_KEY) == 2)
+
+    def test_session_snapshot(self):
+        session_id = '12345'
+        redis_lib.update_user_pref(session_id, {np.StyleChoice.get_url_param_name(): np.StyleChoice.create('Classic')})
+        redis_lib.update_user_sentiments(session_id, UserSentiments.create_from_dict({
+            'Thomas': {'sentiment': 'liked', 'reason': 'abc'},
+            'Ethan': {'sentiment': 'disliked'}
+        }))
+        redis_lib.append_displayed_names(session_id, ['Liam', 'Noah'])
+        redis_lib.update_name_proposal_reasons(session_id, {'Liam': 'A popular name'})
+
+        snapshot = redis_lib.get_session_snapshot(session_id)
+        self.assertTrue(snapshot.session_id == session_id)
+        self.assertTrue(snapshot.user_prefs[np.StyleChoice.get_url_param_name()].get_val() == 'Classic')
+        self.assertTrue(sorted(snapshot.user_sentiments.get_val().keys()) == ['Ethan', 'Thomas'])
+        self.assertTrue(sorted(snapshot.displayed_names) == ['Liam', 'Noah'])
+        self.assertTrue(snapshot.proposal_reasons == {})
+
+        reasons_snapshot = redis_lib.get_session_snapshot(session_id, include_reasons=True)
+        self.assertTrue(reasons_snapshot.proposal_reasons == {'Liam': 'A popular name'})
+
+        empty_snapshot = redis_lib.get_session_snapshot('54321', include_reasons=True)
+        self.assertTrue(empty_snapshot.user_prefs == {} and empty_snapshot.displayed_names == [])
+        self.assertTrue(empty_snapshot.proposal_reasons == {})
+
+    def test_concurrent_append_displayed_names(self):
+        session_id = '12345'
+        batches = [['Name{}-{}'.format(i, j) for j in range(20)] for i in range(16)]
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(lambda x: redis_lib.append_displayed_names(session_id, x), batches))
+
+        # the names are trimmed exactly to the maximum, whatever the order of the concurrent appends
+        displayed_names = redis_lib.get_displayed_names(session_id)
+        self.assertTrue(len(displayed_names) == redis_lib.MAX_NUM_OF_TRACKED_NAMES, len(displayed_names))
+        self.assertTrue(redis_lib.redis_client.ttl(redis_lib.get_displayed_names_key(session_id)) > 0)
+
+        # a name displayed again is not tracked twice
+        redis_lib.append_displayed_names(session_id, [displayed_names[-1]])
+        self.assertTrue(redis_lib.redis_client.zcard(redis_lib.get_displayed_names_key(session_id)) ==
+                        redis_lib.MAX_NUM_OF_TRACKED_NAMES)
+
+    def test_concurrent_add_jobs(self):
+        names = ['Liam', 'Zoë', 'O"Neil', 'Back\\slash']
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(lambda x: redis_lib.add_recommendation_job('s{}'.format(x), names), range(16)))
+
+        jobs = [json.loads(x) for x in redis_lib.redis_client.lrange(redis_lib.PROPOSAL_REASON_JOB_QUEUE_KEY, 0, -1)]
+        self.assertTrue(sorted(x['session_id'] for x in jobs) == sorted('s{}'.format(x) for x in range(16)))
+        self.assertTrue(all(x['names'] == names for x in jobs))
+
+
+class TestReasonJobQueue(unittest.TestCase):
+    def setUp(self) -> None:
+        server = fakeredis.FakeServer()
+        redis_lib.redis_client = fakeredis.FakeRedis(server=server, decode_responses=True)
+        redis_async.redis_client = fakeredis.aioredis.FakeRedis(server=server, decode_responses=True)
+
+    def test_reclaim_jobs(self):
+        for session_id in ['s1', 's2', 's3']:
+            redis_lib.add_recommendation_job(session_id, ['Liam'])
+
+        async def run():
+            await redis_async.send_reason_worker_heartbeat('worker-a')
+            await redis_async.send_reason_worker_heartbeat('worker-b')
+            job_a1 = await redis_async.pop_reason_job('worker-a', timeout=1)
+            job_a2 = await redis_async.pop_reason_job('worker-a', timeout=1)
+            job_b = await redis_async.pop_reason_job('worker-b', timeout=1)
+            await redis_async.ack_reason_job('worker-a', job_a1)
+
+            # nothing is reclaimed from the live workers
+            self.assertTrue(await redis_async.reclaim_reason_jobs() == 0)
+
+            # worker-b dies, and worker-a restarts; worker-a's heartbeat is removed until its next heartbeat
+            stale_ts = int(time.time()) - redis_lib.REASON_WORKER_STALE_SECONDS - 1
+            await redis_async.redis_client.zadd(redis_lib.REASON_WORKER_HEARTBEAT_KEY, {'worker-b': stale_ts})
+            self.assertTrue(await redis_async.reclaim_reason_jobs('worker-a') == 2)
+            return job_a2, job_b
+
+        job_a2, job_b = asyncio.run(run())
+        self.assertTrue(json.loads(job_b)['session_id'] == 's3')
+        self.assertTrue(redis_lib.redis_client.lrange(redis_lib.PROPOSAL_REASON_JOB_QUEUE_KEY, 0, -1) == [job_a2, job_b])
+        self.assertTrue(redis_lib.redis_client.keys('{}:processing:*'.format(redis_lib.PROPOSAL_REASON_JOB_QUEUE_KEY))
+                        == [])
+        self.assertTrue(redis_lib.redis_client.zcard(redis_lib.REASON_WORKER_HEARTBEAT_KEY) == 0)
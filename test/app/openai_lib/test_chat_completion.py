@@ -1,5 +1,11 @@
+import json
 import unittest
+from unittest.mock import MagicMock, patch
 
+import fakeredis
+
+import app.lib.redis as redis_lib
+from app.lib.common import Gender
 from app.lib.name_sentiments import UserSentiments
 from app.openai_lib import chat_completion as cc
 from app.lib import name_pref as np
@@ -29,3 +35,35 @@ class TestChatCompletion(unittest.TestCase):
         )
         self.assertTrue(result == ["Madison", "Maxwell"], "the actual resul is {}".format(result))
 
+    @patch('app.openai_lib.chat_completion.client')
+    def test_propose_names_cache(self, client_mock):
+        redis_lib.redis_client = fakeredis.FakeRedis(charset="utf-8", decode_responses=True)
+        response = MagicMock()
+        response.choices[0].finish_reason = 'stop'
+        response.choices[0].message.content = json.dumps({'names': ['Madison', 'Maxwell']})
+        create_mock = client_mock.with_options.return_value.chat.completions.create
+        create_mock.return_value = response
+
+        prefs = {
+            np.StyleChoice.get_url_param_name(): np.StyleChoice.create('Classic'),
+            np.OtherPref.get_url_param_name(): np.OtherPref.create('Please suggest names with more than 6 letters')
+        }
+        result = cc.propose_names(Gender.GIRL, prefs, UserSentiments.create_from_dict({}), {'Emma', 'Ava'}, 2)
+        self.assertTrue(result == ['Madison', 'Maxwell'])
+
+        # the same context in another order is served from the cache
+        prefs = dict(reversed(list(prefs.items())))
+        result = cc.propose_names(Gender.GIRL, prefs, UserSentiments.create_from_dict({}), {'Ava', 'Emma'}, 2)
+        self.assertTrue(result == ['Madison', 'Maxwell'])
+        self.assertTrue(create_mock.call_count == 1)
+
+        cc.propose_names(Gender.GIRL, prefs, UserSentiments.create_from_dict({}), {'Ava'}, 2)
+        self.assertTrue(create_mock.call_count == 2)
+
+    def test_streaming_names_parser(self):
+        text = '{\n  "names": ["Madison", "Zo\\u00eb", "Ma\\"x", "Olivia"],\n  "other": ["Liam"]\n}'
+        parser = cc.StreamingNamesParser('names')
+        names = []
+        for i in range(0, len(text), 3):
+            names.extend(parser.feed(text[i:i + 3]))
+        self.assertTrue(names == ['Madison', 'Zoë', 'Ma"x', 'Olivia'], names)
@@ -0,0 +1,137 @@
+import concurrent.futures
+import json
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+
+import fakeredis
+import numpy
+import openai
+
+import app.lib.redis as redis_lib
+import app.openai_lib.embedding_client as ec
+
+
+class TestEmbeddingClient(unittest.TestCase):
+    def setUp(self) -> None:
+        redis_lib.redis_bytes_client = fakeredis.FakeRedis()
+        ec.get_embedding.cache_clear()
+
+    @patch('app.openai_lib.embedding_client.fetch_embedding')
+    def test_embedding_cache(self, fetch_embedding_mock):
+        fetch_embedding_mock.return_value = [0.1, 0.2, 0.3]
+
+        embedding = ec.create_single_embedding('I like French names')
+        self.assertTrue(embedding.dtype == numpy.float32)
+        self.assertTrue(numpy.allclose(embedding, [0.1, 0.2, 0.3]))
+        # served from the in-process cache
+        ec.create_single_embedding('I like French names')
+        self.assertTrue(fetch_embedding_mock.call_count == 1)
+
+        # served from Redis after the process restarts
+        ec.get_embedding.cache_clear()
+        embedding = ec.create_single_embedding('I like French names')
+        self.assertTrue(fetch_embedding_mock.call_count == 1)
+        self.assertTrue(numpy.allclose(embedding, [0.1, 0.2, 0.3]))
+
+        ec.create_single_embedding('I like Italian names')
+        self.assertTrue(fetch_embedding_mock.call_count == 2)
+        self.assertTrue(len(redis_lib.redis_bytes_client.keys('embedding-*')) == 2)
+
+
+class StubEmbeddingHandler(BaseHTTPRequestHandler):
+    """
+    a local stub of the embeddings API, which returns [len(text), index] as the embedding of each text; the responses
+    are held until the released event is set, if any
+    """
+    requests = []
+    released = None
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        StubEmbeddingHandler.requests.append(body['input'])
+        time.sleep(0.05)
+        if StubEmbeddingHandler.released is not None:
+            StubEmbeddingHandler.released.wait(timeout=5)
+
+        data = [{'object': 'embedding', 'index': i, 'embedding': [float(len(text)), float(i)]}
+                for i, text in enumerate(body['input'])]
+        output = json.dumps({'object': 'list', 'data': data, 'model': body['model'],
+                             'usage': {'prompt_tokens': 1, 'total_tokens': 1}}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(output)))
+        self.end_headers()
+        self.wfile.write(output)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestEmbeddingBatcher(unittest.TestCase):
+    def setUp(self) -> None:
+        StubEmbeddingHandler.requests = []
+        StubEmbeddingHandler.released = None
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubEmbeddingHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.client = openai.OpenAI(api_key='test', base_url='http://127.0.0.1:{}/v1'.format(self.server.server_port))
+
+    def tearDown(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_coalesce_requests(self):
+        batcher = ec.EmbeddingBatcher(self.client, max_wait_ms=100)
+        texts = ['name' * (i % 6 + 1) for i in range(12)]
+        with ThreadPoolExecutor(max_workers=len(texts)) as executor:
+            embeddings = list(executor.map(lambda x: batcher.embed(ec.EMBEDDING_MODEL, x), texts))
+
+        self.assertTrue([x[0] for x in embeddings] == [len(x) for x in texts])
+        # the concurrent calls are sent in fewer requests, without duplicated texts
+        self.assertTrue(len(StubEmbeddingHandler.requests) < len(texts), StubEmbeddingHandler.requests)
+        self.assertTrue(sum(len(x) for x in StubEmbeddingHandler.requests) < len(texts))
+
+    def test_failed_request(self):
+        # nothing is listening on the port of a closed server
+        server = ThreadingHTTPServer(('127.0.0.1', 0), StubEmbeddingHandler)
+        server.server_close()
+        openai_client = openai.OpenAI(api_key='test', base_url='http://127.0.0.1:{}/v1'.format(server.server_port))
+
+        batcher = ec.EmbeddingBatcher(openai_client)
+        with self.assertRaises(openai.APIConnectionError):
+            batcher.embed(ec.EMBEDDING_MODEL, 'name')
+
+    def test_cancelled_requests(self):
+        batcher = ec.EmbeddingBatcher(self.client, max_wait_ms=200)
+        # the caller stops waiting before the batch is sent, so its text is not sent
+        with self.assertRaises(concurrent.futures.TimeoutError):
+            batcher.embed(ec.EMBEDDING_MODEL, 'Liam', timeout=0.01)
+        self.assertTrue(batcher.embed(ec.EMBEDDING_MODEL, 'Noah')[0] == 4)
+        self.assertTrue(StubEmbeddingHandler.requests == [['Noah']], StubEmbeddingHandler.requests)
+
+    def test_full_queue(self):
+        StubEmbeddingHandler.released = threading.Event()
+        self.addCleanup(StubEmbeddingHandler.released.set)
+        batcher = ec.EmbeddingBatcher(self.client, max_wait_ms=1, max_concurrency=1, max_pending=2)
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            first_future = executor.submit(batcher.embed, ec.EMBEDDING_MODEL, 'Liam')
+            while not StubEmbeddingHandler.requests:
+                time.sleep(0.01)
+
+            # the only sender is busy, so the texts wait in the queue until it is full
+            for text in ['Noah', 'Oliver']:
+                with self.assertRaises(concurrent.futures.TimeoutError):
+                    batcher.embed(ec.EMBEDDING_MODEL, text, timeout=0.05)
+            with self.assertRaises(ec.EmbeddingQueueFull):
+                batcher.embed(ec.EMBEDDING_MODEL, 'James')
+
+            StubEmbeddingHandler.released.set()
+            self.assertTrue(first_future.result()[0] == 4)
+
+        # the texts of the callers which stopped waiting are not sent
+        self.assertTrue(batcher.embed(ec.EMBEDDING_MODEL, 'Henry')[0] == 5)
+        self.assertTrue(StubEmbeddingHandler.requests == [['Liam'], ['Henry']], StubEmbeddingHandler.requests)
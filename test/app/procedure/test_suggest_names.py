@@ -1,14 +1,21 @@
+import asyncio
+import concurrent.futures
 import json
 import logging
 import os
+import time
 import unittest
 from unittest.mock import patch, MagicMock
 
 import fakeredis
+import fakeredis.aioredis
+from werkzeug.exceptions import ServiceUnavailable
 
 import app.lib.redis as redis_lib
+import app.lib.redis_async as redis_async
 import app.procedure.suggest_names as sn
 import app.procedure.name_proposer as n_proposer
+import app.openai_lib.embedding_client as ec
 import app.lib.name_pref as np
 from app.lib.common import Gender
 from test.test_lib import get_test_root_dir
@@ -18,7 +25,10 @@ from app.lib.name_sentiments import UserSentiments
 class TestSuggestNames(unittest.TestCase):
     def setUp(self) -> None:
         logging.getLogger().setLevel(logging.DEBUG)
-        redis_lib.redis_client = fakeredis.FakeRedis(charset="utf-8", decode_responses=True)
+        self.redis_server = fakeredis.FakeServer()
+        redis_lib.redis_client = fakeredis.FakeRedis(server=self.redis_server, charset="utf-8", decode_responses=True)
+        redis_lib.redis_bytes_client = fakeredis.FakeRedis()
+        ec.get_embedding.cache_clear()
 
     def test_suggest_names_no_pref(self):
         names = sn.suggest_names_using_facts('12345', Gender.BOY)
@@ -190,3 +200,118 @@ class TestSuggestNames(unittest.TestCase):
         self.assertTrue(all(x > 0.7 for x in name_scores.values()),
                         'The  similarity score is less than 0.6: {}'.format(name_scores))
 
+    @patch('app.openai_lib.chat_completion.client')
+    def test_stream_suggest_names(self, client_mock):
+        def create_chunk(content, finish_reason=None):
+            chunk = MagicMock()
+            chunk.choices[0].delta.content = content
+            chunk.choices[0].finish_reason = finish_reason
+            return chunk
+
+        content = json.dumps({'names': ['Madison', 'Liam', 'Maxwell', 'Madison']})
+        chunks = [create_chunk(content[i:i + 5]) for i in range(0, len(content), 5)] + [create_chunk(None, 'stop')]
+        client_mock.with_options.return_value.chat.completions.create.return_value = iter(chunks)
+
+        sibling_name = np.SiblingNames.create('["Liam"]')
+        redis_lib.update_user_pref('222333', {np.SiblingNames.get_url_param_name(): sibling_name})
+
+        names = sn.stream_suggest('222333', Gender.BOY)
+        self.assertTrue(next(names) == 'Madison')
+        # the displayed names are recorded once all names are streamed
+        self.assertTrue(redis_lib.get_displayed_names('222333') == [])
+        self.assertTrue(list(names) == ['Maxwell'])
+        self.assertTrue(sorted(redis_lib.get_displayed_names('222333')) == ['Madison', 'Maxwell'])
+
+    @patch('app.openai_lib.chat_completion.propose_names')
+    def test_suggest_names_hedged(self, propose_names_mock):
+        def slow_propose_names(*args):
+            time.sleep(0.5)
+            return ['Madison', 'Maxwell']
+        propose_names_mock.side_effect = slow_propose_names
+
+        # ChatGPT is slower than the latency budget, so the names from the local datasets are returned
+        names = sn.suggest_names_hedged('333444', Gender.BOY, latency_budget=0.1)
+        self.assertTrue(names[0] == 'Liam', names)
+        self.assertTrue('Liam' in redis_lib.get_displayed_names('333444'))
+
+        names = sn.suggest_names_hedged('444555', Gender.BOY, latency_budget=5)
+        self.assertTrue(names == ['Madison', 'Maxwell'], names)
+        self.assertTrue(sorted(redis_lib.get_displayed_names('444555')) == ['Madison', 'Maxwell'])
+
+    @patch('app.openai_lib.embedding_client.fetch_embedding')
+    @patch('app.openai_lib.chat_completion.propose_names')
+    def test_suggest_names_hedged_with_slow_openai(self, propose_names_mock, fetch_embedding_mock):
+        def slow_propose_names(*args):
+            time.sleep(1)
+            return ['Madison', 'Maxwell']
+        propose_names_mock.side_effect = slow_propose_names
+        fetch_embedding_mock.side_effect = concurrent.futures.TimeoutError()
+        redis_lib.update_user_pref('555666', {np.OtherPref.get_url_param_name(): np.OtherPref.create('a short name')})
+
+        # the names from the text preferences are skipped, rather than failing the names from the local datasets
+        names = sn.suggest_names_hedged('555666', Gender.BOY, latency_budget=0.2)
+        self.assertTrue(len(names) > 0 and 'Madison' not in names, names)
+
+        # without the names from the local datasets, ChatGPT is not awaited beyond the budget either
+        with patch('app.procedure.suggest_names.propose_names_using_facts', side_effect=ValueError('no data')):
+            start_ts = time.perf_counter()
+            with self.assertRaises(ServiceUnavailable):
+                sn.suggest_names_hedged('666777', Gender.BOY, latency_budget=0.2)
+            self.assertTrue(time.perf_counter() - start_ts < 0.8)
+
+    @patch('app.openai_lib.chat_completion.propose_names_async')
+    def test_suggest_names_hedged_async(self, propose_names_mock):
+        async def slow_propose_names(*args):
+            await asyncio.sleep(0.5)
+            return ['Madison', 'Maxwell']
+        propose_names_mock.side_effect = slow_propose_names
+        redis_async.redis_client = fakeredis.aioredis.FakeRedis(server=self.redis_server, decode_responses=True)
+
+        async def suggest_concurrently():
+            return await asyncio.gather(sn.suggest_names_hedged_async('333444', Gender.BOY, latency_budget=0.1),
+                                        sn.suggest_names_hedged_async('444555', Gender.BOY, latency_budget=5))
+
+        facts_names, gpt_names = asyncio.run(suggest_concurrently())
+        self.assertTrue(facts_names[0] == 'Liam', facts_names)
+        self.assertTrue(gpt_names == ['Madison', 'Maxwell'], gpt_names)
+        self.assertTrue('Liam' in redis_lib.get_displayed_names('333444'))
+        self.assertTrue(sorted(redis_lib.get_displayed_names('444555')) == ['Madison', 'Maxwell'])
+
+    @patch('app.openai_lib.chat_completion.propose_names_async')
+    def test_suggest_names_hedged_async_with_busy_executor(self, propose_names_mock):
+        async def slow_propose_names(*args):
+            await asyncio.sleep(1)
+            return ['Madison', 'Maxwell']
+        propose_names_mock.side_effect = slow_propose_names
+        redis_async.redis_client = fakeredis.aioredis.FakeRedis(server=self.redis_server, decode_responses=True)
+
+        def slow_propose_names_using_facts(*args, **kwargs):
+            time.sleep(0.5)
+            return n_proposer.ProposedNames(), ['Liam']
+
+        async def suggest_concurrently():
+            return await asyncio.gather(*[sn.suggest_names_hedged_async('333444', Gender.BOY, latency_budget=0.2)
+                                          for _ in range(sn.FACTS_EXECUTOR_THREADS * 2)], return_exceptions=True)
+
+        # the requests queued behind the busy threads do not wait beyond the budget
+        with patch('app.procedure.suggest_names.propose_names_using_facts', side_effect=slow_propose_names_using_facts):
+            start_ts = time.perf_counter()
+            results = asyncio.run(suggest_concurrently())
+            self.assertTrue(time.perf_counter() - start_ts < 0.45)
+        self.assertTrue(all(isinstance(x, ServiceUnavailable) for x in results), results)
+
+    @patch('app.openai_lib.chat_completion.propose_names_async')
+    def test_suggest_names_hedged_async_concurrency(self, propose_names_mock):
+        async def slow_propose_names(*args):
+            await asyncio.sleep(0.2)
+            return ['Madison', 'Maxwell']
+        propose_names_mock.side_effect = slow_propose_names
+        redis_async.redis_client = fakeredis.aioredis.FakeRedis(server=self.redis_server, decode_responses=True)
+
+        async def suggest_concurrently():
+            return await asyncio.gather(*[sn.suggest_names_hedged_async(str(100000 + i), Gender.BOY, latency_budget=5)
+                                          for i in range(sn.MAX_PENDING_GPT_REQUESTS * 2)])
+
+        # the async path is not limited by the pending requests of GPT_EXECUTOR
+        results = asyncio.run(suggest_concurrently())
+        self.assertTrue(all(x == ['Madison', 'Maxwell'] for x in results), results)
@@ -0,0 +1,116 @@
+import asyncio
+import json
+import threading
+import time
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import fakeredis
+import fakeredis.aioredis
+
+import app.lib.redis as redis_lib
+import app.lib.redis_async as redis_async
+from app.lib import session_id as sid
+import app.asgi as asgi
+
+
+def call_asgi(path: str, query_string: str):
+    """
+    :return: the status and the decoded json body of a GET request to the ASGI app
+    """
+    status, body = asyncio.run(request_asgi(path, query_string))
+    return status, json.loads(body)
+
+
+async def request_asgi(path: str, query_string: str):
+    """
+    :return: the status and the body of a GET request to the ASGI app
+    """
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {'type': 'http', 'method': 'GET', 'path': path, 'query_string': query_string.encode('latin-1'),
+             'headers': [], 'http_version': '1.1', 'scheme': 'http', 'server': ('127.0.0.1', 8080),
+             'root_path': ''}
+    await asgi.app(scope, receive, send)
+    body = b''.join(x.get('body', b'') for x in messages if x['type'] == 'http.response.body')
+    return messages[0]['status'], body
+
+
+class TestAsgi(unittest.TestCase):
+    def setUp(self) -> None:
+        server = fakeredis.FakeServer()
+        redis_lib.redis_client = fakeredis.FakeRedis(server=server, decode_responses=True)
+        redis_async.redis_client = fakeredis.aioredis.FakeRedis(server=server, decode_responses=True)
+        self.session_id = sid.get_session_id(1234567)
+
+    @patch('app.procedure.suggest_names.GPT_LATENCY_BUDGET_SECONDS', 0)
+    @patch('app.openai_lib.chat_completion.async_client')
+    def test_suggest(self, client_mock):
+        response = MagicMock()
+        response.choices[0].finish_reason = 'stop'
+        response.choices[0].message.content = json.dumps({'names': ['Madison', 'Maxwell']})
+        client_mock.with_options.return_value.chat.completions.create = AsyncMock(return_value=response)
+
+        status, output = call_asgi('/babyname/suggest',
+                                   'session_id={}&gender=girl&style_option=Classic'.format(self.session_id))
+        self.assertTrue(status == 200, output)
+        self.assertTrue(output == {'suggested_names': ['Madison', 'Maxwell'], 'page_no': 0}, output)
+
+        # the data written by the async path is read by the Flask endpoints
+        self.assertTrue(sorted(redis_lib.get_displayed_names(self.session_id)) == ['Madison', 'Maxwell'])
+        status, output = call_asgi('/babyname/get_user_pref', 'session_id={}'.format(self.session_id))
+        self.assertTrue(status == 200 and output['style_option'] == 'Classic', output)
+
+    def test_invalid_session_id(self):
+        status, output = call_asgi('/babyname/suggest', 'session_id=12345678&gender=girl')
+        self.assertTrue(status == 400, output)
+
+    @patch('app.openai_lib.chat_completion.async_client')
+    def test_suggest_stream(self, client_mock):
+        async def create_stream():
+            content = json.dumps({'names': ['Madison', 'Maxwell', 'Madison']})
+            for i in range(0, len(content), 5):
+                chunk = MagicMock()
+                chunk.choices[0].delta.content = content[i:i + 5]
+                chunk.choices[0].finish_reason = None
+                yield chunk
+            chunk = MagicMock()
+            chunk.choices[0].delta.content = None
+            chunk.choices[0].finish_reason = 'stop'
+            yield chunk
+        client_mock.with_options.return_value.chat.completions.create = AsyncMock(return_value=create_stream())
+
+        status, body = asyncio.run(request_asgi('/babyname/suggest_stream',
+                                                'session_id={}&gender=girl'.format(self.session_id)))
+        self.assertTrue(status == 200, body)
+        events = body.decode('utf-8').strip().split('\n\n')
+        self.assertTrue(events[:2] == ['event: name\ndata: {"name": "Madison"}',
+                                       'event: name\ndata: {"name": "Maxwell"}'], events)
+        self.assertTrue(events[2].startswith('event: done'), events)
+        self.assertTrue(sorted(redis_lib.get_displayed_names(self.session_id)) == ['Madison', 'Maxwell'])
+
+    def test_concurrent_flask_requests(self):
+        thread_names = set()
+
+        def slow_get_user_pref(session_id):
+            thread_names.add(threading.current_thread().name)
+            time.sleep(0.3)
+            return {}
+
+        async def request_concurrently():
+            path, query_string = '/babyname/get_user_pref', 'session_id={}'.format(self.session_id)
+            return await asyncio.gather(request_asgi(path, query_string), request_asgi(path, query_string))
+
+        # the Flask endpoints are served in a thread pool, rather than one after another in a single thread
+        with patch('app.app.redis_lib.get_user_pref', side_effect=slow_get_user_pref):
+            start_ts = time.perf_counter()
+            responses = asyncio.run(request_concurrently())
+            self.assertTrue(time.perf_counter() - start_ts < 0.5)
+        self.assertTrue(all(x[0] == 200 for x in responses), responses)
+        self.assertTrue(len(thread_names) == 2, thread_names)
@@ -0,0 +1,157 @@
+import asyncio
+import json
+import time
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import fakeredis
+import fakeredis.aioredis
+
+import app.lib.name_pref as np
+import app.lib.redis as redis_lib
+import app.lib.redis_async as redis_async
+from app.lib.common import Gender
+import worker.proposal_completion_worker as pcw
+
+
+class TestRequestLimiter(unittest.TestCase):
+    def test_concurrent_requests(self):
+        limiter = pcw.RequestLimiter(max_concurrent_requests=2, max_tokens_per_minute=0)
+        active_counts = [0]
+        max_active_counts = [0]
+
+        async def send_request():
+            async with limiter.limit(100):
+                active_counts[0] += 1
+                max_active_counts[0] = max(max_active_counts[0], active_counts[0])
+                await asyncio.sleep(0.01)
+                active_counts[0] -= 1
+
+        async def run():
+            await asyncio.gather(*[send_request() for _ in range(6)])
+
+        asyncio.run(run())
+        self.assertTrue(max_active_counts[0] == 2, max_active_counts)
+
+    def test_tokens_per_minute(self):
+        limiter = pcw.RequestLimiter(max_concurrent_requests=10, max_tokens_per_minute=100, window_seconds=0.2)
+
+        async def send_request(estimated_tokens, used_tokens):
+            async with limiter.limit(estimated_tokens) as reservation:
+                limiter.record_usage(reservation, used_tokens)
+                return time.monotonic()
+
+        async def run():
+            start_ts = time.monotonic()
+            # the over-estimated reservation is corrected, so the second request is sent at once
+            await send_request(90, 40)
+            second_ts = await send_request(60, 60)
+            self.assertTrue(limiter.used_tokens == 100)
+            # the third request waits for the window to pass
+            third_ts = await send_request(30, 30)
+            return second_ts - start_ts, third_ts - start_ts
+
+        second_elapse, third_elapse = asyncio.run(run())
+        self.assertTrue(second_elapse < 0.1, second_elapse)
+        self.assertTrue(third_elapse >= 0.2, third_elapse)
+        self.assertTrue(limiter.used_tokens == 30)
+
+
+class TestHandleJob(unittest.TestCase):
+    def setUp(self) -> None:
+        server = fakeredis.FakeServer()
+        redis_lib.redis_client = fakeredis.FakeRedis(server=server, decode_responses=True)
+        redis_async.redis_client = fakeredis.aioredis.FakeRedis(server=server, decode_responses=True)
+        for session_id in ['s1', 's2']:
+            redis_lib.update_user_pref(session_id, {
+                np.GenderPref.get_url_param_name(): np.GenderPref.create(Gender.BOY),
+                np.StyleChoice.get_url_param_name(): np.StyleChoice.create('Classic')
+            })
+
+    @patch('worker.proposal_completion_worker.count_tokens', lambda x: len(x) // 4)
+    @patch('worker.proposal_completion_worker.client')
+    def test_shared_reasons(self, client_mock):
+        def create_response(**kwargs):
+            names = kwargs['messages'][0]['content'].split('The list of names: ')[1].split('.')[0].split(', ')
+            response = MagicMock()
+            response.choices[0].finish_reason = 'stop'
+            response.choices[0].message.content = json.dumps({x: 'A reason of {}'.format(x) for x in names})
+            response.usage.total_tokens = 100
+            return response
+        client_mock.chat.completions.create = AsyncMock(side_effect=create_response)
+
+        async def run():
+            request_limiter = pcw.RequestLimiter(max_concurrent_requests=2, max_tokens_per_minute=0)
+            await pcw.handle_job(redis_lib.create_job_string('s1', ['Liam', 'Noah', 'Oliver', 'James']),
+                                 request_limiter)
+            # the same user context as s1
+            await pcw.handle_job(redis_lib.create_job_string('s2', ['Liam', 'Noah', 'Henry']), request_limiter)
+
+        asyncio.run(run())
+        # only Henry is not generated for s1
+        self.assertTrue(client_mock.chat.completions.create.call_count == 3)
+        self.assertTrue(redis_lib.get_proposal_reasons('s2') ==
+                        {x: 'A reason of {}'.format(x) for x in ['Liam', 'Noah', 'Henry']})
+
+    @patch('worker.proposal_completion_worker.count_tokens', lambda x: len(x) // 4)
+    @patch('worker.proposal_completion_worker.client')
+    def test_overlapping_jobs(self, client_mock):
+        requested_names = []
+
+        async def create_response(**kwargs):
+            names = kwargs['messages'][0]['content'].split('The list of names: ')[1].split('.')[0].split(', ')
+            requested_names.extend(names)
+            await asyncio.sleep(0.05)
+            response = MagicMock()
+            response.choices[0].finish_reason = 'stop'
+            response.choices[0].message.content = json.dumps({x: 'A reason of {}'.format(x) for x in names})
+            response.usage.total_tokens = 100
+            return response
+        client_mock.chat.completions.create = AsyncMock(side_effect=create_response)
+
+        # overlapping jobs are queued only after the pending names expire
+        redis_lib.add_recommendation_job('s1', ['Liam', 'Noah'])
+        redis_lib.redis_client.delete(redis_lib.get_pending_reason_names_key('s1'))
+        redis_lib.add_recommendation_job('s1', ['Noah', 'Oliver'])
+        jobs = redis_lib.redis_client.lrange(redis_lib.PROPOSAL_REASON_JOB_QUEUE_KEY, 0, -1)
+
+        async def run():
+            request_limiter = pcw.RequestLimiter(max_concurrent_requests=2, max_tokens_per_minute=0)
+            await asyncio.gather(*[pcw.handle_job(x, request_limiter) for x in jobs])
+
+        asyncio.run(run())
+        # Noah, which is in both jobs, is generated once
+        self.assertTrue(sorted(requested_names) == ['Liam', 'Noah', 'Oliver'], requested_names)
+        self.assertTrue(sorted(redis_lib.get_proposal_reasons('s1').keys()) == ['Liam', 'Noah', 'Oliver'])
+        self.assertTrue(not redis_lib.redis_client.exists(redis_lib.get_pending_reason_names_key('s1')))
+        self.assertTrue(pcw.names_in_flight == {})
+
+    @patch('worker.proposal_completion_worker.count_tokens', lambda x: len(x) // 4)
+    @patch('worker.proposal_completion_worker.client')
+    def test_overlapping_jobs_with_failure(self, client_mock):
+        requested_names = []
+
+        async def create_response(**kwargs):
+            names = kwargs['messages'][0]['content'].split('The list of names: ')[1].split('.')[0].split(', ')
+            requested_names.append(names)
+            is_first_request = len(requested_names) == 1
+            await asyncio.sleep(0.05)
+            if is_first_request:
+                raise RuntimeError('Request timed out')
+            response = MagicMock()
+            response.choices[0].finish_reason = 'stop'
+            response.choices[0].message.content = json.dumps({x: 'A reason of {}'.format(x) for x in names})
+            response.usage.total_tokens = 100
+            return response
+        client_mock.chat.completions.create = AsyncMock(side_effect=create_response)
+
+        async def run():
+            request_limiter = pcw.RequestLimiter(max_concurrent_requests=2, max_tokens_per_minute=0)
+            await asyncio.gather(pcw.handle_job(redis_lib.create_job_string('s1', ['Liam', 'Noah']), request_limiter),
+                                 pcw.handle_job(redis_lib.create_job_string('s1', ['Noah', 'Oliver']), request_limiter))
+
+        asyncio.run(run())
+        # the second job waits for Noah of the first job, and generates it once the first job failed
+        self.assertTrue(requested_names == [['Liam', 'Noah'], ['Oliver'], ['Noah']], requested_names)
+        self.assertTrue(sorted(redis_lib.get_proposal_reasons('s1').keys()) == ['Noah', 'Oliver'])
+        self.assertTrue(pcw.names_in_flight == {})
@@ -0,0 +1,71 @@
+"""
+Measure the recall@k and the search latency of the approximate index types of FaissSearch against the exact
+flat index, with the embeddings of the indexed names as queries (as FaissSearch.similar_names() does).
+
+python -m tools.benchmark_faiss_index [boy|girl] [number of queries]
+"""
+import logging
+import sys
+import time
+
+import faiss
+import numpy as np
+
+from app.lib.common import Gender, canonicalize_gender
+import app.lib.embedding_search as es
+
+
+def search(embedding_index: faiss.Index, queries: np.ndarray, k: int):
+    """
+    :return: the result rows of each query, and the average latency of a single query in milliseconds
+    """
+    start_ts = time.perf_counter()
+    indices = [embedding_index.search(query.reshape(1, -1), k)[1][0] for query in queries]
+    latency = (time.perf_counter() - start_ts) * 1000 / len(queries)
+    return np.asarray(indices), latency
+
+
+def recall_at_k(expected: np.ndarray, actual: np.ndarray) -> float:
+    hits = sum(len(set(x[x >= 0]) & set(y[y >= 0])) for x, y in zip(expected, actual))
+    return hits / float(expected.size)
+
+
+def benchmark(gender: Gender, num_queries=500, k_list=(10, 100), index_types=es.INDEX_TYPES):
+    name_embedding_list = es.FaissSearch.load_file(gender)
+
+    rng = np.random.default_rng(0)
+    query_rows = rng.choice(len(name_embedding_list), size=min(num_queries, len(name_embedding_list)), replace=False)
+    queries = np.asarray([name_embedding_list[row]['embedding'] for row in query_rows], dtype=np.float32)
+    faiss.normalize_L2(queries)
+
+    _, flat_index = es.FaissSearch.create_index(name_embedding_list, 'flat')
+    expected = {k: search(flat_index, queries, k)[0] for k in k_list}
+
+    result = {}
+    for index_type in index_types:
+        start_ts = time.perf_counter()
+        _, embedding_index = es.FaissSearch.create_index(name_embedding_list, index_type)
+        build_time = time.perf_counter() - start_ts
+
+        type_result = {
+            'build_seconds': round(build_time, 2),
+            'index_bytes': len(faiss.serialize_index(embedding_index))
+        }
+        for k in k_list:
+            indices, latency = search(embedding_index, queries, k)
+            type_result['recall@{}'.format(k)] = round(recall_at_k(expected[k], indices), 4)
+            type_result['latency_ms@{}'.format(k)] = round(latency, 3)
+        result[index_type] = type_result
+
+        logging.info('{} index of {} names: {}'.format(index_type, embedding_index.ntotal, type_result))
+
+    return result
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    arg_gender = canonicalize_gender(sys.argv[1]) if len(sys.argv) > 1 else Gender.GIRL
+    arg_num_queries = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+
+    for name, stats in benchmark(arg_gender, arg_num_queries).items():
+        print('{:>6}: {}'.format(name, stats))
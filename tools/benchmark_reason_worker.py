@@ -0,0 +1,113 @@
+"""
+Benchmark of the jobs per second of the proposal reason worker, with a stub of the OpenAI client which responds after
+a fixed delay, so the time is spent on the scheduling of the jobs and on Redis.
+
+    REDISHOST=127.0.0.1 REDISPORT=6379 python -m tools.benchmark_reason_worker --jobs 500 --delay 0.2
+
+The benchmark writes the sessions of the jobs to the Redis server, and deletes them at the end.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import time
+from types import SimpleNamespace
+
+import app.lib.name_pref as np
+import app.lib.redis as redis_lib
+import worker.proposal_completion_worker as pcw
+from app.lib import session_id as sid
+from app.lib.common import Gender
+from app.lib.name_sentiments import UserSentiments
+
+NAMES = ['Liam', 'Noah', 'Oliver', 'James', 'Elijah', 'William', 'Henry', 'Lucas', 'Benjamin', 'Theodore']
+
+
+class StubAsyncOpenAI:
+    """
+    the subset of openai.AsyncOpenAI used by the worker, which returns a reason for every name in the prompt
+    """
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.request_count = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    async def create(self, messages, **kwargs):
+        self.request_count += 1
+        await asyncio.sleep(self.delay)
+
+        names = messages[0]['content'].split('The list of names: ')[1].split('.\n')[0].split(', ')
+        content = json.dumps({x: 'A reason of {}'.format(x) for x in names})
+        return SimpleNamespace(choices=[SimpleNamespace(finish_reason='stop', message=SimpleNamespace(content=content))],
+                               usage=SimpleNamespace(total_tokens=100))
+
+
+def create_jobs(num_jobs: int):
+    """
+    :return: the jobs of distinct sessions, whose user contexts are distinct so they do not share reasons
+    """
+    run_id = random.randint(0, 10 ** 6)
+    jobs = []
+    for i in range(num_jobs):
+        session_id = sid.get_session_id(random.randint(10 ** 6, 10 ** 7 - 1))
+        redis_lib.update_user_pref(session_id, {
+            np.GenderPref.get_url_param_name(): np.GenderPref.create(Gender.BOY),
+            np.OtherPref.get_url_param_name(): np.OtherPref.create('benchmark {} job {}'.format(run_id, i))
+        })
+        redis_lib.update_user_sentiments(session_id, UserSentiments.create_from_dict({
+            'Thomas': {'sentiment': 'liked', 'reason': 'a classic name'},
+            'Ethan': {'sentiment': 'disliked'}
+        }))
+        jobs.append(redis_lib.create_job_string(session_id, NAMES))
+    return jobs
+
+
+def delete_sessions(jobs):
+    keys = []
+    for job_str in jobs:
+        session_id = json.loads(job_str)['session_id']
+        keys += [redis_lib.get_pref_key(session_id), redis_lib.get_user_sentiments_hash_key(session_id),
+                 redis_lib.get_user_sentiments_sset_key(session_id), redis_lib.get_recommendation_reason_key(session_id),
+                 redis_lib.get_pending_reason_names_key(session_id)]
+    redis_lib.redis_client.delete(*keys)
+
+
+async def run_jobs(jobs, max_concurrent_requests: int):
+    request_limiter = pcw.RequestLimiter(max_concurrent_requests, max_tokens_per_minute=0)
+    start_ts = time.perf_counter()
+    await asyncio.gather(*[pcw.handle_job(x, request_limiter) for x in jobs])
+    return time.perf_counter() - start_ts
+
+
+def run_benchmark(num_jobs: int, delay: float, max_concurrent_requests: int):
+    stub_client = StubAsyncOpenAI(delay)
+    pcw.client = stub_client
+
+    jobs = create_jobs(num_jobs)
+    try:
+        total_time = asyncio.run(run_jobs(jobs, max_concurrent_requests))
+        completed_jobs = sum(len(redis_lib.get_proposal_reasons(json.loads(x)['session_id'])) == len(NAMES)
+                             for x in jobs)
+    finally:
+        delete_sessions(jobs)
+
+    return {
+        'jobs': num_jobs,
+        'completed_jobs': completed_jobs,
+        'requests': stub_client.request_count,
+        'total_seconds': round(total_time, 2),
+        'jobs_per_second': round(completed_jobs / total_time, 2),
+        # the lower bound of the time, if the requests were the only wait
+        'min_seconds': round(stub_client.request_count / max_concurrent_requests * delay, 2)
+    }
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--jobs', type=int, default=500)
+    parser.add_argument('--delay', type=float, default=0.2, help='the response time of the stub in seconds')
+    parser.add_argument('--concurrency', type=int, default=200, help='the maximum number of concurrent requests')
+    args = parser.parse_args()
+    print(run_benchmark(args.jobs, args.delay, args.concurrency))
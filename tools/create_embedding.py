@@ -36,6 +36,7 @@ def create_embeddings(gender: str):
 
     result_list = []
     popular_names = ns.NAME_STATISTICS.get_popular_names(gender, count=5000)
+    rating_descriptions = prompt.create_rating_descriptions(popular_names, gender)
     for rank, name in enumerate(popular_names):
         name = canonicalize_name(name)
 
@@ -43,7 +44,7 @@ def create_embeddings(gender: str):
         rank_description = 'In terms of popularity, this name is ranked {rank} among' \
                            ' the {total} {gender} names in the last 3 years.'.format(
             rank=rank + 1, total=len(popular_names), gender=str(gender))
-        rating_description = prompt.create_rating_description(name, gender)
+        rating_description = rating_descriptions.get(name, '')
         description1 = input_dict1[gender].get(name, '')
         description2 = create_text_from_input2(input_dict2[gender].get(name, {}))
         if not rating_description and not description1 and not description2:
@@ -134,6 +135,21 @@ def write_embeddings_to_files(gender, result_list):
     """
 
 
+def convert_to_index(index_type: str = 'flat'):
+    """
+    build the float32 FAISS index files which are opened by FaissSearch with IO_FLAG_MMAP, and the neighbour
+    tables which serve FaissSearch.similar_names()
+
+    :param index_type: one of embedding_search.INDEX_TYPES; see tools/benchmark_faiss_index.py for the recall
+    of the approximate types
+    """
+    import app.lib.embedding_search as es
+
+    for gender in [Gender.BOY, Gender.GIRL]:
+        es.FaissSearch.write_index(gender, index_type)
+    es.FaissSearch.write_neighbors()
+
+
 def write_output(result_list, resp_data, name_list, gender_list):
     for i in range(len(name_list)):
         output_dict = {
@@ -255,7 +255,7 @@ def merge_results(write=False):
         gender_merged_result = merged_result[str(gender)]
 
         # merge short meaning and origin
-        for name, origin_sm in osm.ORIGIN_MEANING.__osm__[gender].items():
+        for name, origin_sm in osm.ORIGIN_MEANING.items(gender):
             origin = origin_sm.get('origin', '')
             if origin:
                 if name not in gender_merged_result:
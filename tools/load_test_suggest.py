@@ -0,0 +1,137 @@
+"""
+Load test of concurrent /babyname/suggest requests, to compare the throughput of the WSGI and the ASGI serving
+modes (see gunicorn.sh) when ChatGPT is slow.
+
+1. start a stub of the chat completions API, which responds after a fixed delay:
+    python -m tools.load_test_suggest stub --port 8090 --delay 2
+2. start the app in one of the modes against the stub, without the fallback to the facts-based suggester:
+    OPENAI_BASE_URL=http://127.0.0.1:8090/v1 GPT_LATENCY_BUDGET_SECONDS=0 \
+        gunicorn -w 5 -b 127.0.0.1:8080 app.app:app
+    OPENAI_BASE_URL=http://127.0.0.1:8090/v1 GPT_LATENCY_BUDGET_SECONDS=0 \
+        gunicorn -w 5 -k uvicorn.workers.UvicornWorker -b 127.0.0.1:8080 app.asgi:app
+3. send the requests, each with a distinct user context so they are not served by the proposed names cache:
+    python -m tools.load_test_suggest run http://127.0.0.1:8080 --concurrency 100 --requests 500
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+import numpy as np
+
+from app.lib import session_id as sid
+
+
+class StubChatCompletionHandler(BaseHTTPRequestHandler):
+    delay = 2.0
+    names = ['Madison', 'Maxwell', 'Olivia', 'Emma', 'Ava', 'Sophia', 'Isabella', 'Mia', 'Amelia', 'Harper']
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        time.sleep(StubChatCompletionHandler.delay)
+
+        output = json.dumps({
+            'id': 'chatcmpl-stub',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': body['model'],
+            'choices': [{
+                'index': 0,
+                'finish_reason': 'stop',
+                'message': {'role': 'assistant', 'content': json.dumps({'names': StubChatCompletionHandler.names})}
+            }],
+            'usage': {'prompt_tokens': 1, 'completion_tokens': 1, 'total_tokens': 2}
+        }).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(output)))
+        self.end_headers()
+        self.wfile.write(output)
+
+    def log_message(self, *args):
+        pass
+
+
+def run_stub(port: int, delay: float):
+    StubChatCompletionHandler.delay = delay
+    server = ThreadingHTTPServer(('127.0.0.1', port), StubChatCompletionHandler)
+    server.daemon_threads = True
+    logging.info('Stub chat completions API is listening on port {} with a delay of {} seconds'.format(port, delay))
+    server.serve_forever()
+
+
+async def send_requests(base_url: str, concurrency: int, num_requests: int, timeout: float):
+    """
+    :return: the latencies of the successful requests in seconds, the number of failed requests and the total time
+    """
+    queue = asyncio.Queue()
+    for i in range(num_requests):
+        queue.put_nowait(i)
+
+    latencies = []
+    failures = [0]
+    # each request has its own session and user context
+    run_id = random.randint(0, 10 ** 6)
+
+    async def worker(client: httpx.AsyncClient):
+        while not queue.empty():
+            i = queue.get_nowait()
+            params = {
+                'session_id': sid.get_session_id(random.randint(10 ** 6, 10 ** 7 - 1)),
+                'gender': 'girl',
+                'other': 'load test {} request {}'.format(run_id, i)
+            }
+            start_ts = time.perf_counter()
+            try:
+                response = await client.get('/babyname/suggest', params=params)
+                response.raise_for_status()
+                latencies.append(time.perf_counter() - start_ts)
+            except httpx.HTTPError as e:
+                logging.warning('Request {} failed: {}'.format(i, e))
+                failures[0] += 1
+
+    start_ts = time.perf_counter()
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits) as client:
+        await asyncio.gather(*[worker(client) for _ in range(concurrency)])
+    return latencies, failures[0], time.perf_counter() - start_ts
+
+
+def run_load_test(base_url: str, concurrency: int, num_requests: int, timeout: float):
+    latencies, failures, total_time = asyncio.run(send_requests(base_url, concurrency, num_requests, timeout))
+    result = {
+        'requests': num_requests,
+        'failures': failures,
+        'total_seconds': round(total_time, 2),
+        'throughput_rps': round(len(latencies) / total_time, 2)
+    }
+    if latencies:
+        for percentile in (50, 90, 99):
+            result['p{}_seconds'.format(percentile)] = round(float(np.percentile(latencies, percentile)), 3)
+    return result
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    stub_parser = subparsers.add_parser('stub', help='run a stub of the chat completions API')
+    stub_parser.add_argument('--port', type=int, default=8090)
+    stub_parser.add_argument('--delay', type=float, default=2.0, help='the response time of the stub in seconds')
+
+    run_parser = subparsers.add_parser('run', help='send concurrent suggest requests to the app')
+    run_parser.add_argument('base_url')
+    run_parser.add_argument('--concurrency', type=int, default=100)
+    run_parser.add_argument('--requests', type=int, default=500)
+    run_parser.add_argument('--timeout', type=float, default=180.0)
+
+    args = parser.parse_args()
+    if args.command == 'stub':
+        run_stub(args.port, args.delay)
+    else:
+        print(run_load_test(args.base_url, args.concurrency, args.requests, args.timeout))
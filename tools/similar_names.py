@@ -6,8 +6,7 @@ from typing import List
 
 import openai
 
-from app.lib.common import Gender, canonicalize_name, get_app_root_dir
-import app.lib.name_statistics as ns
+from app.lib.common import Gender, canonicalize_name
 import app.lib.similar_names as sn
 
 gpt_result_file_path_template = '/Users/santan/gitspace/BabyNamer/tools/tmp/similar_names_gpt_{gender}.json'
@@ -23,18 +22,14 @@ def create_similar_names():
         str(Gender.BOY): {},
         str(Gender.GIRL): {}
     }
-    for name_gender, similar_names in sn.SIMILAR_NAMES.__similar_names__.items():
-        name, gender = name_gender
-        name = canonicalize_name(name)
-        if not gender:
-            gender = ns.NAME_STATISTICS.guess_gender(name)
-
-        embedding_similar_names = es.FAISS_SEARCH.similar_names(gender, name, num_of_result=11)
-        if embedding_similar_names:
-            # the first one is always
-            result[str(gender)][name] = embedding_similar_names
-        else:
-            result[str(gender)][name] = similar_names
+    for gender in [Gender.BOY, Gender.GIRL]:
+        for name, similar_names in sn.SIMILAR_NAMES.items(gender):
+            embedding_similar_names = es.FAISS_SEARCH.similar_names(gender, name, num_of_result=11)
+            if embedding_similar_names:
+                # the first one is always
+                result[str(gender)][name] = embedding_similar_names
+            else:
+                result[str(gender)][name] = similar_names
 
     with open(embedding_output_file, 'w') as fp:
         json.dump(result, fp)
@@ -95,3 +95,12 @@ def read_output_file():
         output[(name, gender)] = trend
 
     return output
+
+
+def convert_to_snapshot():
+    """
+    build the binary snapshot which is opened by NameStatistics with numpy.memmap
+    """
+    import app.lib.name_statistics as ns
+
+    ns.NameStatistics.write_snapshot(ns.NameStatistics.load_file())